@@ -12,23 +12,78 @@ import string
 log = logging.getLogger("anaconda")
 import fileinput
 import hashlib
+from abiquo_services import waitForMySQL
+
+# Init scripts to register with chkconfig before the service plan is applied.
+SERVICES_TO_ADD = ["motd"]
+
+# The services to switch on or off for the selected Abiquo profile groups.
+# A rule applies when any of its groups is selected, or always when it has
+# no groups. Rules are applied in order, so a later rule wins over an
+# earlier one for the same service.
+SERVICE_RULES = [
+    ((), [("motd", "on"), ("iptables", "off"), ("ip6tables", "off")]),
+    (("abiquo-dhcp-relay",), [("relay-config", "on")]),
+    (("abiquo-nfs-repository",), [("nfs", "on"), ("smb", "on")]),
+    (("abiquo-remote-services",), [("dhcpd", "on")]),
+    (("abiquo-server", "abiquo-monolithic"),
+     [("rabbitmq-server", "on"), ("mysql", "on")]),
+    (("abiquo-server", "abiquo-monolithic", "abiquo-ui"), [("httpd", "on")]),
+    (("abiquo-lvm-storage-server",),
+     [("tgtd", "on"), ("abiquo-lvmiscsi", "on")]),
+    (("abiquo-server",), [("zookeeper", "off"), ("redis", "on")]),
+    (("abiquo-standalone-api",), [("zookeeper", "on")]),
+    (("abiquo-monolithic",), [("redis", "on"), ("httpd", "on"),
+                              ("dhcpd", "on")]),
+    (("abiquo-remote-services", "abiquo-public-cloud"), [("redis", "on")]),
+]
+
+def servicePlan(isGroupSelected):
+    """ Return the list of (service, state) pairs to apply.
+
+        isGroupSelected is called with a group name and tells whether the
+        group was selected. Every service appears once, with the state the
+        last matching rule asked for, in the order services were first
+        mentioned.
+    """
+    order = []
+    states = {}
+    for (groups, services) in SERVICE_RULES:
+        if groups and not filter(isGroupSelected, groups):
+            continue
+
+        for (service, state) in services:
+            if service not in states:
+                order.append(service)
+            elif states[service] != state:
+                log.info("service %s: %s overrides %s"
+                         % (service, state, states[service]))
+            states[service] = state
+
+    return [(service, states[service]) for service in order]
+
+def applyServicePlan(plan, rootPath):
+    """ Register and switch services on or off in one chroot helper. """
+    commands = [("/sbin/chkconfig", ["--add", service])
+                for service in SERVICES_TO_ADD]
+    commands.extend([("/sbin/chkconfig", [service, state])
+                     for (service, state) in plan])
+
+    rets = iutil.execBatchWithRedirect(commands,
+                                       stdout="/dev/tty5", stderr="/dev/tty5",
+                                       root=rootPath)
+    for ((command, argv), rc) in zip(commands, rets):
+        if rc:
+            log.error("chkconfig %s failed: %s" % (" ".join(argv), rc))
 
 def abiquoPostInstall(anaconda):
     log.info("Abiquo postinstall")
 
-    # Enable MOTD
+    # Enable MOTD, the service itself is part of the service plan
     iutil.execWithRedirect("/bin/chmod",
                                 ['a+x', "/etc/rc.d/init.d/motd"],
                                 stdout="/dev/tty5", stderr="/dev/tty5",
                                 root=anaconda.rootPath)
-    iutil.execWithRedirect("/sbin/chkconfig",
-                                ['--add', "motd"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-    iutil.execWithRedirect("/sbin/chkconfig",
-                                ['motd', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
 
     # Select first dev with link and change ifcfg to start on boot
     for device in anaconda.id.network.netdevices:
@@ -44,17 +99,6 @@ def abiquoPostInstall(anaconda):
                             ['lo', 'up'],
                             stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                             root=anaconda.rootPath)
-    # Disable firewall
-    iutil.execWithRedirect("/sbin/chkconfig",
-                            ['iptables', "off"],
-                            stdout="/dev/tty5", stderr="/dev/tty5",
-                            root=anaconda.rootPath)
-
-    iutil.execWithRedirect("/sbin/chkconfig",
-                            ['ip6tables', "off"],
-                            stdout="/dev/tty5", stderr="/dev/tty5",
-                            root=anaconda.rootPath)
-
     # Disable SElinux
     f = fileinput.FileInput(anaconda.rootPath + "/etc/sysconfig/selinux",inplace=1)
     for line in f:
@@ -88,10 +132,6 @@ def abiquoPostInstall(anaconda):
                             stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                             root=anaconda.rootPath)
         shutil.move(anaconda.rootPath + '/relay-config', anaconda.rootPath + '/etc/init.d/relay-config')
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['relay-config', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
     # Export NFS
     if anaconda.backend.isGroupSelected('abiquo-nfs-repository') and not \
             anaconda.backend.isGroupSelected('abiquo-monolithic'):
@@ -107,40 +147,19 @@ def abiquoPostInstall(anaconda):
         f.close()
 
     if anaconda.backend.isGroupSelected('abiquo-nfs-repository'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['nfs', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['smb', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
         if not os.path.exists(anaconda.rootPath + '/opt/vm_repository'):
             os.makedirs(anaconda.rootPath + '/opt/vm_repository')
         if not os.path.exists(anaconda.rootPath + '/opt/vm_repository/.abiquo_repository'):
             open(anaconda.rootPath + '/opt/vm_repository/.abiquo_repository', 'w').close()
 
-    if anaconda.backend.isGroupSelected('abiquo-remote-services'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['dhcpd', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-
     if anaconda.backend.isGroupSelected('abiquo-server') or \
             anaconda.backend.isGroupSelected('abiquo-monolithic'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['rabbitmq-server', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
         # start MariaDB to create the schema
         iutil.execWithRedirect("/etc/init.d/mysql",
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['mysql', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
+        waitForMySQL(anaconda.rootPath)
         schema = open(anaconda.rootPath + "/usr/share/doc/abiquo-server/database/kinton-schema.sql")
  
         # create the schema
@@ -185,54 +204,9 @@ def abiquoPostInstall(anaconda):
         if os.path.exists(anaconda.rootPath + '/etc/httpd/conf.d/welcome.conf'):
             shutil.move(anaconda.rootPath + '/etc/httpd/conf.d/welcome.conf',anaconda.rootPath + '/etc/httpd/conf.d/welcome.conf.backup')
         shutil.copy2(anaconda.rootPath + '/usr/share/doc/abiquo-ui/abiquo.conf',anaconda.rootPath + '/etc/httpd/conf.d/abiquo.conf')
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['httpd', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
 
-    if anaconda.backend.isGroupSelected('abiquo-lvm-storage-server'):
-                iutil.execWithRedirect("/sbin/chkconfig",
-                            ['tgtd', "on"],
-                            stdout="/dev/tty5", stderr="/dev/tty5",
-                            root=anaconda.rootPath)
-                iutil.execWithRedirect("/sbin/chkconfig",
-                                        ['abiquo-lvmiscsi', "on"],
-                                        stdout="/dev/tty5", stderr="/dev/tty5",
-                                        root=anaconda.rootPath)
-
-    if anaconda.backend.isGroupSelected('abiquo-server'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['zookeeper', "off"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                        root=anaconda.rootPath)
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['redis', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                        root=anaconda.rootPath)
-    if anaconda.backend.isGroupSelected('abiquo-standalone-api'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['zookeeper', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                        root=anaconda.rootPath)
-    if anaconda.backend.isGroupSelected('abiquo-monolithic'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['redis', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['httpd', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['dhcpd', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
-    if anaconda.backend.isGroupSelected('abiquo-remote-services') or \
-            anaconda.backend.isGroupSelected('abiquo-public-cloud'):
-        iutil.execWithRedirect("/sbin/chkconfig",
-                                ['redis', "on"],
-                                stdout="/dev/tty5", stderr="/dev/tty5",
-                                root=anaconda.rootPath)
+    applyServicePlan(servicePlan(anaconda.backend.isGroupSelected),
+                     anaconda.rootPath)
 
     f = open(anaconda.rootPath + '/etc/abiquo-installer', 'a')
     f.write('Installed Profiles: %s\n' %
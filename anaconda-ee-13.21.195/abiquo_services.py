@@ -0,0 +1,238 @@
+#
+# Copyright 2013 Abiquo, Inc.
+#
+# This software may be freely redistributed under the terms of the GNU
+# library public license.
+#
+# You should have received a copy of the GNU Library Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+import os
+import socket
+import time
+
+import logging
+log = logging.getLogger("anaconda")
+
+MYSQL_SOCKET = "/var/lib/mysql/mysql.sock"
+MYSQL_PORT = 3306
+REDIS_HOST = "127.0.0.1"
+REDIS_PORT = 6379
+
+# how long to wait for a service to answer, in seconds
+SERVICE_TIMEOUT = 120
+
+# delays between probes: start small since most services come up within a
+# second, then back off
+PROBE_DELAY = 0.1
+PROBE_MAX_DELAY = 2.0
+
+def _connect(address, timeout):
+    """ Return a socket connected to address, a path or a (host, port). """
+    if isinstance(address, str):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(address)
+    except:
+        s.close()
+        raise
+    return s
+
+def probeMySQL(address, timeout=2.0):
+    """ Tell whether a MySQL server at address is taking connections.
+
+        The server greets every new client with a handshake packet, or
+        with an error packet if it does not want to talk to us, so any
+        complete packet header means the server is up.
+    """
+    try:
+        s = _connect(address, timeout)
+        try:
+            return len(s.recv(5)) >= 5
+        finally:
+            s.close()
+    except (socket.error, socket.timeout):
+        return False
+
+def probeRedis(address, timeout=2.0):
+    """ Tell whether the Redis server at address answers PING.
+
+        Redis accepts connections while it loads its dataset but answers
+        -LOADING until it is done, so only +PONG counts.
+    """
+    try:
+        s = _connect(address, timeout)
+        try:
+            s.sendall("PING\r\n")
+            return s.recv(64).startswith("+PONG")
+        finally:
+            s.close()
+    except (socket.error, socket.timeout):
+        return False
+
+def waitForService(name, probe, timeout=SERVICE_TIMEOUT):
+    """ Call probe until it returns True or timeout seconds have passed.
+
+        The delay between probes doubles up to PROBE_MAX_DELAY. Return
+        whether the service became ready.
+    """
+    start = time.time()
+    delay = PROBE_DELAY
+    while True:
+        if probe():
+            log.info("%s ready after %.1f s" % (name, time.time() - start))
+            return True
+
+        remaining = start + timeout - time.time()
+        if remaining <= 0:
+            log.error("%s not ready after %d s" % (name, timeout))
+            return False
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, PROBE_MAX_DELAY)
+
+def waitForMySQL(rootPath, timeout=SERVICE_TIMEOUT):
+    """ Wait for the MySQL server of the installed system to start.
+
+        The unix socket is tried first, then the TCP port.
+    """
+    sockpath = rootPath + MYSQL_SOCKET
+
+    def probe():
+        if os.path.exists(sockpath) and probeMySQL(sockpath):
+            return True
+        return probeMySQL(("127.0.0.1", MYSQL_PORT))
+
+    return waitForService("MySQL", probe, timeout=timeout)
+
+def waitForRedis(host=REDIS_HOST, port=REDIS_PORT, timeout=SERVICE_TIMEOUT):
+    """ Wait for the Redis server at host:port to answer PING. """
+    return waitForService("Redis", lambda: probeRedis((host, port)),
+                          timeout=timeout)
+
+class RedisError(Exception):
+    pass
+
+class RedisConnection(object):
+    """ A minimal Redis client speaking the protocol over a socket.
+
+        Commands can be pipelined: all of them are sent at once and then
+        all the replies are read, which saves a round trip per command.
+    """
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT, timeout=60):
+        self.sock = socket.create_connection((host, port), timeout)
+        self._file = self.sock.makefile("rb")
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def _encode(self, args):
+        buf = ["*%d\r\n" % len(args)]
+        for arg in args:
+            arg = str(arg)
+            buf.append("$%d\r\n%s\r\n" % (len(arg), arg))
+        return "".join(buf)
+
+    def _readReply(self):
+        """ Read one reply; error replies are returned as RedisError. """
+        line = self._file.readline()
+        if not line.endswith("\r\n"):
+            raise RedisError("connection closed")
+
+        (kind, data) = (line[0], line[1:-2])
+        if kind == "+":
+            return data
+        elif kind == "-":
+            return RedisError(data)
+        elif kind == ":":
+            return int(data)
+        elif kind == "$":
+            if int(data) < 0:
+                return None
+            return self._file.read(int(data) + 2)[:-2]
+        elif kind == "*":
+            if int(data) < 0:
+                return None
+            return [self._readReply() for i in range(int(data))]
+
+        raise RedisError("unknown reply: %r" % line)
+
+    def execute(self, *args):
+        """ Run a command and return its reply. """
+        self.sock.sendall(self._encode(args))
+        reply = self._readReply()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands):
+        """ Run a list of commands, each a tuple of arguments.
+
+            Return the list of replies, with RedisError instances for the
+            commands that failed.
+        """
+        if not commands:
+            return []
+        self.sock.sendall("".join([self._encode(c) for c in commands]))
+        return [self._readReply() for c in commands]
+
+def scanKeys(conn, pattern, batch=1000):
+    """ Generate lists of keys matching pattern.
+
+        SCAN walks the keyspace a batch at a time without blocking the
+        server. Servers older than 2.8 do not have it; for those all the
+        keys are fetched with KEYS and handed out in batches.
+    """
+    seen = set()
+    try:
+        cursor = "0"
+        while True:
+            (cursor, keys) = conn.execute("SCAN", cursor, "MATCH", pattern,
+                                          "COUNT", batch)
+            # SCAN may return a key more than once
+            keys = [k for k in keys if k not in seen]
+            seen.update(keys)
+            if keys:
+                yield keys
+            if cursor == "0":
+                return
+    except RedisError as e:
+        if seen:
+            raise
+        log.info("SCAN not available (%s), using KEYS" % e)
+
+    keys = conn.execute("KEYS", pattern)
+    for i in range(0, len(keys), batch):
+        yield keys[i:i + batch]
+
+def updateHashField(conn, pattern, field, old, new, batch=1000):
+    """ Set field to new in the hashes matching pattern where it is old.
+
+        Keys that do not hold a hash are skipped. Return a tuple of the
+        number of keys looked at and the number of keys updated.
+    """
+    start = time.time()
+    scanned = updated = 0
+    for keys in scanKeys(conn, pattern, batch=batch):
+        values = conn.pipeline([("HGET", key, field) for key in keys])
+        matches = [key for (key, value) in zip(keys, values) if value == old]
+        replies = conn.pipeline([("HSET", key, field, new) for key in matches])
+        for (key, reply) in zip(matches, replies):
+            if isinstance(reply, RedisError):
+                log.error("updating %s failed: %s" % (key, reply))
+            else:
+                log.debug("%s %s updated" % (key, field))
+                updated += 1
+        scanned += len(keys)
+
+    elapsed = time.time() - start
+    log.info("%s: %d keys scanned, %d updated in %.1f s (%.0f keys/s)"
+             % (pattern, scanned, updated, elapsed,
+                scanned / max(elapsed, 0.001)))
+    return (scanned, updated)
@@ -3,6 +3,7 @@ import iutil
 import shutil
 import logging
 import ConfigParser
+from abiquo_services import waitForMySQL
 
 log = logging.getLogger("anaconda")
 
@@ -43,6 +44,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
+        waitForMySQL(anaconda.rootPath)
 
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
@@ -70,6 +72,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
+        waitForMySQL(anaconda.rootPath)
 
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
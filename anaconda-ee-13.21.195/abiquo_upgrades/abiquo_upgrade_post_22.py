@@ -3,6 +3,7 @@ import iutil
 import shutil
 import logging
 import ConfigParser
+from abiquo_services import waitForMySQL, waitForRedis
 
 log = logging.getLogger("anaconda")
 
@@ -52,6 +53,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
+        waitForMySQL(anaconda.rootPath)
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
                                 stdin=schema,
@@ -67,6 +69,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
+        waitForRedis(port=redis_port)
         iutil.execWithRedirect("/usr/bin/redis-cli",
                                 ['-h', 'localhost', '-p', redis_sport ,"PING"],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
@@ -3,6 +3,7 @@ import iutil
 import shutil
 import logging
 import ConfigParser
+from abiquo_services import waitForMySQL
 
 log = logging.getLogger("anaconda")
 
@@ -48,6 +49,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
+        waitForMySQL(anaconda.rootPath)
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
                                 stdin=schema,
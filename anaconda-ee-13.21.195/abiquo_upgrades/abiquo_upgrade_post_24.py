@@ -3,9 +3,10 @@ import iutil
 import shutil
 import logging
 import ConfigParser
-import time
 import re
-from subprocess import *
+import socket
+from abiquo_services import waitForMySQL, waitForRedis, RedisConnection, \
+                            RedisError, updateHashField
 
 log = logging.getLogger("anaconda")
 
@@ -19,7 +20,6 @@ def abiquo_upgrade_post(anaconda):
     xen_kernel = '/xen.gz-3.4.2'
 
     redis_port = 6379
-    redis_sport = str(redis_port)
     redis_host = '127.0.0.1'
 
     log.info("ABIQUO: Post install steps")
@@ -59,7 +59,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
-        time.sleep(6)
+        waitForMySQL(anaconda.rootPath)
         schema = open(schema_path)
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
@@ -78,41 +78,22 @@ def abiquo_upgrade_post(anaconda):
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
         # Wait for start
-        time.sleep(3)
-        log.info("ABIQUO: Updating redis ...")
-        iutil.execWithRedirect("/usr/bin/redis-cli",
-                                ['-h', redis_host, '-p', redis_sport ,"PING"],
-                                stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
-                                root=anaconda.rootPath) 
-        # Update tasks
-        cmd = iutil.execWithRedirect("/usr/bin/redis-cli",
-                                ['-h', redis_host, '-p', redis_sport ,'keys','Task:*'],
-                                stdout="/mnt/sysimage/tmp/redis_tasks", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
-                                root=anaconda.rootPath)
-        for task in open('/mnt/sysimage/tmp/redis_tasks','r').readlines() :
-            task = task.strip()
-            tasktype = Popen(["redis-cli", "-h", redis_host, "-p", redis_sport, "hget", task, "type"], stdout=PIPE).communicate()[0].strip()
-            if 'SNAPSHOT' == tasktype:
-                iutil.execWithRedirect("/usr/bin/redis-cli",
-                                    ["-h", redis_host, "-p", redis_sport ,"hset",task,"type","INSTANCE"],
-                                    stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
-                                    root=anaconda.rootPath)
-                log.info("ABIQUO: Task "+task+" updated.")
-
-        # Update jobs
-        cmd = iutil.execWithRedirect("/usr/bin/redis-cli",
-                                ['-h', redis_host, '-p', redis_sport ,'keys','Job:*'],
-                                stdout="/mnt/sysimage/tmp/redis_jobs", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
-                                root=anaconda.rootPath)
-        for job in open('/mnt/sysimage/tmp/redis_jobs','r').readlines() :
-            job = job.strip()
-            jobtype = Popen(["redis-cli", "-h", redis_host, "-p", redis_sport, "hget", job, "type"], stdout=PIPE).communicate()[0].strip()
-            if 'SNAPSHOT' == jobtype:
-                iutil.execWithRedirect("/usr/bin/redis-cli",
-                                    ["-h", redis_host, "-p", redis_sport ,"hset",job,"type","INSTANCE"],
-                                    stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="//mnt/sysimage/var/log/abiquo-postinst.log",
-                                    root=anaconda.rootPath)
-                log.info("ABIQUO: Job "+job+" updated.")
+        if waitForRedis(redis_host, redis_port):
+            log.info("ABIQUO: Updating redis ...")
+            try:
+                conn = RedisConnection(redis_host, redis_port)
+                try:
+                    # Update tasks and jobs
+                    updateHashField(conn, "Task:*", "type", "SNAPSHOT",
+                                    "INSTANCE")
+                    updateHashField(conn, "Job:*", "type", "SNAPSHOT",
+                                    "INSTANCE")
+                finally:
+                    conn.close()
+            except (socket.error, RedisError), e:
+                log.error("ABIQUO: Updating redis failed: %s" % e)
+        else:
+            log.error("ABIQUO: Redis did not start, not updating it")
 
 
     if os.path.exists(xen_path):
@@ -3,9 +3,9 @@ import iutil
 import shutil
 import logging
 import ConfigParser
-import time
 import re
 from subprocess import *
+from abiquo_services import waitForMySQL, waitForRedis
 
 log = logging.getLogger("anaconda")
 
@@ -55,7 +55,7 @@ def abiquo_upgrade_post(anaconda):
                                 ['start'],
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log",stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
-        time.sleep(6)
+        waitForMySQL(anaconda.rootPath)
         schema = open(schema_path)
         iutil.execWithRedirect("/usr/bin/mysql",
                                 ['kinton'],
@@ -74,7 +74,7 @@ def abiquo_upgrade_post(anaconda):
                                 stdout="/mnt/sysimage/var/log/abiquo-postinst.log", stderr="/mnt/sysimage/var/log/abiquo-postinst.log",
                                 root=anaconda.rootPath)
         # Wait for start
-        time.sleep(3)
+        waitForRedis()
         log.info("ABIQUO: Updating redis ...")
         iutil.execWithRedirect("/usr/bin/python",
                                 [redis_path],
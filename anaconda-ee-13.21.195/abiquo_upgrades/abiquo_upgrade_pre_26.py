@@ -3,7 +3,6 @@ import shutil
 import glob
 import os
 import iutil
-import time
 import sys
 import os.path
 
@@ -50,8 +49,6 @@ def abiquo_upgrade_pre(anaconda):
         os.makedirs(redis_backup_dir)
         shutil.copy(redis_db_file, redis_backup_dir)
 
-    for i in range(1, 6):
-        time.sleep(0.50)
-        win.set(i)
+    win.set(5)
 
     win.pop()
@@ -23,6 +23,7 @@
 
 import iutil
 import os
+import select
 
 import pyudev
 global_udev = pyudev.Udev()
@@ -35,6 +36,7 @@ def udev_enumerate_devices(deviceClass="block"):
     return [path[4:] for path in devices]
 
 def udev_get_device(sysfs_path):
+    """ Return the udev db entry for a device. """
     if not os.path.exists("/sys%s" % sysfs_path):
         log.debug("%s does not exist" % sysfs_path)
         return None
@@ -47,8 +49,11 @@ def udev_get_device(sysfs_path):
         dev["name"] = dev.sysname
         dev["sysfs_path"] = sysfs_path
 
-        # now add in the contents of the uevent file since they're handy
-        dev = udev_parse_uevent_file(dev)
+        # the properties already hold what is in the uevent file, except
+        # that udev turns DEVNAME into the full device node path; we have
+        # always used the kernel's name relative to /dev
+        if dev.devnode and dev.devnode.startswith("/dev/"):
+            dev["DEVNAME"] = dev.devnode[5:]
 
     return dev
 
@@ -61,20 +66,43 @@ def udev_get_devices(deviceClass="block"):
             entries.append(entry)
     return entries
 
-def udev_parse_uevent_file(dev):
-    path = os.path.normpath("/sys/%s/uevent" % dev['sysfs_path'])
-    if not os.access(path, os.R_OK):
-        return dev
+# the monitor is only drained when the device tree is refreshed, so its
+# socket has to hold all the events of a scan of every block device
+UDEV_MONITOR_BUFFER_SIZE = 128 * 1024 * 1024
 
-    with open(path) as f:
-        for line in f.readlines():
-            (key, equals, value) = line.strip().partition("=")
-            if not equals:
-                continue
+def udev_monitor_start(deviceClass="block"):
+    """ Start listening for uevents of deviceClass devices.
 
-            dev[key] = value
+        Return the monitor, or None if it could not be set up.
+    """
+    try:
+        return global_udev.create_monitor(subsystem=deviceClass,
+                                          bufferSize=UDEV_MONITOR_BUFFER_SIZE)
+    except EnvironmentError as e:
+        log.error("failed to start udev monitor: %s" % e)
+        return None
 
-    return dev
+def udev_monitor_get_events(monitor):
+    """ Return the list of (action, sysfs_path) events received so far.
+
+        The events are in the order udev processed them.  Return None if
+        receiving failed, in which case events may have been lost.
+    """
+    events = []
+    while select.select([monitor], [], [], 0)[0]:
+        event = monitor.receive_event()
+        if event is None:
+            log.error("failed to receive uevents after %d, some may have "
+                      "been lost" % len(events))
+            return None
+
+        (action, path) = event
+        events.append((action, path[4:]))
+
+    return events
+
+def udev_monitor_stop(monitor):
+    monitor.unref()
 
 def udev_settle():
     # wait maximal 300 seconds for udev to be done running blkid, lvm,
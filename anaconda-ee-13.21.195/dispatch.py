@@ -20,7 +20,14 @@
 # Author(s): Erik Troan <ewt@redhat.com>
 #
 
+import os
 import string
+import time
+import resource
+import cProfile
+import pstats
+import json
+from cStringIO import StringIO
 from types import *
 from constants import *
 from packages import writeKSConfiguration, turnOnFilesystems
@@ -46,6 +53,7 @@ from backend import doPreInstall, doPostInstall, doInstall
 from backend import writeConfiguration
 
 from packages import doReIPL
+import iutil
 
 import logging
 log = logging.getLogger("anaconda")
@@ -123,6 +131,85 @@ installSteps = [
     ("complete", ),
     ]
 
+TIMING_REPORT = "anaconda-timing.json"
+
+class StepTimer(object):
+    """ Resource usage of the direct install steps.
+
+        For every run of a step this records the wall clock and CPU time
+        spent in anaconda, the CPU time of the programs it ran and how many
+        of them there were, and the peak RSS of anaconda so far.  The steps
+        named in the profilestep= boot option, or all of them with
+        profilestep=all, are run under cProfile.
+    """
+    def __init__(self, profileSteps=None):
+        self.steps = []
+        self.profileSteps = profileSteps or []
+
+    def _profile(self, name, func, anaconda):
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(func, anaconda)
+        finally:
+            prof.dump_stats("/tmp/anaconda-%s.prof" % name)
+            buf = StringIO()
+            stats = pstats.Stats(prof, stream=buf)
+            stats.sort_stats("cumulative").print_stats(25)
+            log.info("profile of step %s:\n%s" % (name, buf.getvalue()))
+
+    def run(self, name, func, anaconda):
+        """ Run the step func and record what it took. """
+        selfStart = resource.getrusage(resource.RUSAGE_SELF)
+        childStart = resource.getrusage(resource.RUSAGE_CHILDREN)
+        execStart = iutil.execCount
+        start = time.time()
+        try:
+            if name in self.profileSteps or "all" in self.profileSteps:
+                return self._profile(name, func, anaconda)
+            else:
+                return func(anaconda)
+        finally:
+            selfEnd = resource.getrusage(resource.RUSAGE_SELF)
+            childEnd = resource.getrusage(resource.RUSAGE_CHILDREN)
+            step = {"step": name,
+                    "wall": time.time() - start,
+                    "cpu": selfEnd.ru_utime + selfEnd.ru_stime -
+                           selfStart.ru_utime - selfStart.ru_stime,
+                    "childcpu": childEnd.ru_utime + childEnd.ru_stime -
+                                childStart.ru_utime - childStart.ru_stime,
+                    "programs": iutil.execCount - execStart,
+                    "maxrss": selfEnd.ru_maxrss}
+            self.steps.append(step)
+            log.info("step %(step)s took %(wall).1f s, %(cpu).1f s of CPU, "
+                     "%(programs)d programs using %(childcpu).1f s of CPU, "
+                     "max RSS %(maxrss)d KB" % step)
+
+    def writeReport(self, anaconda):
+        """ Write the timings to /tmp and to /root of the installed system.
+
+            The report is only written to the installed system once the
+            kickstart file has been written there.
+        """
+        report = {"steps": self.steps,
+                  "wall": sum([s["wall"] for s in self.steps]),
+                  "cpu": sum([s["cpu"] for s in self.steps]),
+                  "childcpu": sum([s["childcpu"] for s in self.steps]),
+                  "programs": sum([s["programs"] for s in self.steps])}
+
+        paths = ["/tmp/%s" % TIMING_REPORT]
+        if os.path.exists(anaconda.rootPath + "/root/anaconda-ks.cfg"):
+            paths.append(anaconda.rootPath + "/root/" + TIMING_REPORT)
+
+        for path in paths:
+            try:
+                f = open(path, "w")
+                try:
+                    json.dump(report, f, indent=2, sort_keys=True)
+                finally:
+                    f.close()
+            except IOError as e:
+                log.warning("unable to write %s: %s" % (path, e))
+
 class Dispatcher(object):
 
     def gotoPrev(self):
@@ -215,7 +302,8 @@ class Dispatcher(object):
 	        (stepName, stepFunc) = installSteps[self.step]
                 log.info("moving (%d) to step %s" %(self._getDir(), stepName))
                 log.debug("%s is a direct step" %(stepName,))
-		rc = stepFunc(self.anaconda)
+		rc = self.timer.run(stepName, stepFunc, self.anaconda)
+                self.timer.writeReport(self.anaconda)
                 if rc in [DISPATCH_BACK, DISPATCH_FORWARD]:
 		    self._setDir(rc)
                 log.info("leaving (%d) step %s" %(self._getDir(), stepName))
@@ -255,6 +343,12 @@ class Dispatcher(object):
 
 	self.firstStep = 0
 
+        profileSteps = flags.cmdline.get("profilestep")
+        if profileSteps:
+            self.timer = StepTimer(profileSteps.split(","))
+        else:
+            self.timer = StepTimer()
+
     def _getDir(self):
         return self.anaconda.dir
 
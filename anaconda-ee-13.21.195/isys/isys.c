@@ -227,7 +227,11 @@ static PyObject * doMount(PyObject * s, PyObject * args) {
     if (!PyArg_ParseTuple(args, "sss|z", &fs, &device, &mntpoint,
 			  &flags)) return NULL;
 
+    /* mount(8) can take a while, let other threads run meanwhile */
+    Py_BEGIN_ALLOW_THREADS
     rc = doPwMount(device, mntpoint, fs, flags, &err);
+    Py_END_ALLOW_THREADS
+
     if (rc == IMOUNT_ERR_ERRNO)
 	PyErr_SetFromErrno(PyExc_SystemError);
     else if (rc) {
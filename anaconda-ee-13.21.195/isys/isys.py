@@ -23,6 +23,7 @@
 #
 
 import _isys
+import errno
 import string
 import os
 import os.path
@@ -38,6 +39,9 @@ import struct
 import block
 import dbus
 import selinux
+import threading
+import Queue
+import time
 
 import logging
 log = logging.getLogger("anaconda")
@@ -587,6 +591,97 @@ def resetFileContext(fn, instroot = '/'):
             return con
     return None
 
+## Restore the SELinux file contexts of many files to their defaults.
+# Files are only relabeled when their context differs from the default.
+# The directory trees are walked by a pool of threads, one tree each, as
+# the files are found; a tree inside another one is only walked once.
+# @param fns The files to fix, relative to instroot.
+# @param dirs The directories whose whole trees to fix, relative to instroot.
+# @param instroot An optional root filesystem to look under for the files.
+# @param jobs The number of threads walking the trees.
+# @return A tuple of the number of files looked at and relabeled.
+def resetFileContexts(fns, dirs=[], instroot='/', jobs=4):
+    start = time.time()
+    counts = {"checked": 0, "relabeled": 0}
+    lock = threading.Lock()
+
+    # load the file contexts once, before there are threads to race for it
+    matchPathContext("/")
+
+    def relabel(fn, full_path):
+        try:
+            cur = selinux.lgetfilecon(full_path)[1]
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+
+            # eg: no label at all, which is all the more reason to set one
+            log.info("failed to get SELinux context for %s: %s" % (full_path, e))
+            cur = None
+
+        relabeled = 0
+        con = matchPathContext(fn)
+        if con and con != cur:
+            try:
+                if selinux.lsetfilecon(full_path, con) == 0:
+                    relabeled = 1
+            except OSError as e:
+                log.info("failed to set SELinux context for %s: %s" % (full_path, e))
+
+        lock.acquire()
+        counts["checked"] += 1
+        counts["relabeled"] += relabeled
+        lock.release()
+
+    def relabelTree(d):
+        root = os.path.normpath("%s/%s" % (instroot, d))
+        if not os.path.isdir(root):
+            return
+
+        strip = len(os.path.normpath(instroot).rstrip("/"))
+        relabel(d, root)
+        for (path, dirnames, filenames) in os.walk(root):
+            for name in dirnames + filenames:
+                full_path = os.path.join(path, name)
+                relabel(full_path[strip:], full_path)
+
+    dirs = sorted(set([os.path.normpath(d) for d in dirs]))
+    trees = []
+    for d in dirs:
+        if not [t for t in trees if d.startswith(t.rstrip("/") + "/")]:
+            trees.append(d)
+
+    seen = set()
+    for fn in fns:
+        fn = os.path.normpath(fn)
+        if fn in seen or [t for t in trees if fn.startswith(t.rstrip("/") + "/") or fn == t]:
+            continue
+        seen.add(fn)
+        relabel(fn, os.path.normpath("%s/%s" % (instroot, fn)))
+
+    pending = Queue.Queue()
+    for d in trees:
+        pending.put(d)
+
+    def worker():
+        while True:
+            try:
+                d = pending.get_nowait()
+            except Queue.Empty:
+                return
+            relabelTree(d)
+
+    workers = [threading.Thread(target=worker)
+               for i in range(min(jobs, len(trees)))]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    log.info("relabeled %d of %d files in %.1f s"
+             % (counts["relabeled"], counts["checked"], time.time() - start))
+    return (counts["checked"], counts["relabeled"])
+
 def prefix2netmask(prefix):
     return _isys.prefix2netmask(prefix)
 
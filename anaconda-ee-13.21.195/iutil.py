@@ -31,7 +31,8 @@ import subprocess
 from flags import flags
 from constants import *
 import re
-import threading
+import select
+import time
 
 import gettext
 _ = lambda x: gettext.ldgettext("anaconda", x)
@@ -40,58 +41,78 @@ import logging
 log = logging.getLogger("anaconda")
 program_log = logging.getLogger("program")
 
-#Python reimplementation of the shell tee process, so we can
-#feed the pipe output into two places at the same time
-class tee(threading.Thread):
-    def __init__(self, inputdesc, outputdesc, logmethod, command):
-        threading.Thread.__init__(self)
-        self.inputdesc = os.fdopen(inputdesc, "r")
-        self.outputdesc = outputdesc
-        self.logmethod = logmethod
-        self.running = True
-        self.command = command
-
-    def run(self):
-        while self.running:
+## Return the environment to run external programs in.
+def _execEnv():
+    env = os.environ.copy()
+    env.update({"LC_ALL": "C"})
+    return env
+
+## The number of external programs run so far.
+execCount = 0
+
+## Log how long an external program took to the program log.
+# @param command The command that was run.
+# @param ret The return code of command.
+# @param start The time command was started at, as returned by time.time().
+def _logRunTime(command, ret, start):
+    global execCount
+    execCount += 1
+    program_log.info("%s exited with status %s after %.3f s"
+                     % (command, ret, time.time() - start))
+
+## Copy the output of child processes until all of them closed their pipes.
+# This replaces a pair of tee threads per command with one select loop in
+# the calling thread.
+# @param sources A dict mapping the read end of each pipe to a tuple of the
+#                file descriptor to copy the data to (or None) and the
+#                method to call with each complete line of output.
+# @param command The command whose output is copied, for error messages.
+def _copyOutput(sources, command):
+    sources = sources.copy()
+    partial = {}
+    while sources:
+        try:
+            (ready, w, x) = select.select(sources.keys(), [], [])
+        except select.error as e:
+            if e.args[0] == EINTR:
+                continue
+            raise
+
+        for fd in ready:
+            (outfd, linemethod) = sources[fd]
             try:
-                data = self.inputdesc.readline()
-            except IOError:
-                self.logmethod("Can't read from pipe during a call to %s. "
-                               "(program terminated suddenly?)" % self.command)
-                break
-            if data == "":
-                self.running = False
-            else:
-                self.logmethod(data.rstrip('\n'))
-                os.write(self.outputdesc, data)
+                data = os.read(fd, 4096)
+            except OSError as e:
+                if e.errno == EINTR:
+                    continue
+                program_log.error("Can't read from pipe during a call to %s. "
+                                  "(program terminated suddenly?)" % command)
+                data = ""
+
+            if not data:
+                if partial.get(fd):
+                    linemethod(partial[fd])
+                os.close(fd)
+                del sources[fd]
+                continue
 
-    def stop(self):
-        self.running = False
-        return self
+            if outfd is not None:
+                os.write(outfd, data)
 
-## Run an external program and redirect the output to a file.
-# @param command The command to run.
-# @param argv A list of arguments.
-# @param stdin The file descriptor to read stdin from.
-# @param stdout The file descriptor to redirect stdout to.
-# @param stderr The file descriptor to redirect stderr to.
-# @param root The directory to chroot to before running command.
-# @return The return code of command.
-def execWithRedirect(command, argv, stdin = None, stdout = None,
-                     stderr = None, root = '/'):
-    def chroot ():
-        os.chroot(root)
-
-    # if command.startswith('/'):
-    #     log.warning("'%s' specified as full path" % (command,))
+            lines = (partial.get(fd, "") + data).split("\n")
+            partial[fd] = lines.pop()
+            map(linemethod, lines)
 
-    stdinclose = stdoutclose = stderrclose = lambda : None
+## Open the file descriptors to redirect the standard streams of a command to.
+# @return A tuple of stdin, stdout and stderr file descriptors and a function
+#         closing the ones opened here.
+def _openRedirects(stdin, stdout, stderr):
+    opened = []
 
-    argv = list(argv)
     if isinstance(stdin, str):
         if os.access(stdin, os.R_OK):
             stdin = os.open(stdin, os.O_RDONLY)
-            stdinclose = lambda : os.close(stdin)
+            opened.append(stdin)
         else:
             stdin = sys.stdin.fileno()
     elif isinstance(stdin, int):
@@ -102,7 +123,7 @@ def execWithRedirect(command, argv, stdin = None, stdout = None,
     orig_stdout = stdout
     if isinstance(stdout, str):
         stdout = os.open(stdout, os.O_RDWR|os.O_CREAT)
-        stdoutclose = lambda : os.close(stdout)
+        opened.append(stdout)
     elif isinstance(stdout, int):
         pass
     elif stdout is None or not isinstance(stdout, file):
@@ -112,70 +133,156 @@ def execWithRedirect(command, argv, stdin = None, stdout = None,
         stderr = stdout
     elif isinstance(stderr, str):
         stderr = os.open(stderr, os.O_RDWR|os.O_CREAT)
-        stderrclose = lambda : os.close(stderr)
+        opened.append(stderr)
     elif isinstance(stderr, int):
         pass
     elif stderr is None or not isinstance(stderr, file):
         stderr = sys.stderr.fileno()
 
+    def closefds():
+        map(os.close, opened)
+
+    return (stdin, stdout, stderr, closefds)
+
+## Run an external program and redirect the output to a file.
+# @param command The command to run.
+# @param argv A list of arguments.
+# @param stdin The file descriptor to read stdin from.
+# @param stdout The file descriptor to redirect stdout to.
+# @param stderr The file descriptor to redirect stderr to.
+# @param root The directory to chroot to before running command.
+# @return The return code of command.
+def execWithRedirect(command, argv, stdin = None, stdout = None,
+                     stderr = None, root = '/'):
+    def chroot ():
+        os.chroot(root)
+
+    # if command.startswith('/'):
+    #     log.warning("'%s' specified as full path" % (command,))
+
+    argv = list(argv)
+    (stdin, stdout, stderr, closefds) = _openRedirects(stdin, stdout, stderr)
+
     program_log.info("Running... %s" % ([command] + argv,))
 
-    #prepare os pipes for feeding tee proceses
+    #prepare os pipes for feeding the output to the program log
     pstdout, pstdin = os.pipe()
     perrout, perrin = os.pipe()
-   
-    env = os.environ.copy()
-    env.update({"LC_ALL": "C"})
 
+    start = time.time()
     try:
-        #prepare tee proceses
-        proc_std = tee(pstdout, stdout, program_log.info, command)
-        proc_err = tee(perrout, stderr, program_log.error, command)
-
-        #start monitoring the outputs
-        proc_std.start()
-        proc_err.start()
-
         proc = subprocess.Popen([command] + argv, stdin=stdin,
                                 stdout=pstdin,
                                 stderr=perrin,
                                 preexec_fn=chroot, cwd=root,
-                                env=env)
-
-        proc.wait()
-        ret = proc.returncode
-
-        #close the input ends of pipes so we get EOF in the tee processes
-        os.close(pstdin)
-        os.close(perrin)
-
-        #wait for the output to be written and destroy them
-        proc_std.join()
-        del proc_std
-
-        proc_err.join()
-        del proc_err
-
-        stdinclose()
-        stdoutclose()
-        stderrclose()
+                                env=_execEnv())
     except OSError as e:
         errstr = "Error running %s: %s" % (command, e.strerror)
         log.error(errstr)
         program_log.error(errstr)
-        #close the input ends of pipes so we get EOF in the tee processes
-        os.close(pstdin)
-        os.close(perrin)
-        proc_std.join()
-        proc_err.join()
-
-        stdinclose()
-        stdoutclose()
-        stderrclose()
+        map(os.close, [pstdout, pstdin, perrout, perrin])
+        closefds()
         raise RuntimeError, errstr
 
+    #close the input ends of pipes so we get EOF once the command is done
+    os.close(pstdin)
+    os.close(perrin)
+
+    _copyOutput({pstdout: (stdout, program_log.info),
+                 perrout: (stderr, program_log.error)}, command)
+
+    proc.wait()
+    ret = proc.returncode
+    _logRunTime(command, ret, start)
+
+    closefds()
     return ret
 
+## Run several external programs one after the other in one chroot helper.
+# The helper process chroots once and then runs all of the commands, which
+# saves a fork of anaconda and a chroot per command.
+# @param commands A list of (command, argv) tuples.
+# @param stdin The file descriptor to read stdin from.
+# @param stdout The file descriptor to redirect stdout to.
+# @param stderr The file descriptor to redirect stderr to.
+# @param root The directory to chroot to before running the commands.
+# @return A list of the return codes of the commands.
+def execBatchWithRedirect(commands, stdin = None, stdout = None,
+                          stderr = None, root = '/'):
+    global execCount
+    commands = [(command, list(argv)) for (command, argv) in commands]
+    if not commands:
+        return []
+
+    (stdin, stdout, stderr, closefds) = _openRedirects(stdin, stdout, stderr)
+
+    program_log.info("Running batch of %d commands in %s..."
+                     % (len(commands), root))
+    for (command, argv) in commands:
+        program_log.info("    %s" % ([command] + argv,))
+
+    pstdout, pstdin = os.pipe()
+    perrout, perrin = os.pipe()
+    pstatus, pstatusin = os.pipe()
+    env = _execEnv()
+
+    start = time.time()
+    childpid = os.fork()
+    if not childpid:
+        # the helper reports the return code and run time of each command
+        # on the status pipe
+        try:
+            try:
+                os.dup2(stdin, 0)
+                os.dup2(pstdin, 1)
+                os.dup2(perrin, 2)
+                map(os.close, [pstdout, pstdin, perrout, perrin, pstatus])
+                os.chroot(root)
+                os.chdir("/")
+
+                for (command, argv) in commands:
+                    cmdstart = time.time()
+                    try:
+                        ret = subprocess.call([command] + argv, env=env)
+                    except OSError as e:
+                        os.write(2, "Error running %s: %s\n"
+                                    % (command, e.strerror))
+                        ret = 127
+                    os.write(pstatusin, "%d %f\n"
+                                        % (ret, time.time() - cmdstart))
+            except Exception as e:
+                os.write(2, "Error running batch: %s\n" % (e,))
+        finally:
+            os._exit(0)
+
+    map(os.close, [pstdin, perrin, pstatusin])
+
+    status = []
+    _copyOutput({pstdout: (stdout, program_log.info),
+                 perrout: (stderr, program_log.error),
+                 pstatus: (None, status.append)},
+                commands[0][0])
+    os.waitpid(childpid, 0)
+
+    rets = []
+    for (i, (command, argv)) in enumerate(commands):
+        if i < len(status) and status[i]:
+            (ret, elapsed) = status[i].split()
+            ret = int(ret)
+            program_log.info("%s exited with status %d after %.3f s"
+                             % (command, ret, float(elapsed)))
+        else:
+            # the helper died before running the command
+            program_log.error("%s was not run" % (command,))
+            ret = 127
+        rets.append(ret)
+
+    program_log.info("batch of %d commands done after %.3f s"
+                     % (len(commands), time.time() - start))
+    execCount += len(commands)
+    closefds()
+    return rets
+
 ## Run an external program and capture standard out.
 # @param command The command to run.
 # @param argv A list of arguments.
@@ -221,15 +328,13 @@ def execWithCapture(command, argv, stdin = None, stderr = None, root='/',
 
     program_log.info("Running... %s" % ([command] + argv,))
 
-    env = os.environ.copy()
-    env.update({"LC_ALL": "C"})
-
+    start = time.time()
     try:
         proc = subprocess.Popen([command] + argv, stdin=stdin,
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE,
                                 preexec_fn=chroot, cwd=root,
-                                env=env)
+                                env=_execEnv())
 
         while True:
             (outStr, errStr) = proc.communicate()
@@ -242,6 +347,7 @@ def execWithCapture(command, argv, stdin = None, stderr = None, root='/',
 
             if proc.returncode is not None:
                 break
+        _logRunTime(command, proc.returncode, start)
         # if we have anything other than a clean exit, and we get the fatal
         # option, raise the OSError.
         if proc.returncode and fatal:
@@ -300,6 +406,7 @@ def execWithCallback(command, argv, stdin = None, stdout = None,
 
     program_log.info("Running... %s" % ([command] + argv,))
 
+    start = time.time()
     p = os.pipe()
     p_stderr = os.pipe()
     childpid = os.fork()
@@ -378,12 +485,14 @@ def execWithCallback(command, argv, stdin = None, stdout = None,
     closefds()
     # *shrug*  no clue why this would happen, but hope that things are fine
     if status is None:
-        return 0
-
-    if os.WIFEXITED(status):
-        return os.WEXITSTATUS(status)
+        ret = 0
+    elif os.WIFEXITED(status):
+        ret = os.WEXITSTATUS(status)
+    else:
+        ret = 1
 
-    return 1
+    _logRunTime(command, ret, start)
+    return ret
 
 def _pulseProgressCallback(data, callback_data=None):
     if callback_data:
@@ -718,6 +718,7 @@ class VolumeGroupEditor:
             origname = templv.lvname
             if not templv.exists:
                 templv._name = lvname
+                templv.noteIndexedChange()
                 try:
                     templv.size = size
                 except ValueError:
@@ -1061,6 +1062,10 @@ class VolumeGroupEditor:
                     self.vg._addPV(pv)
 
             self.vg.name = volname
+            # the lvs were taken out of the vg above but are still in the
+            # tree, under names that include the vg's
+            for lv in origlvs:
+                lv.noteIndexedChange()
             self.vg.peSize = pesize
 
             if self.isNew:
@@ -29,6 +29,12 @@ import stat
 import shutil
 import time
 import subprocess
+import errno
+import fcntl
+import mmap
+import struct
+import threading
+import Queue
 import storage
 
 import selinux
@@ -50,64 +56,296 @@ log = logging.getLogger("anaconda")
 
 class Error(EnvironmentError):
     pass
+
+# at most this many threads copy files in copytree
+COPYTREE_MAX_JOBS = 8
+
 def copytree(src, dst, symlinks=False, preserveOwner=False,
-             preserveSelinux=False):
-    def tryChown(src, dest):
-        try:
-            os.chown(dest, os.stat(src)[stat.ST_UID], os.stat(src)[stat.ST_GID])
-        except OverflowError:
-            log.error("Could not set owner and group on file %s" % dest)
+             preserveSelinux=False, jobs=None, callback=None):
+    """ Copy the tree at src into dst, which may already exist.
+
+        This is shutil.copytree with options to preserve the owner and the
+        selinux contexts.  Hard links within the tree are preserved.
+
+        The tree is walked once, in this thread, creating the directories,
+        symlinks and hard links, while a pool of jobs threads copies the
+        files and sets their metadata from the single lstat of each.  The
+        metadata of the directories is set last, once their contents are
+        in place.  callback, if given, is called now and then from this
+        thread while the files are copied.  All the errors are collected
+        and raised at the end as an Error.
+    """
+    if jobs is None:
+        jobs = min(os.sysconf("SC_NPROCESSORS_ONLN"), COPYTREE_MAX_JOBS)
 
-    def trySetfilecon(src, dest):
-        try:
-            selinux.lsetfilecon(dest, selinux.lgetfilecon(src)[1])
-        except:
-            log.error("Could not set selinux context on file %s" % dest)
-
-    # copy of shutil.copytree which doesn't require dst to not exist
-    # and which also has options to preserve the owner and selinux contexts
-    names = os.listdir(src)
-    if not os.path.isdir(dst):
-        os.makedirs(dst)
     errors = []
-    for name in names:
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
-        try:
-            if symlinks and os.path.islink(srcname):
-                linkto = os.readlink(srcname)
-                os.symlink(linkto, dstname)
-                if preserveSelinux:
-                    trySetfilecon(srcname, dstname)
-            elif os.path.isdir(srcname):
-                copytree(srcname, dstname, symlinks, preserveOwner, preserveSelinux)
-            else:
-                shutil.copyfile(srcname, dstname)
-                if preserveOwner:
-                    tryChown(srcname, dstname)
 
-                if preserveSelinux:
-                    trySetfilecon(srcname, dstname)
+    def setMetadata(srcname, dstname, st):
+        if preserveOwner:
+            try:
+                os.lchown(dstname, st.st_uid, st.st_gid)
+            except OverflowError:
+                log.error("Could not set owner and group on file %s" % dstname)
+
+        if preserveSelinux:
+            try:
+                selinux.lsetfilecon(dstname, selinux.lgetfilecon(srcname)[1])
+            except:
+                log.error("Could not set selinux context on file %s" % dstname)
+
+        if not stat.S_ISLNK(st.st_mode):
+            os.chmod(dstname, stat.S_IMODE(st.st_mode))
+            os.utime(dstname, (st.st_atime, st.st_mtime))
 
-                shutil.copystat(srcname, dstname)
+    def copyFile(srcname, dstname, st):
+        try:
+            if stat.S_ISREG(st.st_mode):
+                shutil.copyfile(srcname, dstname)
+            else:
+                os.mknod(dstname, st.st_mode, st.st_rdev)
+            setMetadata(srcname, dstname, st)
         except (IOError, os.error), why:
             errors.append((srcname, dstname, str(why)))
-        # catch the Error from the recursive copytree so that we can
-        # continue with other files
-        except Error, err:
-            errors.extend(err.args[0])
-    try:
-        if preserveOwner:
-            tryChown(src, dst)
-        if preserveSelinux:
-            trySetfilecon(src, dst)
 
-        shutil.copystat(src, dst)
+    pending = Queue.Queue()
+
+    def worker():
+        while True:
+            job = pending.get()
+            if job is None:
+                return
+            copyFile(*job)
+
+    workers = []
+    for i in range(max(jobs, 1)):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        workers.append(t)
+        t.start()
+
+    if symlinks:
+        getStat = os.lstat
+    else:
+        getStat = os.stat
+
+    dirs = []           # (src, dst, stat) in the order they were created
+    inodes = {}         # (st_dev, st_ino) -> first copy of a hard link
+    links = []          # (src, dst, first copy) for the other hard links
+    walk = [(src, dst)]
+    try:
+        dirs.append((src, dst, os.stat(src)))
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
     except OSError as e:
-        errors.extend((src, dst, e.strerror))
+        errors.append((src, dst, e.strerror))
+        walk = []
+
+    while walk:
+        (srcdir, dstdir) = walk.pop()
+        try:
+            names = os.listdir(srcdir)
+        except OSError as e:
+            errors.append((srcdir, dstdir, e.strerror))
+            continue
+
+        for name in names:
+            srcname = os.path.join(srcdir, name)
+            dstname = os.path.join(dstdir, name)
+            try:
+                st = getStat(srcname)
+                if stat.S_ISLNK(st.st_mode):
+                    os.symlink(os.readlink(srcname), dstname)
+                    if preserveSelinux:
+                        setMetadata(srcname, dstname, st)
+                elif stat.S_ISDIR(st.st_mode):
+                    if not os.path.isdir(dstname):
+                        os.mkdir(dstname)
+                    dirs.append((srcname, dstname, st))
+                    walk.append((srcname, dstname))
+                elif stat.S_ISSOCK(st.st_mode):
+                    log.debug("not copying socket %s" % srcname)
+                elif st.st_nlink > 1 and (st.st_dev, st.st_ino) in inodes:
+                    links.append((srcname, dstname,
+                                  inodes[(st.st_dev, st.st_ino)]))
+                else:
+                    if st.st_nlink > 1:
+                        inodes[(st.st_dev, st.st_ino)] = dstname
+                    pending.put((srcname, dstname, st))
+            except (IOError, os.error), why:
+                errors.append((srcname, dstname, str(why)))
+
+        if callback:
+            callback()
+
+    for t in workers:
+        pending.put(None)
+    for t in workers:
+        while t.isAlive():
+            t.join(0.5)
+            if callback:
+                callback()
+
+    # the first copy of each hard link is complete now
+    for (srcname, dstname, first) in links:
+        try:
+            os.link(first, dstname)
+        except OSError as e:
+            errors.append((srcname, dstname, e.strerror))
+
+    # creating entries changed the times of the directories
+    for (srcname, dstname, st) in reversed(dirs):
+        try:
+            setMetadata(srcname, dstname, st)
+        except OSError as e:
+            errors.append((srcname, dstname, e.strerror))
+
     if errors:
         raise Error, errors
 
+# the live image is copied this many bytes at a time; a multiple of the
+# page size so that it can be written with O_DIRECT
+LIVE_COPY_BLOCK_SIZE = 4 * 1024 * 1024
+# how often to update the progress bar while copying, in seconds
+LIVE_COPY_PROGRESS_INTERVAL = 0.25
+
+# from linux/fs.h
+BLKDISCARD = 0x1277
+BLKDISCARDZEROES = 0x127c
+# from linux/fs.h, not in python's os before 3.3
+SEEK_DATA = 3
+
+def _zeroTarget(fd, size):
+    """ Make the first size bytes of fd read back as zeros, if that is cheap.
+
+        Regular files are truncated.  Block devices are discarded if they
+        guarantee that discarded blocks read as zeros, which is the case
+        for most SSDs.  Return whether it worked, in which case all-zero
+        blocks need not be written.
+    """
+    mode = os.fstat(fd).st_mode
+    if stat.S_ISREG(mode):
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, size)
+        return True
+
+    if not stat.S_ISBLK(mode):
+        return False
+
+    try:
+        buf = fcntl.ioctl(fd, BLKDISCARDZEROES, struct.pack("I", 0))
+        if not struct.unpack("I", buf)[0]:
+            return False
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack("QQ", 0, size))
+    except IOError as e:
+        log.debug("cannot discard the live image target: %s" % e)
+        return False
+
+    return True
+
+def _nextData(fd, offset, size):
+    """ Return the offset of the first data at or after offset in fd.
+
+        Holes in sparse files are found with SEEK_DATA.  Return None if fd
+        cannot tell, and size if there is no more data.
+    """
+    try:
+        return os.lseek(fd, offset, SEEK_DATA)
+    except OSError as e:
+        if e.errno == errno.ENXIO:
+            return size
+        return None
+
+def _writeAll(fd, buf):
+    """ Write all of buf to fd, which may take more than one write. """
+    done = 0
+    while done < len(buf):
+        count = os.write(fd, buffer(buf, done))
+        if not count:
+            raise RuntimeError, "error copying filesystem!"
+        done += count
+
+def copyImage(srcfd, dstfd, size, blockSize=LIVE_COPY_BLOCK_SIZE,
+              direct=False, callback=None):
+    """ Copy the first size bytes of srcfd to dstfd.
+
+        Blocks of zeros are skipped when the target can be zeroed cheaply
+        beforehand, and holes are skipped when the source is a sparse
+        file.  If direct is True dstfd has been opened with O_DIRECT, and
+        the data is written from a page aligned buffer.  callback is
+        called with the fraction copied every
+        LIVE_COPY_PROGRESS_INTERVAL seconds.  Return the number of bytes
+        written.
+    """
+    start = time.time()
+    lastUpdate = start
+    skipZeros = _zeroTarget(dstfd, size)
+    seekData = skipZeros and stat.S_ISREG(os.fstat(srcfd).st_mode)
+    zeros = "\0" * blockSize
+    if direct:
+        aligned = mmap.mmap(-1, blockSize)
+
+    os.lseek(srcfd, 0, 0)
+    os.lseek(dstfd, 0, 0)
+    offset = 0
+    written = 0
+    while offset < size:
+        if seekData:
+            dataOffset = _nextData(srcfd, offset, size)
+            if dataOffset is None:
+                seekData = False
+            else:
+                # round down to keep the offsets aligned
+                dataOffset = min(dataOffset - dataOffset % blockSize, size)
+                if dataOffset > offset:
+                    os.lseek(dstfd, dataOffset, 0)
+                    offset = dataOffset
+            # SEEK_DATA moved the file offset
+            os.lseek(srcfd, offset, 0)
+            if offset >= size:
+                break
+
+        buf = os.read(srcfd, min(blockSize, size - offset))
+        if not buf:
+            raise IOError(errno.EIO, "short read from live image at %d"
+                                     % offset)
+
+        if skipZeros and buf == zeros[:len(buf)]:
+            os.lseek(dstfd, len(buf), 1)
+        elif direct:
+            if len(buf) % 512:
+                # O_DIRECT only takes whole sectors, so write the rest of
+                # the image without it
+                flags = fcntl.fcntl(dstfd, fcntl.F_GETFL)
+                fcntl.fcntl(dstfd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+                direct = False
+                _writeAll(dstfd, buf)
+            else:
+                aligned.seek(0)
+                aligned.write(buf)
+                # the rest of a short write would not be aligned any more
+                if os.write(dstfd, buffer(aligned, 0, len(buf))) < len(buf):
+                    raise RuntimeError, "error copying filesystem!"
+            written += len(buf)
+        else:
+            _writeAll(dstfd, buf)
+            written += len(buf)
+        offset += len(buf)
+
+        now = time.time()
+        if callback and now - lastUpdate >= LIVE_COPY_PROGRESS_INTERVAL:
+            callback(offset / float(size))
+            lastUpdate = now
+
+    if callback:
+        callback(1.0)
+
+    elapsed = max(time.time() - start, 0.001)
+    log.info("copied live image: %d MB in %.1f s (%.1f MB/s), wrote %d MB, "
+             "skipped %d MB of zeros"
+             % (size / 1048576, elapsed, size / 1048576.0 / elapsed,
+                written / 1048576, (size - written) / 1048576))
+    return written
+
 class LiveCDCopyBackend(backend.AnacondaBackend):
     def __init__(self, anaconda):
         backend.AnacondaBackend.__init__(self, anaconda)
@@ -183,18 +421,33 @@ class LiveCDCopyBackend(backend.AnacondaBackend):
         osimg = self._getLiveBlockDevice() # the real image
         osfd = os.open(osimg, os.O_RDONLY)
 
+        blockSize = LIVE_COPY_BLOCK_SIZE
+        if flags.cmdline.has_key("livecopyblock"):
+            # in KB, rounded to whole pages for O_DIRECT
+            blockSize = int(flags.cmdline["livecopyblock"]) * 1024
+            blockSize = max(blockSize - blockSize % mmap.PAGESIZE,
+                            mmap.PAGESIZE)
+        direct = flags.cmdline.has_key("livecopydirect")
+
         rootDevice = anaconda.id.storage.rootDevice
         rootDevice.setup()
-        rootfd = os.open(rootDevice.path, os.O_WRONLY)
+        if direct:
+            rootfd = os.open(rootDevice.path, os.O_WRONLY | os.O_DIRECT)
+        else:
+            rootfd = os.open(rootDevice.path, os.O_WRONLY)
+
+        def update(fraction):
+            progress.set_fraction(pct = fraction)
+            progress.processEvents()
 
-        readamt = 1024 * 1024 * 8 # 8 megs at a time
         size = self._getLiveSize()
-        copied = 0
-        while copied < size:
+        while True:
             try:
-                buf = os.read(osfd, readamt)
-                written = os.write(rootfd, buf)
-            except:
+                copyImage(osfd, rootfd, size, blockSize=blockSize,
+                          direct=direct, callback=update)
+                break
+            except (IOError, OSError) as e:
+                log.error("error copying live image: %s" % e)
                 rc = anaconda.intf.messageWindow(_("Error"),
                         _("There was an error installing the live image to "
                           "your hard drive.  This could be due to bad media.  "
@@ -206,18 +459,8 @@ class LiveCDCopyBackend(backend.AnacondaBackend):
 
                 if rc == 0:
                     sys.exit(0)
-                else:
-                    os.lseek(osfd, 0, 0)
-                    os.lseek(rootfd, 0, 0)
-                    copied = 0
-                    continue
-
-            if (written < readamt) and (written < len(buf)):
-                raise RuntimeError, "error copying filesystem!"
-            copied += written
-            progress.set_fraction(pct = copied / float(size))
-            progress.processEvents()
 
+        os.fsync(rootfd)
         os.close(osfd)
         os.close(rootfd)
 
@@ -306,7 +549,7 @@ class LiveCDCopyBackend(backend.AnacondaBackend):
 
             copytree("%s/%s" % (anaconda.rootPath, tocopy),
                      "%s/mnt/%s" % (anaconda.rootPath, tocopy),
-                     True, True, flags.selinux)
+                     True, True, flags.selinux, callback=wait.refresh)
             wait.refresh()
             shutil.rmtree("%s/%s" % (anaconda.rootPath, tocopy))
             wait.refresh()
@@ -220,14 +220,6 @@ def setupTimezone(anaconda):
 # FIXME: this is a huge gross hack.  hard coded list of files
 # created by anaconda so that we can not be killed by selinux
 def setFileCons(anaconda):
-    def lst(root):
-        rc = [root]
-        for (root, dirs, files) in os.walk(root):
-            rc.extend(map(lambda d: root+"/"+d, dirs))
-            rc.extend(map(lambda d: root+"/"+d, files))
-
-        return rc
-
     if flags.selinux:
         log.info("setting SELinux contexts for anaconda created files")
 
@@ -245,24 +237,11 @@ def setFileCons(anaconda):
                  "/etc/zipl.conf"] + glob.glob('/etc/dhcp/dhclient-*.conf')
 
         vgs = ["/dev/%s" % vg.name for vg in anaconda.id.storage.vgs]
-        for f in files + vgs:
-            isys.resetFileContext(os.path.normpath(f), anaconda.rootPath)
 
         # ugh, this is ugly
-        for d in ["/etc/sysconfig/network-scripts", "/var/cache/yum", "/var/lib/rpm", "/var/lib/yum", "/etc/lvm", "/dev/mapper", "/etc/iscsi", "/var/lib/iscsi", "/root", "/var/log", "/etc/modprobe.d", "/etc/sysconfig" ]:
-            if not os.path.isdir(anaconda.rootPath + d):
-                continue
-
-            # This is stupid, but resetFileContext expects to get the path
-            # without "/mnt/sysimage" in front, whereas everything else needs
-            # it there.  So we add it to get the list of files, then
-            # immediately remove it, then pass it back to resetFileContext
-            # anyway.
-            for f in map(lambda f: f.replace(anaconda.rootPath, ""),
-                         filter(lambda f: os.access(f, os.R_OK),
-                                lst(anaconda.rootPath+d))):
-                ret = isys.resetFileContext(os.path.normpath(f),
-                                            anaconda.rootPath)
+        dirs = ["/etc/sysconfig/network-scripts", "/var/cache/yum", "/var/lib/rpm", "/var/lib/yum", "/etc/lvm", "/dev/mapper", "/etc/iscsi", "/var/lib/iscsi", "/root", "/var/log", "/etc/modprobe.d", "/etc/sysconfig" ]
+
+        isys.resetFileContexts(files + vgs, dirs, anaconda.rootPath)
 
     return
 
@@ -109,9 +109,40 @@ libudev_udev_device_get_devlinks_list_entry = libudev.udev_device_get_devlinks_l
 libudev_udev_device_get_devlinks_list_entry.restype = c_void_p
 libudev_udev_device_get_devlinks_list_entry.argtypes = [ c_void_p ]
 
+libudev_udev_device_get_action = libudev.udev_device_get_action
+libudev_udev_device_get_action.restype = c_char_p
+libudev_udev_device_get_action.argtypes = [ c_void_p ]
+
+libudev_udev_monitor_new_from_netlink = libudev.udev_monitor_new_from_netlink
+libudev_udev_monitor_new_from_netlink.restype = c_void_p
+libudev_udev_monitor_new_from_netlink.argtypes = [ c_void_p, c_char_p ]
+libudev_udev_monitor_unref = libudev.udev_monitor_unref
+libudev_udev_monitor_unref.argtypes = [ c_void_p ]
+
+libudev_udev_monitor_filter_add_match_subsystem_devtype = libudev.udev_monitor_filter_add_match_subsystem_devtype
+libudev_udev_monitor_filter_add_match_subsystem_devtype.restype = c_int
+libudev_udev_monitor_filter_add_match_subsystem_devtype.argtypes = [ c_void_p, c_char_p, c_char_p ]
+libudev_udev_monitor_enable_receiving = libudev.udev_monitor_enable_receiving
+libudev_udev_monitor_enable_receiving.restype = c_int
+libudev_udev_monitor_enable_receiving.argtypes = [ c_void_p ]
+libudev_udev_monitor_get_fd = libudev.udev_monitor_get_fd
+libudev_udev_monitor_get_fd.restype = c_int
+libudev_udev_monitor_get_fd.argtypes = [ c_void_p ]
+libudev_udev_monitor_receive_device = libudev.udev_monitor_receive_device
+libudev_udev_monitor_receive_device.restype = c_void_p
+libudev_udev_monitor_receive_device.argtypes = [ c_void_p ]
+libudev_udev_monitor_set_receive_buffer_size = libudev.udev_monitor_set_receive_buffer_size
+libudev_udev_monitor_set_receive_buffer_size.restype = c_int
+libudev_udev_monitor_set_receive_buffer_size.argtypes = [ c_void_p, c_int ]
+
 
 class UdevDevice(dict):
 
+    # the attributes below are all a device has besides its properties, so
+    # don't give every instance a __dict__
+    __slots__ = ("syspath", "sysname", "devpath", "subsystem", "devtype",
+                 "sysnum", "devnode")
+
     def __init__(self, udev, sysfs_path):
         dict.__init__(self)
 
@@ -125,37 +156,15 @@ class UdevDevice(dict):
         self.syspath = libudev_udev_device_get_syspath(udev_device)
         self.sysname = libudev_udev_device_get_sysname(udev_device)
 
-        # get the devlinks list
-        devlinks = []
-        devlinks_entry = libudev_udev_device_get_devlinks_list_entry(udev_device)
-
-        while devlinks_entry:
-            path = libudev_udev_list_entry_get_name(devlinks_entry)
-            devlinks.append(path)
-
-            devlinks_entry = libudev_udev_list_entry_get_next(devlinks_entry)
-
-        # add devlinks list to the dictionary
-        self["symlinks"] = devlinks
-
-        # get the first property entry
+        # get the first property entry; libudev has already merged the
+        # uevent file and the udev db into the properties. The property
+        # names are the same for every device, so intern them to keep a
+        # single copy of each.
         property_entry = libudev_udev_device_get_properties_list_entry(udev_device)
 
         while property_entry:
-            name = libudev_udev_list_entry_get_name(property_entry)
-            value = libudev_udev_list_entry_get_value(property_entry)
-
-            # lvm outputs values for multiple lvs in one line
-            # we want to split them and make a list
-            # if the first lv's value is empty we end up with a value starting
-            # with name=, prepend a space that our split does the right thing
-            if value.startswith("%s=" % name):
-                value = " " + value
-
-            if value.count(" %s=" % name):
-                value = value.split(" %s=" % name)
-
-            self[name] = value
+            name = intern(libudev_udev_list_entry_get_name(property_entry))
+            self[name] = libudev_udev_list_entry_get_value(property_entry)
 
             # get next property entry
             property_entry = libudev_udev_list_entry_get_next(property_entry)
@@ -170,6 +179,69 @@ class UdevDevice(dict):
         # cleanup
         libudev_udev_device_unref(udev_device)
 
+    def __missing__(self, key):
+        # the devlinks list is only built when somebody asks for it, from
+        # the DEVLINKS property rather than from another libudev list
+        if key == "symlinks":
+            symlinks = self.get("DEVLINKS", "").split()
+            self["symlinks"] = symlinks
+            return symlinks
+
+        raise KeyError(key)
+
+
+class UdevMonitor(object):
+
+    def __init__(self, udev, subsystem=None, bufferSize=None):
+        # listen to the events udev sends out once it has processed them,
+        # so that the udev db is up to date when we look at the device
+        self.monitor = libudev_udev_monitor_new_from_netlink(udev, "udev")
+        if not self.monitor:
+            raise EnvironmentError("unable to create the udev monitor")
+
+        # add the match subsystem
+        if subsystem is not None:
+            rc = libudev_udev_monitor_filter_add_match_subsystem_devtype(self.monitor, subsystem, None)
+            if not rc == 0:
+                self.unref()
+                raise EnvironmentError("unable to add the match subsystem")
+
+        # events pile up in the socket until they are received; once its
+        # buffer is full the kernel drops them
+        if bufferSize is not None:
+            rc = libudev_udev_monitor_set_receive_buffer_size(self.monitor, bufferSize)
+            if not rc == 0:
+                self.unref()
+                raise EnvironmentError("unable to set the receive buffer size")
+
+        rc = libudev_udev_monitor_enable_receiving(self.monitor)
+        if not rc == 0:
+            self.unref()
+            raise EnvironmentError("unable to enable receiving of events")
+
+    def fileno(self):
+        return libudev_udev_monitor_get_fd(self.monitor)
+
+    def receive_event(self):
+        # blocks until there is an event, so select on fileno() first;
+        # None means the receive failed, eg: because the socket's buffer
+        # overflowed and events were lost
+        udev_device = libudev_udev_monitor_receive_device(self.monitor)
+        if not udev_device:
+            return None
+
+        event = (libudev_udev_device_get_action(udev_device),
+                 libudev_udev_device_get_syspath(udev_device))
+
+        # cleanup
+        libudev_udev_device_unref(udev_device)
+
+        return event
+
+    def unref(self):
+        libudev_udev_monitor_unref(self.monitor)
+        self.monitor = None
+
 
 class Udev(object):
 
@@ -225,6 +297,9 @@ class Udev(object):
             if device:
                 yield device
 
+    def create_monitor(self, subsystem=None, bufferSize=None):
+        return UdevMonitor(self.udev, subsystem, bufferSize)
+
     def unref(self):
         libudev_udev_unref(self.udev)
         self.udev = None
@@ -0,0 +1,189 @@
+#
+# repocache.py: persistent cache of repository metadata
+#
+# Copyright 2013 Abiquo, Inc.
+#
+# This software may be freely redistributed under the terms of the GNU
+# library public license.
+#
+# You should have received a copy of the GNU Library Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+import hashlib
+import os
+import shutil
+import time
+
+import logging
+log = logging.getLogger("anaconda")
+
+REPOCACHE_MOUNT = "/mnt/repocache"
+
+# how many repository snapshots to keep in the cache
+REPOCACHE_ENTRIES = 16
+
+# what yum keeps in a repository cachedir besides metadata
+NOT_METADATA = ("packages", "headers", "cachecookie")
+
+def repomdChecksum(cachedir):
+    """ Return the sha1 of the repomd.xml in cachedir, or None. """
+    try:
+        f = open(os.path.join(cachedir, "repomd.xml"))
+    except IOError:
+        return None
+
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def _copyMetadata(src, dest):
+    """ Copy the metadata files and directories in src to dest. """
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+
+    for name in os.listdir(src):
+        if name in NOT_METADATA:
+            continue
+
+        path = os.path.join(src, name)
+        if os.path.isdir(path):
+            _copyMetadata(path, os.path.join(dest, name))
+        else:
+            shutil.copy2(path, os.path.join(dest, name))
+
+class RepoMetadataCache:
+    """ Repository metadata kept across installer runs.
+
+        Each entry is a copy of the metadata yum left in a repository
+        cachedir -- the repomd.xml, primary, comps and the sqlite
+        databases generated from them -- stored under the sha1 of the
+        repomd.xml.  When a repository's repomd.xml matches an entry, the
+        entry is copied back before yum sets up the sack, and yum finds
+        all the metadata it needs up to date in its cachedir.
+    """
+    def __init__(self, path, maxEntries=REPOCACHE_ENTRIES):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.hits = []
+        self.misses = []
+        self.stored = []
+
+    def restore(self, repo):
+        """ Fill repo's cachedir from the cache.
+
+            repo.cachedir must already hold the current repomd.xml.
+            Return whether the cache had the repository's metadata.
+        """
+        checksum = repomdChecksum(repo.cachedir)
+        if checksum is None:
+            return False
+
+        entry = os.path.join(self.path, checksum)
+        if not os.path.isdir(entry):
+            log.info("repodata cache miss for %s (%s)" % (repo.id, checksum))
+            self.misses.append(repo.id)
+            return False
+
+        start = time.time()
+        try:
+            _copyMetadata(entry, repo.cachedir)
+        except (IOError, OSError) as e:
+            log.warning("restoring %s from repodata cache failed: %s"
+                        % (repo.id, e))
+            self.misses.append(repo.id)
+            return False
+
+        log.info("repodata cache hit for %s (%s), restored in %.1f s"
+                 % (repo.id, checksum, time.time() - start))
+        self.hits.append(repo.id)
+        os.utime(entry, None)
+        return True
+
+    def store(self, repo):
+        """ Save the metadata in repo's cachedir to the cache. """
+        checksum = repomdChecksum(repo.cachedir)
+        if checksum is None:
+            return
+
+        entry = os.path.join(self.path, checksum)
+        if os.path.isdir(entry):
+            return
+
+        # copy to a temporary name first so that an interrupted copy is
+        # never taken for a complete entry
+        tmp = "%s.%d.tmp" % (entry, os.getpid())
+        try:
+            _copyMetadata(repo.cachedir, tmp)
+            os.rename(tmp, entry)
+        except (IOError, OSError) as e:
+            log.warning("saving %s to repodata cache failed: %s"
+                        % (repo.id, e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        log.info("saved %s to repodata cache (%s)" % (repo.id, checksum))
+        self.stored.append(repo.id)
+        self.prune()
+
+    def prune(self):
+        """ Remove all but the maxEntries most recently used entries. """
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isdir(path) and not name.endswith(".tmp"):
+                entries.append((os.stat(path).st_mtime, path))
+
+        entries.sort()
+        for (mtime, path) in entries[:-self.maxEntries]:
+            log.debug("removing %s from repodata cache" % path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def report(self):
+        log.info("repodata cache %s: %d hits %s, %d misses %s, %d saved"
+                 % (self.path, len(self.hits), self.hits, len(self.misses),
+                    self.misses, len(self.stored)))
+
+def openRepoMetadataCache(location):
+    """ Return the RepoMetadataCache for the repocache= boot option.
+
+        location is a directory, or hd:<device>:<path> for a directory on
+        a disk that is not mounted yet.  Return None if the cache cannot
+        be used.
+    """
+    if location.startswith("hd:"):
+        import isys
+        try:
+            (device, path) = location[3:].split(":", 1)
+        except ValueError:
+            log.error("invalid repocache location %s" % location)
+            return None
+
+        if not device.startswith("/dev/") and \
+           not device.startswith("UUID=") and \
+           not device.startswith("LABEL="):
+            device = "/dev/%s" % device
+
+        if not os.path.ismount(REPOCACHE_MOUNT):
+            try:
+                if not os.path.isdir(REPOCACHE_MOUNT):
+                    os.makedirs(REPOCACHE_MOUNT)
+                isys.mount(device, REPOCACHE_MOUNT, fstype="auto")
+            except (OSError, SystemError) as e:
+                log.error("couldn't mount repodata cache device %s: %s"
+                          % (device, e))
+                return None
+
+        location = os.path.join(REPOCACHE_MOUNT, path.lstrip("/"))
+
+    try:
+        if not os.path.isdir(location):
+            os.makedirs(location)
+    except OSError as e:
+        log.error("couldn't create repodata cache %s: %s" % (location, e))
+        return None
+
+    log.info("using repodata cache %s" % location)
+    return RepoMetadataCache(location)
@@ -26,6 +26,8 @@ import stat
 import errno
 import sys
 import statvfs
+import threading
+import Queue
 
 import nss.nss
 import parted
@@ -291,6 +293,7 @@ def undoEncryption(storage):
             child.parents.remove(device)
             device.removeChild()
             child.parents.append(slave)
+            child.noteParentsChange()
 
         storage.devicetree.registerAction(ActionDestroyFormat(device))
         storage.devicetree.registerAction(ActionDestroyDevice(device))
@@ -435,6 +438,7 @@ class Storage(object):
             # Reset the internal dasd list (823534)
             self.dasd.clear_device_list()
 
+        self.devicetree.stopMonitor()
         self.devicetree = DeviceTree(intf=self.anaconda.intf,
                                      ignored=self.ignoredDisks,
                                      exclusive=self.exclusiveDisks,
@@ -451,18 +455,58 @@ class Storage(object):
         self.devicetree.populate(prog)
         self.fsset = FSSet(self.devicetree, self.anaconda.rootPath)
         self.eddDict = get_edd_dict(self.partitioned)
+        # the disk order depends on eddDict
+        self.devicetree.invalidateViews()
         self.anaconda.id.rootParts = None
         self.anaconda.id.upgradeRoot = None
         self.dumpState("initial")
         prog.pop()
 
-    @property
-    def devices(self):
-        """ A list of all the devices in the device tree. """
+    def refresh(self):
+        """ Bring the device tree up to date with the system's devices.
+
+            Unlike reset, this only looks at the devices udev reported as
+            added, changed or removed since the tree was populated, and it
+            keeps the registered actions. If the changes cannot be applied
+            to the tree, eg: because they affect devices with actions
+            registered, we fall back to reset.
+        """
+        if self.devicetree.refresh():
+            return
+
+        log.info("device tree refresh failed, rescanning all devices")
+        self.reset()
+
+    def _getView(self, key, build):
+        """ Return a copy of the device tree view cached under key.
+
+            The views are kept until the tree changes, so the properties
+            below don't rebuild and re-sort their lists on every access.
+        """
+        return self.devicetree.getView(key, build)[:]
+
+    def _sortedDevices(self):
         devices = self.devicetree.devices
         devices.sort(key=lambda d: d.name)
         return devices
 
+    def _filterDevices(self, key, func):
+        """ Return the cached list of devices for which func is true.
+
+            The list is sorted by name.
+        """
+        def build():
+            devices = self.devicetree.getView("sortedDevices",
+                                              self._sortedDevices)
+            return [d for d in devices if func(d)]
+
+        return self._getView(key, build)
+
+    @property
+    def devices(self):
+        """ A list of all the devices in the device tree. """
+        return self._getView("sortedDevices", self._sortedDevices)
+
     @property
     def disks(self):
         """ A list of the disks in the device tree.
@@ -473,15 +517,18 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        disks = []
-        for device in self.devicetree.devices:
-            if device.isDisk:
-                if not device.mediaPresent:
-                    log.info("Skipping disk: %s: No media present" % device.name)
-                    continue
-                disks.append(device)
-        disks.sort(key=lambda d: d.name, cmp=self.compareDisks)
-        return disks
+        def build():
+            disks = []
+            for device in self.devicetree.devices:
+                if device.isDisk:
+                    if not device.mediaPresent:
+                        log.info("Skipping disk: %s: No media present" % device.name)
+                        continue
+                    disks.append(device)
+            disks.sort(key=lambda d: d.name, cmp=self.compareDisks)
+            return disks
+
+        return self._getView("disks", build)
 
     @property
     def partitioned(self):
@@ -496,19 +543,17 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        partitioned = []
-        for device in self.devicetree.devices:
+        def isPartitioned(device):
             if not device.partitioned:
-                continue
+                return False
 
             if not device.mediaPresent:
                 log.info("Skipping device: %s: No media present" % device.name)
-                continue
+                return False
 
-            partitioned.append(device)
+            return True
 
-        partitioned.sort(key=lambda d: d.name)
-        return partitioned
+        return self._filterDevices("partitioned", isPartitioned)
 
     @property
     def partitions(self):
@@ -518,9 +563,8 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        partitions = self.devicetree.getDevicesByInstance(PartitionDevice)
-        partitions.sort(key=lambda d: d.name)
-        return partitions
+        return self._filterDevices("partitions",
+                                   lambda d: isinstance(d, PartitionDevice))
 
     @property
     def vgs(self):
@@ -530,9 +574,7 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        vgs = self.devicetree.getDevicesByType("lvmvg")
-        vgs.sort(key=lambda d: d.name)
-        return vgs
+        return self._filterDevices("vgs", lambda d: d.type == "lvmvg")
 
     @property
     def lvs(self):
@@ -542,9 +584,7 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        lvs = self.devicetree.getDevicesByType("lvmlv")
-        lvs.sort(key=lambda d: d.name)
-        return lvs
+        return self._filterDevices("lvs", lambda d: d.type == "lvmlv")
 
     @property
     def pvs(self):
@@ -554,10 +594,7 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        devices = self.devicetree.devices
-        pvs = [d for d in devices if d.format.type == "lvmpv"]
-        pvs.sort(key=lambda d: d.name)
-        return pvs
+        return self._filterDevices("pvs", lambda d: d.format.type == "lvmpv")
 
     def unusedPVs(self, vg=None):
         unused = []
@@ -581,16 +618,13 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        arrays = self.devicetree.getDevicesByType("mdarray")
-        arrays.sort(key=lambda d: d.name)
-        return arrays
+        return self._filterDevices("mdarrays", lambda d: d.type == "mdarray")
 
     @property
     def mdcontainers(self):
         """ A list of the MD containers in the device tree. """
-        arrays = self.devicetree.getDevicesByType("mdcontainer")
-        arrays.sort(key=lambda d: d.name)
-        return arrays
+        return self._filterDevices("mdcontainers",
+                                   lambda d: d.type == "mdcontainer")
 
     @property
     def mdmembers(self):
@@ -600,10 +634,7 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        devices = self.devicetree.devices
-        members = [d for d in devices if d.format.type == "mdmember"]
-        members.sort(key=lambda d: d.name)
-        return members
+        return self._filterDevices("mdmembers", lambda d: d.format.type == "mdmember")
 
     def unusedMDMembers(self, array=None):
         unused = []
@@ -636,17 +667,14 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        devices = self.devicetree.devices
-        swaps = [d for d in devices if d.format.type == "swap"]
-        swaps.sort(key=lambda d: d.name)
-        return swaps
+        return self._filterDevices("swaps", lambda d: d.format.type == "swap")
 
     @property
     def protectedDevices(self):
-        devices = self.devicetree.devices
-        protected = [d for d in devices if d.protected]
-        protected.sort(key=lambda d: d.name)
-        return protected
+        # protected is set on devices already in the tree, which doesn't
+        # change the tree's generation, so only the sorted list is cached
+        devices = self.devicetree.getView("sortedDevices", self._sortedDevices)
+        return [d for d in devices if d.protected]
 
     def exceptionDisks(self):
         """ Return a list of removable devices to save exceptions to.
@@ -666,7 +694,7 @@ class Storage(object):
         # When a usb is connected from before the start of the installation,
         # it is not correctly detected.
         udev_trigger(subsystem="block", action="change")
-        self.reset()
+        self.refresh()
 
         dests = []
 
@@ -1607,6 +1635,114 @@ def get_containing_device(path, devicetree):
 
     return devicetree.getDeviceByName(device_name)
 
+# Maximum number of devices set up, and of filesystems mounted, at once by
+# FSSet.mountFilesystems.
+MOUNT_MAX_JOBS = 4
+
+def _setupGroups(devices):
+    """ Split devices into groups that can be set up independently.
+
+        Setting up a device sets up everything it is built on. Disks and
+        partitions need no activation, but two devices on the same vg, md
+        array or LUKS mapping must not be set up at the same time, so they
+        end up in the same group. Each group keeps the order of devices.
+    """
+    groups = []
+    for device in devices:
+        shared = set([device.id])
+        for ancestor in device.ancestors:
+            if not isinstance(ancestor, (DiskDevice, PartitionDevice)):
+                shared.add(ancestor.id)
+
+        members = [device]
+        for group in [g for g in groups if g[0] & shared]:
+            groups.remove(group)
+            shared.update(group[0])
+            members = group[1] + members
+
+        groups.append((shared, members))
+
+    order = dict([(id(d), i) for (i, d) in enumerate(devices)])
+    return [sorted(g[1], key=lambda d: order[id(d)]) for g in groups]
+
+def setupDevicesConcurrently(devices, maxJobs=MOUNT_MAX_JOBS):
+    """ Run the setup method of devices, independent ones concurrently.
+
+        Opening LUKS mappings, activating lvs and assembling md arrays is
+        done by external programs, so threads are all we need to run
+        several at once. Return the list of devices whose setup failed.
+    """
+    groups = Queue.Queue()
+    for group in _setupGroups(devices):
+        groups.put(group)
+
+    failed = []
+
+    def worker():
+        while True:
+            try:
+                group = groups.get_nowait()
+            except Queue.Empty:
+                return
+
+            for device in group:
+                try:
+                    device.setup()
+                except Exception as e:
+                    log.error("failed to set up %s: %s" % (device.name, e))
+                    failed.append(device)
+
+    workers = []
+    for i in range(min(maxJobs, groups.qsize())):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        workers.append(t)
+        t.start()
+
+    for t in workers:
+        t.join()
+
+    return failed
+
+def _isUnder(path, parent):
+    """ Return True if path is parent or a path below it. """
+    return path == parent or path.startswith(parent.rstrip("/") + "/")
+
+def _mountDependencies(devices, barriers=()):
+    """ Return the mount order constraints of a list of devices.
+
+        devices is sorted by mountpoint. The result has, for each device,
+        the set of indexes of the devices that must be mounted before it:
+        the one mounted on the closest directory above its mountpoint.
+        The indexes in barriers are mounted once all the devices before
+        them are, and before any of the devices after them.
+    """
+    deps = []
+    barrier = None
+    for (i, device) in enumerate(devices):
+        mountpoint = device.format.mountpoint
+        parent = None
+        for j in range(i):
+            other = devices[j].format.mountpoint
+            if _isUnder(mountpoint, other) and \
+               (parent is None or
+                len(other) >= len(devices[parent].format.mountpoint)):
+                parent = j
+
+        if i in barriers:
+            dep = set(range(i))
+            barrier = i
+        else:
+            dep = set()
+            if parent is not None:
+                dep.add(parent)
+            if barrier is not None:
+                dep.add(barrier)
+
+        deps.append(dep)
+
+    return deps
+
 
 class FSSet(object):
     """ A class to represent a set of filesystems. """
@@ -1995,13 +2131,120 @@ class FSSet(object):
 
                 break
 
+    def _bindSetup(self, anaconda, device):
+        """ Set up the parents of a bind mount's DirectoryDevice.
+
+            Return False if the directory's device cannot be found, in
+            which case the device is removed from the tree.
+        """
+        # set up the DirectoryDevice's parents now that they are
+        # accessible
+        #
+        # -- bind formats' device and mountpoint are always both
+        #    under the chroot. no exceptions. none, damn it.
+        targetDir = "%s/%s" % (anaconda.rootPath, device.path)
+        parent = get_containing_device(targetDir, self.devicetree)
+        if not parent:
+            log.error("cannot determine which device contains "
+                      "directory %s" % device.path)
+            device.parents = []
+            self.devicetree._removeDevice(device)
+            return False
+        else:
+            device.parents = [parent]
+
+        return True
+
+    def _mountFailed(self, intf, device, exc_info, raiseErrors=None):
+        """ Report a failure to mount device; exc_info is sys.exc_info(). """
+        try:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        except OSError as e:
+            log.error("OSError: (%d) %s" % (e.errno, e.strerror))
+
+            if intf:
+                if e.errno == errno.EEXIST:
+                    intf.messageWindow(_("Invalid mount point"),
+                                       _("An error occurred when trying "
+                                         "to create %s.  Some element of "
+                                         "this path is not a directory. "
+                                         "This is a fatal error and the "
+                                         "install cannot continue.\n\n"
+                                         "Press <Enter> to exit the "
+                                         "installer.")
+                                       % (device.format.mountpoint,))
+                else:
+                    na = {'mountpoint': device.format.mountpoint,
+                          'msg': e.strerror}
+                    intf.messageWindow(_("Invalid mount point"),
+                                       _("An error occurred when trying "
+                                         "to create %(mountpoint)s: "
+                                         "%(msg)s.  This is "
+                                         "a fatal error and the install "
+                                         "cannot continue.\n\n"
+                                         "Press <Enter> to exit the "
+                                         "installer.") % na)
+            sys.exit(0)
+        except SystemError as e:
+            (num, msg) = e.args[:2]
+            log.error("SystemError: (%d) %s" % (num, msg) )
+
+            if raiseErrors:
+                raise
+            if intf and not device.format.linuxNative:
+                na = {'path': device.path,
+                      'mountpoint': device.format.mountpoint}
+                ret = intf.messageWindow(_("Unable to mount filesystem"),
+                                         _("An error occurred mounting "
+                                         "device %(path)s as "
+                                         "%(mountpoint)s.  You may "
+                                         "continue installation, but "
+                                         "there may be problems.") % na,
+                                         type="custom",
+                                         custom_icon="warning",
+                                         custom_buttons=[_("_Exit installer"),
+                                                        _("_Continue")])
+
+                if ret == 0:
+                    sys.exit(0)
+                else:
+                    return
+
+            sys.exit(0)
+        except FSError as msg:
+            log.error("FSError: %s" % msg)
+
+            if intf:
+                na = {'path': device.path,
+                      'mountpoint': device.format.mountpoint,
+                      'msg': msg}
+                intf.messageWindow(_("Unable to mount filesystem"),
+                                   _("An error occurred mounting "
+                                     "device %(path)s as %(mountpoint)s: "
+                                     "%(msg)s. This is "
+                                     "a fatal error and the install "
+                                     "cannot continue.\n\n"
+                                     "Press <Enter> to exit the "
+                                     "installer.") % na)
+            sys.exit(0)
+
     def mountFilesystems(self, anaconda, raiseErrors=None, readOnly=None,
-                         skipRoot=False):
+                         skipRoot=False, maxJobs=MOUNT_MAX_JOBS):
+        """ Mount the filesystems, independent ones concurrently.
+
+            The devices are set up first, those that share no vg, md
+            array or LUKS mapping concurrently. Then each filesystem is
+            mounted as soon as the one it is mounted below is; bind
+            mounts wait for all the mounts before them. Failures are
+            reported from this thread, in the order they happen.
+        """
         intf = anaconda.intf
         devices = self.mountpoints.values() + self.swapDevices
         devices.extend([self.dev, self.devshm, self.devpts, self.sysfs, self.proc])
         devices.sort(key=lambda d: getattr(d.format, "mountpoint", None))
 
+        mounts = []
+        binds = set()
         for device in devices:
             if not device.format.mountable or not device.format.mountpoint:
                 continue
@@ -2014,101 +2257,100 @@ class FSSet(object):
                 continue
 
             if device.format.type == "bind" and device != self.dev:
-                # set up the DirectoryDevice's parents now that they are
-                # accessible
-                #
-                # -- bind formats' device and mountpoint are always both
-                #    under the chroot. no exceptions. none, damn it.
-                targetDir = "%s/%s" % (anaconda.rootPath, device.path)
-                parent = get_containing_device(targetDir, self.devicetree)
-                if not parent:
-                    log.error("cannot determine which device contains "
-                              "directory %s" % device.path)
-                    device.parents = []
-                    self.devicetree._removeDevice(device)
-                    continue
-                else:
-                    device.parents = [parent]
-
-            try:
-                device.setup()
-            except Exception as msg:
-                # FIXME: need an error popup
-                continue
+                binds.add(len(mounts))
 
             if readOnly:
                 options = "%s,%s" % (options, readOnly)
 
-            try:
-                device.format.setup(options=options,
-                                    chroot=anaconda.rootPath)
-            except OSError as e:
-                log.error("OSError: (%d) %s" % (e.errno, e.strerror))
-
-                if intf:
-                    if e.errno == errno.EEXIST:
-                        intf.messageWindow(_("Invalid mount point"),
-                                           _("An error occurred when trying "
-                                             "to create %s.  Some element of "
-                                             "this path is not a directory. "
-                                             "This is a fatal error and the "
-                                             "install cannot continue.\n\n"
-                                             "Press <Enter> to exit the "
-                                             "installer.")
-                                           % (device.format.mountpoint,))
-                    else:
-                        na = {'mountpoint': device.format.mountpoint,
-                              'msg': e.strerror}
-                        intf.messageWindow(_("Invalid mount point"),
-                                           _("An error occurred when trying "
-                                             "to create %(mountpoint)s: "
-                                             "%(msg)s.  This is "
-                                             "a fatal error and the install "
-                                             "cannot continue.\n\n"
-                                             "Press <Enter> to exit the "
-                                             "installer.") % na)
-                sys.exit(0)
-            except SystemError as (num, msg):
-                log.error("SystemError: (%d) %s" % (num, msg) )
-
-                if raiseErrors:
-                    raise
-                if intf and not device.format.linuxNative:
-                    na = {'path': device.path,
-                          'mountpoint': device.format.mountpoint}
-                    ret = intf.messageWindow(_("Unable to mount filesystem"),
-                                             _("An error occurred mounting "
-                                             "device %(path)s as "
-                                             "%(mountpoint)s.  You may "
-                                             "continue installation, but "
-                                             "there may be problems.") % na,
-                                             type="custom",
-                                             custom_icon="warning",
-                                             custom_buttons=[_("_Exit installer"),
-                                                            _("_Continue")])
-
-                    if ret == 0:
-                        sys.exit(0)
-                    else:
+            mounts.append((device, options))
+
+        # bind mounts' devices are only known once what they bind is mounted
+        failed = setupDevicesConcurrently([d for (i, (d, o))
+                                           in enumerate(mounts)
+                                           if i not in binds],
+                                          maxJobs=maxJobs)
+        failed = set([id(d) for d in failed])
+        deps = _mountDependencies([d for (d, o) in mounts], barriers=binds)
+
+        jobs = Queue.Queue()
+        results = Queue.Queue()
+
+        def worker():
+            while True:
+                i = jobs.get()
+                if i is None:
+                    return
+
+                (device, options) = mounts[i]
+                try:
+                    device.format.setup(options=options,
+                                        chroot=anaconda.rootPath)
+                except Exception:
+                    results.put((i, sys.exc_info()))
+                else:
+                    results.put((i, None))
+
+        workers = []
+        for i in range(min(maxJobs, len(mounts))):
+            t = threading.Thread(target=worker)
+            t.setDaemon(True)
+            workers.append(t)
+            t.start()
+
+        started = set()
+        done = set()
+        try:
+            while len(done) < len(mounts):
+                for i in range(len(mounts)):
+                    if i in started or not deps[i] <= done:
                         continue
 
-                sys.exit(0)
-            except FSError as msg:
-                log.error("FSError: %s" % msg)
-
-                if intf:
-                    na = {'path': device.path,
-                          'mountpoint': device.format.mountpoint,
-                          'msg': msg}
-                    intf.messageWindow(_("Unable to mount filesystem"),
-                                       _("An error occurred mounting "
-                                         "device %(path)s as %(mountpoint)s: "
-                                         "%(msg)s. This is "
-                                         "a fatal error and the install "
-                                         "cannot continue.\n\n"
-                                         "Press <Enter> to exit the "
-                                         "installer.") % na)
-                sys.exit(0)
+                    started.add(i)
+                    (device, options) = mounts[i]
+                    if i in binds:
+                        # nothing else is mounting now, see _mountDependencies
+                        done.add(i)
+                        if not self._bindSetup(anaconda, device):
+                            continue
+
+                        try:
+                            device.setup()
+                        except Exception as e:
+                            # FIXME: need an error popup
+                            log.error("failed to set up %s: %s"
+                                      % (device.name, e))
+                            continue
+
+                        try:
+                            device.format.setup(options=options,
+                                                chroot=anaconda.rootPath)
+                        except Exception:
+                            self._mountFailed(intf, device, sys.exc_info(),
+                                              raiseErrors=raiseErrors)
+                    elif id(device) in failed:
+                        # FIXME: need an error popup
+                        done.add(i)
+                    else:
+                        jobs.put(i)
+
+                if len(started) > len(done):
+                    (i, exc_info) = results.get()
+                    if exc_info:
+                        self._mountFailed(intf, mounts[i][0], exc_info,
+                                          raiseErrors=raiseErrors)
+                    done.add(i)
+        finally:
+            # after a failure, don't start any of the mounts still queued
+            while True:
+                try:
+                    jobs.get_nowait()
+                except Queue.Empty:
+                    break
+
+            for t in workers:
+                jobs.put(None)
+            for t in workers:
+                t.join()
 
         self.active = True
 
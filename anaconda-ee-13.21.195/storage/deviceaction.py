@@ -23,9 +23,13 @@
 
 from udev import *
 import math
+import heapq
+import threading
+import Queue
 
-from devices import StorageDevice, PartitionDevice
+from devices import StorageDevice, PartitionDevice, LVMLogicalVolumeDevice
 from formats import getFormat
+from formats.fs import FS
 from errors import *
 from parted import partitionFlag, PARTITION_LBA
 
@@ -268,6 +272,12 @@ class ActionCreateFormat(DeviceAction):
             self.origFormat = getFormat(None)
 
     def execute(self, intf=None):
+        self.prepare()
+        self.createFormat(intf=intf)
+        self.finish()
+
+    def prepare(self):
+        """ Set up the device and write out its partition flags. """
         self.device.setup()
 
         if isinstance(self.device, PartitionDevice):
@@ -285,18 +295,35 @@ class ActionCreateFormat(DeviceAction):
 
             self.device.disk.format.commitToDisk()
 
+    def createFormat(self, intf=None):
+        """ Create the format on the prepared device. """
         self.device.format.create(intf=intf,
                                   device=self.device.path,
                                   options=self.device.formatArgs)
-        # Get the UUID now that the format is created
+
+    def finish(self):
+        """ Pick up the UUID of the newly created format. """
         udev_settle()
         self.device.updateSysfsPath()
         info = udev_get_block_device(self.device.sysfsPath)
         self.device.format.uuid = udev_device_get_uuid(info)
 
+        # creating the format may also have set its label or, for luks, its
+        # uuid; either way the tree has to index the device again
+        self.device.noteIndexedChange()
+
     def cancel(self):
         self.device.format = self.origFormat
 
+    @property
+    def concurrent(self):
+        """ Can the format be created alongside other formats?
+
+            A filesystem's mkfs only writes to its own device, so it can
+            run while other filesystems are being created elsewhere.
+        """
+        return isinstance(self.format, FS)
+
 
 class ActionDestroyFormat(DeviceAction):
     """ An action representing the removal of an existing filesystem.
@@ -376,3 +403,347 @@ class ActionMigrateFormat(DeviceAction):
     def cancel(self):
         self.device.format.migrate = False
 
+
+# Maximum number of filesystems createFormatsConcurrently creates at once.
+MKFS_MAX_JOBS = 4
+
+# Actions run in phases, each phase in dependency order.
+ACTION_PHASES = [ACTION_TYPE_DESTROY, ACTION_TYPE_RESIZE, ACTION_TYPE_CREATE,
+                 ACTION_TYPE_MIGRATE]
+
+class ActionGraph(object):
+    """ The dependencies between a set of actions.
+
+        Actions are executed in phases: all destroys, then resizes, then
+        creates, then migrates. Within a phase an action has to wait for
+        the actions on the devices it must follow:
+
+            destroy     -- devices that depend on its device, and the
+                           format on its device before the device itself
+            resize      -- for a grow the devices its device depends on,
+                           for a shrink the devices depending on it
+            create      -- the devices its device depends on, and the
+                           device before its format
+            migrate     -- the devices its device depends on
+
+        The graph is built once from the devices' parents, which is linear
+        in the number of actions times the depth of the device stack.
+        Actions that are not ordered by the graph are ordered as they have
+        always been, eg: partitions on a disk by number.
+    """
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self._succ = [set() for a in self.actions]
+        self._pred = [set() for a in self.actions]
+        self._indexes = dict([(id(a), i) for (i, a) in enumerate(self.actions)])
+        self._ancestors = {}
+        self._extended = {}
+
+        for (i, action) in enumerate(self.actions):
+            device = action.device
+            if isinstance(device, PartitionDevice) and device.disk and \
+               device.isExtended:
+                self._extended.setdefault(device.disk.id, set()).add(device)
+
+        for phase in ACTION_PHASES:
+            self._addPhaseEdges(phase, [i for (i, a) in
+                                        enumerate(self.actions)
+                                        if a.type == phase])
+
+    def _getAncestors(self, device):
+        """ Return the set of devices device depends on.
+
+            This is what Device.dependsOn checks, including the dependency
+            of logical partitions on the extended partition.
+        """
+        if device.id in self._ancestors:
+            return self._ancestors[device.id]
+
+        ancestors = set(device.ancestors)
+        for ancestor in device.ancestors:
+            ancestors.update(self._getExtended(ancestor))
+        ancestors.update(self._getExtended(device))
+
+        self._ancestors[device.id] = ancestors
+        return ancestors
+
+    def _getExtended(self, device):
+        """ Return the extended partitions a logical partition is on. """
+        if isinstance(device, PartitionDevice) and device.disk and \
+           device.disk.id in self._extended and device.isLogical:
+            return self._extended[device.disk.id]
+
+        return ()
+
+    def _addEdge(self, first, then):
+        if first != then:
+            self._succ[first].add(then)
+            self._pred[then].add(first)
+
+    def _addPhaseEdges(self, phase, indices):
+        byDevice = {}
+        byPath = {}
+        for i in indices:
+            device = self.actions[i].device
+            byDevice.setdefault(device.id, []).append(i)
+            byPath.setdefault(device.path, []).append(i)
+
+        # actions on the device and on the format at the same path
+        for same in byPath.values():
+            for i in same:
+                for j in same:
+                    a = self.actions[i]
+                    b = self.actions[j]
+                    if not (a.isDevice() and b.isFormat()):
+                        continue
+
+                    # a is the device action, b the format action
+                    if phase == ACTION_TYPE_DESTROY:
+                        self._addEdge(j, i)
+                    elif phase == ACTION_TYPE_CREATE:
+                        self._addEdge(i, j)
+                    elif phase == ACTION_TYPE_RESIZE:
+                        if b.isGrow():
+                            self._addEdge(i, j)
+                        else:
+                            self._addEdge(j, i)
+
+        # actions on devices and on the devices they depend upon
+        for i in indices:
+            action = self.actions[i]
+            for ancestor in self._getAncestors(action.device):
+                for j in byDevice.get(ancestor.id, []):
+                    if phase == ACTION_TYPE_DESTROY:
+                        self._addEdge(i, j)
+                    elif phase == ACTION_TYPE_RESIZE and not action.isGrow():
+                        self._addEdge(i, j)
+                    else:
+                        self._addEdge(j, i)
+
+    def successors(self, action):
+        """ Return the actions that have to wait for action. """
+        return [self.actions[j] for j in
+                sorted(self._succ[self._indexes[id(action)]])]
+
+    def _sortKey(self, i):
+        """ Key ordering actions the graph leaves unordered. """
+        action = self.actions[i]
+        device = action.device
+        if isinstance(device, PartitionDevice):
+            if device.disk:
+                diskName = device.disk.name
+            else:
+                diskName = ""
+            if device.partedPartition:
+                number = device.partedPartition.number
+            else:
+                number = 0
+
+            if action.isDestroy():
+                # partitions go after other devices, last partition first
+                return (1, _reversed(diskName), -number, i)
+            elif action.isResize():
+                return (1, device.name, 0, i)
+            else:
+                # partitions before other devices, first partition first
+                return (0, diskName, number, i)
+        elif isinstance(device, LVMLogicalVolumeDevice) and action.isCreate():
+            # lvs restricted to a single pv before the others
+            return (1, "", int(not device.singlePV), i)
+        elif action.isDestroy() or action.isResize():
+            return (0, "", 0, i)
+        else:
+            return (1, "", 0, i)
+
+    def sortedActions(self):
+        """ Return the actions in execution order. """
+        ordered = []
+        for phase in ACTION_PHASES + [None]:
+            if phase is None:
+                indices = [i for (i, a) in enumerate(self.actions)
+                           if a.type not in ACTION_PHASES]
+            else:
+                indices = [i for (i, a) in enumerate(self.actions)
+                           if a.type == phase]
+            ordered.extend([self.actions[i] for i in
+                            self._topologicalSort(indices)])
+
+        return ordered
+
+    def _topologicalSort(self, indices):
+        waiting = {}
+        ready = []
+        for i in indices:
+            waiting[i] = len(self._pred[i])
+            if not waiting[i]:
+                heapq.heappush(ready, (self._sortKey(i), i))
+
+        ordered = []
+        while ready:
+            (key, i) = heapq.heappop(ready)
+            ordered.append(i)
+            for j in self._succ[i]:
+                waiting[j] -= 1
+                if not waiting[j]:
+                    heapq.heappush(ready, (self._sortKey(j), j))
+
+        if len(ordered) != len(indices):
+            # this should not happen since the device tree has no cycles
+            log.error("dependency cycle among actions: %s"
+                      % [str(self.actions[k]) for k in indices
+                            if waiting[k]])
+            ordered.extend(sorted([k for k in indices if waiting[k]],
+                                  key=self._sortKey))
+
+        return ordered
+
+    def branches(self, actions=None):
+        """ Split actions into independent branches.
+
+            Actions in different branches operate on devices that have no
+            ancestor in common (eg: formats on partitions of different
+            disks) and are not ordered relative to each other, so the
+            branches could be executed concurrently. Each branch is
+            returned in execution order.
+
+            actions defaults to all of the graph's actions.
+        """
+        if actions is None:
+            actions = self.actions
+
+        roots = {}
+        def find(devid):
+            while roots.get(devid, devid) != devid:
+                devid = roots[devid]
+            return devid
+
+        def union(a, b):
+            (a, b) = (find(a), find(b))
+            if a != b:
+                roots[a] = b
+
+        members = set([id(a) for a in actions])
+        for action in actions:
+            device = action.device
+            for ancestor in self._getAncestors(device):
+                union(device.id, ancestor.id)
+
+        # devices at the same path (eg: a new partition replacing an old
+        # one) and devices with ordered actions belong together, too
+        byPath = {}
+        for (i, action) in enumerate(self.actions):
+            if id(action) not in members:
+                continue
+            byPath.setdefault(action.device.path, action.device)
+            union(action.device.id, byPath[action.device.path].id)
+            for j in self._succ[i]:
+                if id(self.actions[j]) in members:
+                    union(action.device.id, self.actions[j].device.id)
+
+        branches = {}
+        order = []
+        for action in self.sortedActions():
+            if id(action) not in members:
+                continue
+            root = find(action.device.id)
+            if root not in branches:
+                branches[root] = []
+                order.append(root)
+            branches[root].append(action)
+
+        return [branches[r] for r in order]
+
+def createFormatsConcurrently(branches, intf=None, maxJobs=MKFS_MAX_JOBS):
+    """ Create the formats of prepared actions concurrently.
+
+        Arguments:
+
+            branches -- lists of ActionCreateFormat instances, as returned
+                        by ActionGraph.branches, whose prepare method has
+                        already been called
+
+        Keyword Arguments:
+
+            intf -- InstallInterface instance
+            maxJobs -- maximum number of formats to create at once
+
+        The formats in a branch are created in order, up to maxJobs
+        branches at a time. Each mkfs runs in its own process, so threads
+        are all we need to drive them. The interfaces are not thread-safe,
+        so progress is shown in a single window from the calling thread.
+
+        After a failure no more formats are started. Return the actions
+        whose format was not created, in execution order, so they can be
+        retried one at a time.
+    """
+    actions = []
+    for branch in branches:
+        actions.extend(branch)
+
+    if not actions:
+        return []
+
+    pending = Queue.Queue()
+    for branch in branches:
+        pending.put(branch)
+
+    results = Queue.Queue()
+    failed = threading.Event()
+
+    def worker():
+        while not failed.isSet():
+            try:
+                branch = pending.get_nowait()
+            except Queue.Empty:
+                return
+
+            for action in branch:
+                if failed.isSet():
+                    return
+
+                log.info("creating format: %s" % action)
+                try:
+                    action.createFormat()
+                except Exception as e:
+                    log.error("failed to create format on %s: %s"
+                              % (action.device.name, e))
+                    failed.set()
+                    return
+
+                results.put(action)
+
+    w = None
+    if intf:
+        w = intf.progressWindow(_("Formatting"),
+                                _("Creating filesystems"),
+                                len(actions))
+
+    workers = []
+    for i in range(min(maxJobs, len(branches))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        workers.append(t)
+        t.start()
+
+    created = set()
+    try:
+        while [thread for thread in workers if thread.isAlive()] or \
+              not results.empty():
+            try:
+                action = results.get(True, 0.5)
+            except Queue.Empty:
+                pass
+            else:
+                created.add(id(action))
+
+            if w:
+                w.set(len(created))
+    finally:
+        if w:
+            w.pop()
+
+    return [a for a in actions if id(a) not in created]
+
+def _reversed(s):
+    """ Return a key that sorts strings in reverse order. """
+    return tuple([-ord(c) for c in s] + [1])
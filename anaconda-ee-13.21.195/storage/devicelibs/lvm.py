@@ -369,6 +369,155 @@ def lvorigin(vg_name, lv_name):
 
     return origin
 
+# Start bulk report handling code
+#
+# Probing every PV, VG and snapshot separately costs a full LVM device scan
+# per call, so DeviceTree.populate takes one report of all PVs, VGs and LVs
+# up front and looks the metadata up here instead.
+LVM_REPORT_SEPARATOR = "|"
+
+LVM_REPORT_PV_FIELDS = ["pv_name", "pv_uuid", "pe_start", "vg_name", "vg_uuid"]
+LVM_REPORT_VG_FIELDS = ["vg_name", "vg_uuid", "vg_size", "vg_free",
+                        "vg_extent_size", "vg_extent_count", "vg_free_count",
+                        "pv_count"]
+LVM_REPORT_LV_FIELDS = ["vg_uuid", "lv_name", "lv_uuid", "lv_size", "lv_attr",
+                        "origin"]
+
+lvm_report = None   # None until lvm_report_refresh has been run
+
+def parse_lvm_report(buf, fields):
+    """ Parse the output of a separator delimited lvm report.
+
+        Return a list of dicts mapping field names to values, one dict per
+        report line. Lines with an unexpected number of fields are skipped.
+    """
+    rows = []
+    for line in buf.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        values = [v.strip() for v in line.split(LVM_REPORT_SEPARATOR)]
+        if len(values) != len(fields):
+            log.warning("unexpected lvm report line: %s" % line)
+            continue
+
+        rows.append(dict(zip(fields, values)))
+
+    return rows
+
+def _lvm_report_cmd(cmd, fields):
+    # sizes are reported in KB and converted to MB for consistency with the
+    # values we get from udev
+    args = [cmd, "--noheadings", "--nosuffix", "--units", "k",
+            "--separator", LVM_REPORT_SEPARATOR,
+            "-o", ",".join(fields)] + \
+            config_args
+
+    if cmd == "lvs":
+        # include mirror images and logs, which handleVgLvs needs
+        args.insert(1, "-a")
+
+    buf = iutil.execWithCapture("lvm", args, stderr="/dev/tty5")
+    return parse_lvm_report(buf, fields)
+
+def build_lvm_report(pv_rows, vg_rows, lv_rows):
+    """ Build the report cache from parsed pvs, vgs and lvs output.
+
+        The returned dict has "pvs", "vgs" and "lvs" keys. PVs are keyed
+        by both pv uuid and pv name, VGs by vg uuid and LVs by vg uuid with
+        a list of that VG's LVs, in report order, as the value.
+    """
+    report = {"pvs": {}, "vgs": {}, "lvs": {}}
+    for pv in pv_rows:
+        try:
+            pv["pe_start"] = float(pv["pe_start"]) / 1024
+        except ValueError:
+            log.warning("invalid pe_start for pv %s" % pv["pv_name"])
+            continue
+
+        report["pvs"][pv["pv_uuid"]] = pv
+        report["pvs"][pv["pv_name"]] = pv
+
+    for vg in vg_rows:
+        try:
+            for field in ("vg_size", "vg_free", "vg_extent_size"):
+                vg[field] = float(vg[field]) / 1024
+            for field in ("vg_extent_count", "vg_free_count", "pv_count"):
+                vg[field] = int(vg[field])
+        except ValueError:
+            log.warning("invalid data for vg %s" % vg["vg_name"])
+            continue
+
+        report["vgs"][vg["vg_uuid"]] = vg
+        report["lvs"][vg["vg_uuid"]] = []
+
+    for lv in lv_rows:
+        try:
+            lv["lv_size"] = float(lv["lv_size"]) / 1024
+        except ValueError:
+            log.warning("invalid size for lv %s" % lv["lv_name"])
+            continue
+
+        report["lvs"].setdefault(lv["vg_uuid"], []).append(lv)
+
+    return report
+
+def lvm_report_refresh():
+    """ Take a fresh report of all PVs, VGs and LVs.
+
+        This runs one pvs, one vgs and one lvs command in total, as opposed
+        to several per device.
+    """
+    global lvm_report
+    try:
+        pv_rows = _lvm_report_cmd("pvs", LVM_REPORT_PV_FIELDS)
+        vg_rows = _lvm_report_cmd("vgs", LVM_REPORT_VG_FIELDS)
+        lv_rows = _lvm_report_cmd("lvs", LVM_REPORT_LV_FIELDS)
+    except RuntimeError as e:
+        log.error("failed to take lvm report: %s" % e)
+        lvm_report = None
+        return
+
+    lvm_report = build_lvm_report(pv_rows, vg_rows, lv_rows)
+    log.info("lvm report: %d pvs, %d vgs, %d lvs"
+             % (len(pv_rows), len(vg_rows), len(lv_rows)))
+
+def lvm_report_reset():
+    """ Drop the report; lookups will return None until the next refresh. """
+    global lvm_report
+    lvm_report = None
+
+def lvm_report_get_pv(pv):
+    """ Return the report entry for a PV, by uuid or device path. """
+    if lvm_report is None or not pv:
+        return None
+    return lvm_report["pvs"].get(pv)
+
+def lvm_report_get_vg(vg_uuid):
+    """ Return the report entry for a VG. """
+    if lvm_report is None or not vg_uuid:
+        return None
+    return lvm_report["vgs"].get(vg_uuid)
+
+def lvm_report_get_lvs(vg_uuid):
+    """ Return the list of report entries for a VG's LVs.
+
+        None is returned if the VG is not in the report.
+    """
+    if lvm_report is None or not vg_uuid:
+        return None
+    return lvm_report["lvs"].get(vg_uuid)
+
+def lvm_report_get_origin(vg_uuid, lv_name):
+    """ Return the origin of a snapshot LV, or None if it is not known. """
+    for lv in lvm_report_get_lvs(vg_uuid) or []:
+        if lv["lv_name"] == lv_name:
+            return lv["origin"]
+
+    return None
+# End bulk report handling code
+
 def lvcreate(vg_name, lv_name, size, progress=None, pvs=[]):
     args = ["lvcreate"] + \
             ["-L", "%dm" % size] + \
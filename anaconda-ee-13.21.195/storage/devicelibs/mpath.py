@@ -80,36 +80,82 @@ def parseMultipathOutput(output):
     name = None
     devices = []
 
-    policy = re.compile('^[|+` -]+policy')
+    # the policy and path lines are drawn as a tree; only the path lines
+    # have a host:channel:target:lun
     device = re.compile('^[|+` -]+[0-9]+:[0-9]+:[0-9]+:[0-9]+ +([a-zA-Z0-9!/]+)')
     create = re.compile('^(?:([a-z]+): )?(mpath\w+|[a-f0-9]+)')
 
     lines = output.split('\n')
     for line in lines:
-        pmatch = policy.match(line)
-        dmatch = device.match(line)
-        cmatch = create.match(line)
-        lexemes = line.split()
-        if not lexemes:
+        if not line.split():
             break
+
+        if line[0] in "|+` -":
+            dmatch = device.match(line)
+            if dmatch:
+                devices.append(dmatch.group(1).replace('!','/'))
+            continue
+
+        cmatch = create.match(line)
         if cmatch and cmatch.group(2):
             if name and devices and action in (None, 'create'):
                 mpaths[name] = devices
             action = cmatch.group(1)
             name = cmatch.group(2)
             devices = []
-        elif lexemes[0].startswith('size='):
-            pass
-        elif pmatch:
-            pass
-        elif dmatch:
-            devices.append(dmatch.groups()[0].replace('!','/'))
 
     if name and devices and action in (None, 'create'):
         mpaths[name] = devices
 
     return mpaths
 
+# topologies found by identifyMultipaths, by _topologyKey
+_topologies = {}
+
+def _topologyKey(devices):
+    """ Return what multipath bases its topology on.
+
+        That is the configuration, the bindings file that names the maps
+        and the disks, with their serials.
+    """
+    files = []
+    for path in ("/etc/multipath.conf", "/etc/multipath/bindings"):
+        try:
+            f = open(path)
+            try:
+                files.append(f.read())
+            finally:
+                f.close()
+        except IOError:
+            files.append(None)
+
+    disks = [(d['name'], udev_device_get_serial(d)) for d in devices
+             if udev_device_is_disk(d)]
+    disks.sort()
+    return (tuple(files), tuple(disks))
+
+def getMultipathTopology(devices):
+    """ Return the multipath topology of devices.
+
+        It is found with "multipath -d" and "multipath -ll" the first time,
+        and then reused until the configuration or the disks change, or
+        the multipath maps are flushed.  See parseMultipathOutput for the
+        format.
+    """
+    key = _topologyKey(devices)
+    if _topologies.has_key(key):
+        log.info("using cached multipath topology")
+        return _topologies[key].copy()
+
+    topology = parseMultipathOutput(
+        iutil.execWithCapture("multipath", ["-d",]))
+    topology.update(parseMultipathOutput(
+            iutil.execWithCapture("multipath", ["-ll",])))
+
+    _topologies.clear()
+    _topologies[key] = topology
+    return topology.copy()
+
 def identifyMultipaths(devices):
     """
     This function does a couple of things:
@@ -139,10 +185,7 @@ def identifyMultipaths(devices):
         map(lambda line: log.debug(line.rstrip()), conf)
         log.debug("(end of /etc/multipath.conf)")
 
-    topology = parseMultipathOutput(
-        iutil.execWithCapture("multipath", ["-d",]))
-    topology.update(parseMultipathOutput(
-            iutil.execWithCapture("multipath", ["-ll",])))
+    topology = getMultipathTopology(devices)
     # find the devices that aren't in topology, and add them into it...
     topodevs = reduce(lambda x,y: x.union(y), topology.values(), set())
     for name in set([d['name'] for d in devices]).difference(topodevs):
@@ -212,9 +255,12 @@ def identifyMultipaths(devices):
 
     # this is the list of devices we want to keep from the original
     # device list, but we want to maintain its original order.
-    singlepath_disks = filter(lambda d: d in devices, singlepath_disks)
-    #multipaths = filter(lambda d: d in devices, multipaths)
-    partition_devices = filter(lambda d: d in devices, partition_devices)
+    # the udev dicts are compared by identity, comparing their contents
+    # with every device's gets slow with hundreds of paths
+    ids = set([id(d) for d in devices])
+    singlepath_disks = filter(lambda d: id(d) in ids, singlepath_disks)
+    #multipaths = filter(lambda d: id(d) in ids, multipaths)
+    partition_devices = filter(lambda d: id(d) in ids, partition_devices)
 
     mpathStr = "["
     for mpath in multipaths:
@@ -319,7 +365,39 @@ def writeMultipathConf(writer=None, friendly_names=True):
     with open("/etc/multipath.conf", "w+") as mpath_cfg:
         mpath_cfg.write(cfg)
 
+def setup_multipaths(names):
+    """ Activate the multipath maps names and their partitions.
+
+        The maps are created by one batch of "multipath <name>" and their
+        partitions by one batch of kpartx, waiting for udev once for each
+        batch rather than for every map.  Maps multipath fails to create
+        are left alone, for MultipathDevice.setup to report.  Return the
+        names of the maps whose partitions could not be activated.
+    """
+    if not names:
+        return []
+
+    rcs = iutil.execBatchWithRedirect(
+            [("multipath", [name]) for name in names],
+            stdout = "/dev/tty5",
+            stderr = "/dev/tty5")
+    udev_settle()
+
+    created = [name for (name, rc) in zip(names, rcs) if not rc]
+    if len(created) != len(names):
+        log.error("multipath activation failed for %s"
+                  % [name for name in names if name not in created])
+
+    rcs = iutil.execBatchWithRedirect(
+            [("kpartx", ["-a", "-p", "p", "/dev/mapper/%s" % name])
+             for name in created],
+            stdout = "/dev/tty5",
+            stderr = "/dev/tty5")
+    udev_settle()
+    return [name for (name, rc) in zip(created, rcs) if rc]
+
 def flush_mpaths():
+    _topologies.clear()
     iutil.execWithRedirect("multipath", ["-F"])
     check_output = iutil.execWithCapture("multipath", ["-ll"]).strip()
     if check_output:
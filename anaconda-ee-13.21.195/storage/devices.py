@@ -198,6 +198,20 @@ class Device(object):
     # This is a counter for generating unique ids for Devices.
     _id = 0
 
+    # Ids of devices whose name, path, parents, sysfs path, uuid or format
+    # changed, in the order the changes happened. DeviceTree replays this log
+    # to keep its lookup indexes and views current. See
+    # Device.noteIndexedChange.
+    changeLog = []
+
+    # Number of entries trimmed off the front of changeLog. Positions in
+    # the log are counted from the first entry ever recorded.
+    changeLogBase = 0
+
+    # Bumped whenever any device's parents change. Cached ancestor sets
+    # are only valid for the generation they were computed in.
+    parentsGeneration = 0
+
     _type = "generic device"
     _packages = []
     _services = []
@@ -219,7 +233,9 @@ class Device(object):
             parents = []
         elif not isinstance(parents, list):
             raise ValueError("parents must be a list of Device instances")
-        self.parents = parents
+        self._parents = parents
+        self._ancestors = None
+        self._ancestorsGeneration = None
         self.kids = 0
 
         # Set this instance's id and increment the counter.
@@ -312,15 +328,59 @@ class Device(object):
                 raise DeviceError("parent device does not exist", self.name)
             #parent.create()
 
+    def noteIndexedChange(self):
+        """ Record that an attribute DeviceTree indexes on has changed. """
+        Device.changeLog.append(self.id)
+
+    def noteParentsChange(self):
+        """ Record that this device's parents have changed.
+
+            Code that modifies the parents list in place must call this,
+            since DeviceTree's children map and the cached ancestor sets
+            are derived from it.
+        """
+        Device.parentsGeneration += 1
+        self.noteIndexedChange()
+
+    def _setParents(self, parents):
+        self._parents = parents
+        self.noteParentsChange()
+
+    parents = property(lambda d: d._parents,
+                       lambda d,p: d._setParents(p),
+                       doc="list of devices this device is built on")
+
+    @property
+    def ancestors(self):
+        """ Set of the devices this device is built on, directly or not.
+
+            The set is cached until any device's parents change. Callers
+            must not modify it.
+        """
+        if self._ancestorsGeneration != Device.parentsGeneration:
+            ancestors = set(self.parents)
+            for parent in self.parents:
+                ancestors.update(parent.ancestors)
+
+            self._ancestors = ancestors
+            self._ancestorsGeneration = Device.parentsGeneration
+
+        return self._ancestors
+
     def dependsOn(self, dep):
         """ Return True if this device depends on dep. """
         # XXX does a device depend on itself?
-        if dep in self.parents:
+        ancestors = self.ancestors
+        if dep in ancestors:
             return True
 
-        for parent in self.parents:
-            if parent.dependsOn(dep):
-                return True
+        # logical partitions, and so everything built on them, also depend
+        # on the extended partition of their disk
+        if isinstance(dep, PartitionDevice) and dep.isExtended:
+            for ancestor in ancestors:
+                if isinstance(ancestor, PartitionDevice) and \
+                   ancestor.dependsOn(dep):
+                    return True
 
         return False
 
@@ -582,6 +642,14 @@ class StorageDevice(Device):
         self.sysfsPath = os.path.realpath(path)[4:]
         log.debug("%s sysfsPath set to %s" % (self.name, self.sysfsPath))
 
+    def _setSysfsPath(self, path):
+        self._sysfsPath = path
+        self.noteIndexedChange()
+
+    sysfsPath = property(lambda d: d._sysfsPath,
+                         lambda d,p: d._setSysfsPath(p),
+                         doc="The device's sysfs path.")
+
     @property
     def formatArgs(self):
         """ Device-specific arguments to format creation program. """
@@ -729,6 +797,7 @@ class StorageDevice(Device):
 
         self._format = format
         self._format.device = self.path
+        self.noteIndexedChange()
 
     def _getFormat(self):
         return self._format
@@ -1226,10 +1295,13 @@ class PartitionDevice(StorageDevice):
 
     def updateName(self):
         if self.partedPartition is None:
-            self._name = self.req_name
+            name = self.req_name
         else:
-            self._name = \
-                devicePathToName(self.partedPartition.getDeviceNodeName())
+            name = devicePathToName(self.partedPartition.getDeviceNodeName())
+
+        if name != self._name:
+            self._name = name
+            self.noteIndexedChange()
 
     def dependsOn(self, dep):
         """ Return True if this device depends on dep. """
@@ -1645,6 +1717,7 @@ class DMDevice(StorageDevice):
             raise DeviceError("cannot rename active device", self.name)
 
         self._name = name
+        self.noteIndexedChange()
         #self.sysfsPath = "/dev/disk/by-id/dm-name-%s" % self.name
 
     name = property(lambda d: d._name,
@@ -1751,6 +1824,7 @@ class LUKSDevice(DMCryptDevice):
         #if not self.slave.format.exists:
         #    self.slave.format.create()
         self._name = self.slave.format.mapName
+        self.noteIndexedChange()
         self.exists = True
         self.setup()
 
@@ -2021,6 +2095,7 @@ class LVMVolumeGroupDevice(DMDevice):
             raise ValueError("device is already a member of this VG")
 
         self.parents.append(device)
+        self.noteParentsChange()
         device.addChild()
 
         # now see if the VG can be activated
@@ -2041,6 +2116,7 @@ class LVMVolumeGroupDevice(DMDevice):
         except ValueError, e:
             raise ValueError("cannot remove non-member PV device from VG")
 
+        self.noteParentsChange()
         device.removeChild()
 
     def setup(self, intf=None, orig=False):
@@ -2128,6 +2204,15 @@ class LVMVolumeGroupDevice(DMDevice):
         lvm.vgreduce(self.name, pv_list)
         # XXX do we need to notify the kernel?
 
+    def _setName(self, name):
+        """ Set the vg's name, which is part of its lvs' names too. """
+        DMDevice._setName(self, name)
+        for lv in self._lvs:
+            lv.noteIndexedChange()
+
+    name = property(lambda d: d._name,
+                    lambda d,n: d._setName(n))
+
     def _addLogVol(self, lv):
         """ Add an LV to this VG. """
         if lv in self._lvs:
@@ -2158,6 +2243,7 @@ class LVMVolumeGroupDevice(DMDevice):
             raise DeviceError("cannot add pv to existing vg", self.name)
 
         self.parents.append(pv)
+        self.noteParentsChange()
         pv.addChild()
 
         # and update our pv count
@@ -2173,6 +2259,7 @@ class LVMVolumeGroupDevice(DMDevice):
             raise DeviceError("cannot remove pv from existing vg", self.name)
 
         self.parents.remove(pv)
+        self.noteParentsChange()
         pv.removeChild()
 
         # and update our pv count
@@ -2963,6 +3050,7 @@ class MDRaidArrayDevice(StorageDevice):
 
         # we added it, so now set up the relations
         self.devices.append(device)
+        self.noteParentsChange()
         device.addChild()
 
         device.setup()
@@ -2999,6 +3087,7 @@ class MDRaidArrayDevice(StorageDevice):
             raise ValueError("cannot remove non-member device from array")
 
         self.devices.remove(device)
+        self.noteParentsChange()
         device.removeChild()
 
     @property
@@ -3156,6 +3245,7 @@ class MDRaidArrayDevice(StorageDevice):
             self.updateSysfsPath()
             info = udev_get_block_device(self.sysfsPath)
             self.uuid = udev_device_get_md_uuid(info)
+            self.noteIndexedChange()
             for member in self.devices:
                 member.mdUuid = self.uuid
         finally:
@@ -3275,6 +3365,7 @@ class DMRaidArrayDevice(DMDevice):
 
         # we added it, so now set up the relations
         self.devices.append(device)
+        self.noteParentsChange()
         device.addChild()
 
     @property
@@ -3413,6 +3504,7 @@ class MultipathDevice(DMDevice):
             self.setup()
         else:
             self.parents.append(parent)
+        self.noteParentsChange()
 
     def setupPartitions(self):
         log_method_call(self, name=self.name, kids=self.kids)
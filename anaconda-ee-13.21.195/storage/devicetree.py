@@ -22,6 +22,7 @@
 
 import os
 import stat
+import weakref
 import block
 import re
 
@@ -48,6 +49,17 @@ _ = lambda x: gettext.ldgettext("anaconda", x)
 import logging
 log = logging.getLogger("storage")
 
+# trees whose position in Device.changeLog keeps the log from being trimmed
+_liveTrees = weakref.WeakKeyDictionary()
+
+def _trimChangeLog():
+    """ Drop the part of Device.changeLog that every live tree has seen. """
+    end = Device.changeLogBase + len(Device.changeLog)
+    start = min([t._changeLogPos for t in _liveTrees.keys()] + [end])
+    if start > Device.changeLogBase:
+        del Device.changeLog[:start - Device.changeLogBase]
+        Device.changeLogBase = start
+
 def getLUKSPassphrase(intf, device, globalPassphrase):
     """ Obtain a passphrase for a LUKS encrypted block device.
 
@@ -160,6 +172,30 @@ class DeviceTree(object):
         self._devices = []
         self._actions = []
 
+        # registered actions keyed by device id and action object type, in
+        # queue order
+        self._actionIndex = {}
+        self._actionOrder = {}
+        self._nextActionOrder = 0
+
+        # lookup indexes, keyed by index name and then attribute value; see
+        # _indexDevice for the details
+        self._deviceIndexes = {}
+        for index in self._indexNames:
+            self._deviceIndexes[index] = {}
+        self._deviceIndexKeys = {}
+        self._deviceOrder = {}
+        self._nextDeviceOrder = 0
+        self._changeLogPos = Device.changeLogBase + len(Device.changeLog)
+        _liveTrees[self] = True
+
+        # bumped whenever a device is added, removed or changes an indexed
+        # attribute; cached views built by getView are only valid for the
+        # generation they were built in
+        self._generation = 0
+        self._views = {}
+        self._viewsGeneration = 0
+
         # indicates whether or not the tree has been fully populated
         self.populated = False
 
@@ -182,6 +218,13 @@ class DeviceTree(object):
 
         self.unusedRaidMembers = []
 
+        # block device uevents received after populate, applied by refresh
+        self._monitor = None
+
+        # udev properties of the devices in the tree, by sysfs path, so that
+        # refresh can tell which change events actually changed something
+        self._udevSignatures = {}
+
         self.__multipaths = {}
         self.__multipathConfigWriter = devicelibs.mpath.MultipathConfigWriter()
 
@@ -199,468 +242,199 @@ class DeviceTree(object):
         lvm.lvm_cc_addFilterRejectRegexp(disk)
 
     def pruneActions(self):
-        """ Prune loops and redundant actions from the queue. """
-        # handle device destroy actions
-        actions = self.findActions(type="destroy", object="device")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
-
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            destroys = self.findActions(devid=a.device.id,
-                                        type="destroy",
-                                        object="device")
-
-            creates = self.findActions(devid=a.device.id,
-                                       type="create",
-                                       object="device")
-            log.debug("found %d create and %d destroy actions for device id %d"
-                        % (len(creates), len(destroys), a.device.id))
-
-            # If the device is not preexisting, we remove all actions up
-            # to and including the last destroy action.
-            # If the device is preexisting, we remove all actions from
-            # after the first destroy action up to and including the last
-            # destroy action.
-            # If the device is preexisting and there is only one device
-            # destroy action we remove all resize and format create/migrate
-            # actions on that device that precede the destroy action.
-            loops = []
-            first_destroy_idx = None
-            first_create_idx = None
-            stop_action = None
-            start = None
-            if len(destroys) > 1:
-                # there are multiple destroy actions for this device
-                loops = destroys
-                first_destroy_idx = self._actions.index(loops[0])
-                start = self._actions.index(a) + 1
-                stop_action = destroys[-1]
-
-            if creates:
-                first_create_idx = self._actions.index(creates[0])
-                if not loops or first_destroy_idx > first_create_idx:
-                    # this device is not preexisting
-                    start = first_create_idx
-                    stop_action = destroys[-1]
-
-            dev_actions = self.findActions(devid=a.device.id)
-            if start is None:
-                # only one device destroy, so prune preceding resizes and
-                # format creates and migrates
-                for _a in dev_actions[:]:
-                    if _a.isResize() or (_a.isFormat() and not _a.isDestroy()):
-                        continue
-
-                    dev_actions.remove(_a)
-
-                if not dev_actions:
-                    # nothing to prune
-                    continue
-
-                start = self._actions.index(dev_actions[0])
-                stop_action = dev_actions[-1]
-
-            # now we remove all actions on this device between the start
-            # index (into self._actions) and stop_action.
-            for rem in dev_actions:
-                end = self._actions.index(stop_action)
-                if start <= self._actions.index(rem) <= end:
-                    log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                    self._actions.remove(rem)
+        """ Prune loops and redundant actions from the queue.
 
-                if rem == stop_action:
-                    break
+            Every rule only looks at the actions on a single device, so the
+            queue is pruned one device at a time using the action index.
+        """
+        devids = []
+        seen = set()
+        for action in self._actions:
+            if action.device.id not in seen:
+                seen.add(action.device.id)
+                devids.append(action.device.id)
 
-        # device create actions
-        actions = self.findActions(type="create", object="device")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+        pruned = set()
+        for devid in devids:
+            actions = self.findActions(devid=devid)
+            for action in self._pruneDeviceActions(actions):
+                pruned.add(id(action))
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            creates = self.findActions(devid=a.device.id,
-                                       type="create",
-                                       object="device")
-
-            destroys = self.findActions(devid=a.device.id,
-                                        type="destroy",
-                                        object="device")
-
-            # If the device is preexisting, we remove everything between
-            # the first destroy and the last create.
-            # If the device is not preexisting, we remove everything up to
-            # the last create.
-            loops = []
-            first_destroy_idx = None
-            first_create_idx = None
-            stop_action = None
-            start = None
-            if len(creates) > 1:
-                # there are multiple create actions for this device
-                loops = creates
-                first_create_idx = self._actions.index(loops[0])
-                start = 0
-                stop_action = creates[-1]
-
-            if destroys:
-                first_destroy_idx = self._actions.index(destroys[0])
-                if not loops or first_create_idx > first_destroy_idx:
-                    # this device is preexisting
-                    start = first_destroy_idx + 1
-                    stop_action = creates[-1]
+        if pruned:
+            self._setActions([a for a in self._actions
+                                if id(a) not in pruned])
 
-            if start is None:
-                continue
+    def _pruneDeviceActions(self, actions):
+        """ Prune loops and redundant actions on one device.
 
-            # remove all actions on this from after the first destroy up
-            # to the last create
-            dev_actions = self.findActions(devid=a.device.id)
-            for rem in dev_actions:
-                if rem == stop_action:
-                    break
+            actions is the list of actions on the device in queue order.
+            The pruned actions are removed from it and returned.
+        """
+        pruned = []
+
+        def find(type=None, object=None):
+            return [a for a in actions
+                        if (type is None or a.type == type) and
+                           (object is None or a.obj == object)]
+
+        def remove(rem):
+            log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
+            actions.remove(rem)
+            pruned.append(rem)
+
+        def index(action):
+            # position in the queue
+            return self._actionOrder[id(action)]
+
+        def pruneDestroys(object):
+            for a in find(ACTION_TYPE_DESTROY, object):
+                if a not in actions:
+                    # we may have removed some of the actions in a previous
+                    # iteration of this loop
+                    continue
 
-                end = self._actions.index(stop_action)
-                if start <= self._actions.index(rem) < end:
-                    log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                    self._actions.remove(rem)
-
-        # device resize actions
-        actions = self.findActions(type="resize", object="device")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+                log.debug("action '%s' (%s)" % (a, id(a)))
+                destroys = find(ACTION_TYPE_DESTROY, object)
+                creates = find(ACTION_TYPE_CREATE, object)
+                log.debug("found %d create and %d destroy actions for "
+                          "device id %d" % (len(creates), len(destroys),
+                                            a.device.id))
+
+                # If the device is not preexisting, we remove all actions up
+                # to and including the last destroy action.
+                # If the device is preexisting, we remove all actions from
+                # after the first destroy action up to and including the last
+                # destroy action.
+                # If the device is preexisting and there is only one device
+                # destroy action we remove all resize and format create/migrate
+                # actions on that device that precede the destroy action.
+                loops = []
+                first_destroy_idx = None
+                first_create_idx = None
+                stop_action = None
+                start = None
+                if len(destroys) > 1:
+                    # there are multiple destroy actions for this device
+                    loops = destroys
+                    first_destroy_idx = index(loops[0])
+                    start = index(a) + 1
+                    stop_action = destroys[-1]
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            loops = self.findActions(devid=a.device.id,
-                                     type="resize",
-                                     object="device")
+                if creates:
+                    first_create_idx = index(creates[0])
+                    if not loops or first_destroy_idx > first_create_idx:
+                        # this device is not preexisting
+                        start = first_create_idx
+                        stop_action = destroys[-1]
 
-            if len(loops) == 1:
-                continue
+                if object == ACTION_OBJECT_FORMAT:
+                    if start is None:
+                        continue
 
-            # remove all but the last resize action on this device
-            for rem in loops[:-1]:
-                log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                self._actions.remove(rem)
-
-        # format destroy
-        # XXX I don't think there's a way for these loops to happen
-        actions = self.findActions(type="destroy", object="format")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+                    dev_actions = find(object=object)
+                else:
+                    dev_actions = find()
+
+                if start is None:
+                    # only one device destroy, so prune preceding resizes and
+                    # format creates and migrates
+                    dev_actions = [_a for _a in dev_actions
+                                    if _a.isResize() or
+                                       (_a.isFormat() and not _a.isDestroy())]
+                    if not dev_actions:
+                        # nothing to prune
+                        continue
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            destroys = self.findActions(devid=a.device.id,
-                                        type="destroy",
-                                        object="format")
-
-            creates = self.findActions(devid=a.device.id,
-                                       type="create",
-                                       object="format")
-
-            # If the format is not preexisting, we remove all actions up
-            # to and including the last destroy action.
-            # If the format is preexisting, we remove all actions from
-            # after the first destroy action up to and including the last
-            # destroy action.
-            loops = []
-            first_destroy_idx = None
-            first_create_idx = None
-            stop_action = None
-            start = None
-            if len(destroys) > 1:
-                # there are multiple destroy actions for this format
-                loops = destroys
-                first_destroy_idx = self._actions.index(loops[0])
-                start = self._actions.index(a) + 1
-                stop_action = destroys[-1]
-
-            if creates:
-                first_create_idx = self._actions.index(creates[0])
-                if not loops or first_destroy_idx > first_create_idx:
-                    # this format is not preexisting
-                    start = first_create_idx
-                    stop_action = destroys[-1]
+                    start = index(dev_actions[0])
+                    stop_action = dev_actions[-1]
 
-            if start is None:
-                continue
+                # now we remove all actions on this device between the start
+                # index (into the queue) and stop_action.
+                end = index(stop_action)
+                for rem in dev_actions:
+                    if start <= index(rem) <= end:
+                        remove(rem)
 
-            # now we remove all actions on this device's format between
-            # the start index (into self._actions) and stop_action.
-            dev_actions = self.findActions(devid=a.device.id,
-                                           object="format")
-            for rem in dev_actions:
-                end = self._actions.index(stop_action)
-                if start <= self._actions.index(rem) <= end:
-                    log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                    self._actions.remove(rem)
-
-                if rem == stop_action:
-                    break
+                    if rem == stop_action:
+                        break
 
-        # format create
-        # XXX I don't think there's a way for these loops to happen
-        actions = self.findActions(type="create", object="format")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+        def pruneCreates(object):
+            for a in find(ACTION_TYPE_CREATE, object):
+                if a not in actions:
+                    # we may have removed some of the actions in a previous
+                    # iteration of this loop
+                    continue
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            creates = self.findActions(devid=a.device.id,
-                                       type="create",
-                                       object="format")
-
-            destroys = self.findActions(devid=a.device.id,
-                                        type="destroy",
-                                        object="format")
-
-            # If the format is preexisting, we remove everything between
-            # the first destroy and the last create.
-            # If the format is not preexisting, we remove everything up to
-            # the last create.
-            loops = []
-            first_destroy_idx = None
-            first_create_idx = None
-            stop_action = None
-            start = None
-            if len(creates) > 1:
-                # there are multiple create actions for this format
-                loops = creates
-                first_create_idx = self._actions.index(loops[0])
-                start = 0
-                stop_action = creates[-1]
-
-            if destroys:
-                first_destroy_idx = self._actions.index(destroys[0])
-                if not loops or first_create_idx > first_destroy_idx:
-                    # this format is preexisting
-                    start = first_destroy_idx + 1
+                log.debug("action '%s' (%s)" % (a, id(a)))
+                creates = find(ACTION_TYPE_CREATE, object)
+                destroys = find(ACTION_TYPE_DESTROY, object)
+
+                # If the device is preexisting, we remove everything between
+                # the first destroy and the last create.
+                # If the device is not preexisting, we remove everything up to
+                # the last create.
+                loops = []
+                first_destroy_idx = None
+                first_create_idx = None
+                stop_action = None
+                start = None
+                if len(creates) > 1:
+                    # there are multiple create actions for this device
+                    loops = creates
+                    first_create_idx = index(loops[0])
+                    start = 0
                     stop_action = creates[-1]
 
-            if start is None:
-                continue
+                if destroys:
+                    first_destroy_idx = index(destroys[0])
+                    if not loops or first_create_idx > first_destroy_idx:
+                        # this device is preexisting
+                        start = first_destroy_idx + 1
+                        stop_action = creates[-1]
 
-            # remove all actions on this from after the first destroy up
-            # to the last create
-            dev_actions = self.findActions(devid=a.device.id,
-                                           object="format")
-            for rem in dev_actions:
-                if rem == stop_action:
-                    break
+                if start is None:
+                    continue
 
-                end = self._actions.index(stop_action)
-                if start <= self._actions.index(rem) < end:
-                    log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                    self._actions.remove(rem)
-
-        # format resize
-        actions = self.findActions(type="resize", object="format")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+                # remove all actions on this from after the first destroy up
+                # to the last create
+                end = index(stop_action)
+                if object == ACTION_OBJECT_FORMAT:
+                    dev_actions = find(object=object)
+                else:
+                    dev_actions = find()
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            loops = self.findActions(devid=a.device.id,
-                                     type="resize",
-                                     object="format")
+                for rem in dev_actions:
+                    if rem == stop_action:
+                        break
 
-            if len(loops) == 1:
-                continue
+                    if start <= index(rem) < end:
+                        remove(rem)
 
-            # remove all but the last resize action on this format
-            for rem in loops[:-1]:
-                log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                self._actions.remove(rem)
-
-        # format migrate
-        # XXX I don't think there's away for these loops to occur
-        actions = self.findActions(type="migrate", object="format")
-        for a in actions:
-            if a not in self._actions:
-                # we may have removed some of the actions in a previous
-                # iteration of this loop
-                continue
+        def pruneRepeats(type, object):
+            # remove all but the last action of this type
+            loops = find(type, object)
+            if len(loops) > 1:
+                log.debug("action '%s' (%s)" % (loops[0], id(loops[0])))
+                for rem in loops[:-1]:
+                    remove(rem)
 
-            log.debug("action '%s' (%s)" % (a, id(a)))
-            loops = self.findActions(devid=a.device.id,
-                                     type="migrate",
-                                     object="format")
+        # device destroy, create and resize actions
+        pruneDestroys(ACTION_OBJECT_DEVICE)
+        pruneCreates(ACTION_OBJECT_DEVICE)
+        pruneRepeats(ACTION_TYPE_RESIZE, ACTION_OBJECT_DEVICE)
 
-            if len(loops) == 1:
-                continue
+        # format destroy, create, resize and migrate actions
+        # XXX I don't think there's a way for the destroy, create and migrate
+        #     loops to happen
+        pruneDestroys(ACTION_OBJECT_FORMAT)
+        pruneCreates(ACTION_OBJECT_FORMAT)
+        pruneRepeats(ACTION_TYPE_RESIZE, ACTION_OBJECT_FORMAT)
+        pruneRepeats(ACTION_TYPE_MIGRATE, ACTION_OBJECT_FORMAT)
 
-            # remove all but the last migrate action on this format
-            for rem in loops[:-1]:
-                log.debug(" removing action '%s' (%s)" % (rem, id(rem)))
-                self._actions.remove(rem)
+        return pruned
 
     def processActions(self, dryRun=None):
         """ Execute all registered actions. """
-        # in most cases the actions will already be sorted because of the
-        # rules for registration, but let's not rely on that
-        def cmpActions(a1, a2):
-            ret = 0
-            if a1.isDestroy() and a2.isDestroy():
-                if a1.device.path == a2.device.path:
-                    # if it's the same device, destroy the format first
-                    if a1.isFormat() and a2.isFormat():
-                        ret = 0
-                    elif a1.isFormat() and not a2.isFormat():
-                        ret = -1
-                    elif not a1.isFormat() and a2.isFormat():
-                        ret = 1
-                elif a1.device.dependsOn(a2.device):
-                    ret = -1
-                elif a2.device.dependsOn(a1.device):
-                    ret = 1
-                # generally destroy partitions after lvs, vgs, &c
-                elif isinstance(a1.device, PartitionDevice) and \
-                     isinstance(a2.device, PartitionDevice):
-                    if a1.device.disk == a2.device.disk:
-                        ret = cmp(a2.device.partedPartition.number,
-                                  a1.device.partedPartition.number)
-                    else:
-                        ret = cmp(a2.device.name, a1.device.name)
-                elif isinstance(a1.device, PartitionDevice) and \
-                     a2.device.partitioned:
-                    ret = -1
-                elif isinstance(a2.device, PartitionDevice) and \
-                     a1.device.partitioned:
-                    ret = 1
-                # remove partitions before unpartitioned non-partition
-                # devices
-                elif isinstance(a1.device, PartitionDevice) and \
-                     not isinstance(a2.device, PartitionDevice):
-                    ret = 1
-                elif isinstance(a2.device, PartitionDevice) and \
-                     not isinstance(a1.device, PartitionDevice):
-                    ret = -1
-                else:
-                    ret = 0
-            elif a1.isDestroy():
-                ret = -1
-            elif a2.isDestroy():
-                ret = 1
-            elif a1.isResize() and a2.isResize():
-                if a1.device.path == a2.device.path:
-                    if a1.obj == a2.obj:
-                        ret = 0
-                    elif a1.isFormat() and not a2.isFormat():
-                        # same path, one device, one format
-                        if a1.isGrow():
-                            ret = 1
-                        else:
-                            ret = -1
-                    elif not a1.isFormat() and a2.isFormat():
-                        # same path, one device, one format
-                        if a1.isGrow():
-                            ret = -1
-                        else:
-                            ret = 1
-                    else:
-                        ret = cmp(a1.device.name, a2.device.name)
-                elif a1.device.dependsOn(a2.device):
-                    if a1.isGrow():
-                        ret = 1
-                    else:
-                        ret = -1
-                elif a2.device.dependsOn(a1.device):
-                    if a1.isGrow():
-                        ret = -1
-                    else:
-                        ret = 1
-                elif isinstance(a1.device, PartitionDevice) and \
-                     isinstance(a2.device, PartitionDevice):
-                    ret = cmp(a1.device.name, a2.device.name)
-                else:
-                    ret = 0
-            elif a1.isResize():
-                ret = -1
-            elif a2.isResize():
-                ret = 1
-            elif a1.isCreate() and a2.isCreate():
-                if a1.device.path == a2.device.path:
-                    if a1.obj == a2.obj:
-                        ret = 0
-                    if a1.isFormat():
-                        ret = 1
-                    elif a2.isFormat():
-                        ret = -1
-                    else:
-                        ret = 0
-                elif a1.device.dependsOn(a2.device):
-                    ret = 1
-                elif a2.device.dependsOn(a1.device):
-                    ret = -1
-                # generally create partitions before other device types
-                elif isinstance(a1.device, PartitionDevice) and \
-                     isinstance(a2.device, PartitionDevice):
-                    if a1.device.disk == a2.device.disk:
-                        ret = cmp(a1.device.partedPartition.number,
-                                  a2.device.partedPartition.number)
-                    else:
-                        ret = cmp(a1.device.name, a2.device.name)
-                elif isinstance(a1.device, LVMLogicalVolumeDevice) and \
-                     isinstance(a2.device, LVMLogicalVolumeDevice) and \
-                     a1.device.vg == a2.device.vg:
-                    if a1.device.singlePV and not a2.device.singlePV:
-                        ret = -1
-                    elif not a1.device.singlePV and a2.device.singlePV:
-                        ret = 1
-                elif isinstance(a1.device, PartitionDevice) and \
-                     a2.device.partitioned:
-                    ret = 1
-                elif isinstance(a2.device, PartitionDevice) and \
-                     a1.device.partitioned:
-                    ret = -1
-                elif isinstance(a1.device, PartitionDevice) and \
-                     not isinstance(a2.device, PartitionDevice):
-                    ret = -1
-                elif isinstance(a2.device, PartitionDevice) and \
-                     not isinstance(a1.device, PartitionDevice):
-                    ret = 1
-                else:
-                    ret = 0
-            elif a1.isCreate():
-                ret = -1
-            elif a2.isCreate():
-                ret = 1
-            elif a1.isMigrate() and a2.isMigrate():
-                if a1.device.path == a2.device.path:
-                    ret = 0
-                elif a1.device.dependsOn(a2.device):
-                    ret = 1
-                elif a2.device.dependsOn(a1.device):
-                    ret = -1
-                elif isinstance(a1.device, PartitionDevice) and \
-                     isinstance(a2.device, PartitionDevice):
-                    if a1.device.disk == a2.device.disk:
-                        ret = cmp(a1.device.partedPartition.number,
-                                  a2.device.partedPartition.number)
-                    else:
-                        ret = cmp(a1.device.name, a2.device.name)
-                else:
-                    ret = 0
-            else:
-                ret = 0
-
-            log.debug("cmp: %d -- %s | %s" % (ret, a1, a2))
-            return ret
-
         log.debug("resetting parted disks...")
         for device in self.devices:
             if device.partitioned:
@@ -691,7 +465,7 @@ class DeviceTree(object):
                device.isExtended and not device.exists:
                 # don't properly register the action since the device is
                 # already in the tree
-                self._actions.append(ActionCreateDevice(device))
+                self._appendAction(ActionCreateDevice(device))
 
         for action in self._actions:
             log.debug("action: %s" % action)
@@ -701,12 +475,28 @@ class DeviceTree(object):
         for action in self._actions:
             log.debug("action: %s" % action)
 
+        # in most cases the actions will already be sorted because of the
+        # rules for registration, but let's not rely on that
         log.debug("sorting actions...")
-        self._actions.sort(cmp=cmpActions)
+        graph = ActionGraph(self._actions)
+        self._setActions(graph.sortedActions())
         for action in self._actions:
             log.debug("action: %s" % action)
 
+        # filesystems nothing else waits for are created together at the
+        # end of the create phase
+        deferred = []
         for action in self._actions:
+            if deferred and not action.isCreate():
+                self._createFormats(graph, deferred)
+                deferred = []
+
+            if not dryRun and action.isCreate() and action.isFormat() and \
+               action.concurrent and not graph.successors(action):
+                log.info("deferring action: %s" % action)
+                deferred.append(action)
+                continue
+
             log.info("executing action: %s" % action)
             if not dryRun:
                 try:
@@ -717,12 +507,53 @@ class DeviceTree(object):
                     self.teardownAll()
                     action.execute(intf=self.intf)
 
-                udev_settle()
-                for device in self._devices:
-                    # make sure we catch any renumbering parted does
-                    if device.exists and isinstance(device, PartitionDevice):
-                        device.updateName()
-                        device.format.device = device.path
+                self._updatePartitionNames()
+
+        if deferred:
+            self._createFormats(graph, deferred)
+
+    def _updatePartitionNames(self):
+        udev_settle()
+        for device in self._devices:
+            # make sure we catch any renumbering parted does
+            if device.exists and isinstance(device, PartitionDevice):
+                device.updateName()
+                device.format.device = device.path
+
+    def _createFormats(self, graph, actions):
+        """ Execute independent filesystem create actions concurrently.
+
+            Formats on devices with no common ancestor are created at the
+            same time. If anything goes wrong the remaining formats are
+            created one at a time as usual.
+        """
+        for action in actions:
+            log.info("executing action: %s" % action)
+
+        try:
+            for action in actions:
+                action.prepare()
+        except DiskLabelCommitError:
+            # see above
+            self.teardownAll()
+            for action in actions:
+                action.prepare()
+
+        self._updatePartitionNames()
+        branches = graph.branches(actions)
+        log.info("creating %d formats in %d independent branches"
+                 % (len(actions), len(branches)))
+        remaining = createFormatsConcurrently(branches, intf=self.intf)
+        if remaining:
+            log.info("creating %d remaining formats serially" % len(remaining))
+
+        remaining = set([id(a) for a in remaining])
+        for action in actions:
+            if id(action) in remaining:
+                action.createFormat(intf=self.intf)
+            action.finish()
+
+        self._updatePartitionNames()
 
     def _addDevice(self, newdev):
         """ Add a device to the tree.
@@ -730,16 +561,20 @@ class DeviceTree(object):
             Raise ValueError if the device's identifier is already
             in the list.
         """
-        if newdev.path in [d.path for d in self._devices] and \
+        if self._getIndexedDevices("path", newdev.path) and \
            not isinstance(newdev, NoDevice):
             raise ValueError("device is already in tree")
 
         # make sure this device's parent devices are in the tree already
         for parent in newdev.parents:
-            if parent not in self._devices:
+            if not self._inTree(parent):
                 raise DeviceTreeError("parent device not in tree")
 
         self._devices.append(newdev)
+        self._deviceOrder[newdev.id] = self._nextDeviceOrder
+        self._nextDeviceOrder += 1
+        self._indexDevice(newdev)
+        self._generation += 1
         log.debug("added %s %s (id %d) to device tree" % (newdev.type,
                                                           newdev.name,
                                                           newdev.id))
@@ -749,7 +584,7 @@ class DeviceTree(object):
 
             Only leaves may be removed.
         """
-        if dev not in self._devices:
+        if not self._inTree(dev):
             raise ValueError("Device '%s' not in tree" % dev.name)
 
         if not dev.isleaf and not force:
@@ -777,6 +612,9 @@ class DeviceTree(object):
                     device.updateName()
 
         self._devices.remove(dev)
+        self._unindexDevice(dev)
+        del self._deviceOrder[dev.id]
+        self._generation += 1
         log.debug("removed %s %s (id %d) from device tree" % (dev.type,
                                                               dev.name,
                                                               dev.id))
@@ -786,6 +624,128 @@ class DeviceTree(object):
             #   Do we care about garbage collection? At all?
             parent.removeChild()
 
+    # names of the lookup indexes maintained by _indexDevice
+    _indexNames = ("name", "path", "sysfsPath", "uuid", "label", "serial",
+                   "type")
+
+    def _deviceIndexEntries(self, device):
+        """ Return a list of (index, key) pairs to index device under. """
+        format = getattr(device, "format", None)
+        entries = [("name", device.name),
+                   ("path", device.path),
+                   ("sysfsPath", getattr(device, "sysfsPath", None)),
+                   ("uuid", getattr(device, "uuid", None)),
+                   ("uuid", getattr(format, "uuid", None)),
+                   ("label", getattr(format, "label", None)),
+                   ("serial", getattr(device, "serial", None)),
+                   ("type", device.type)]
+        return [(index, key) for (index, key) in entries if key]
+
+    def _indexDevice(self, device):
+        """ Add device to the lookup indexes.
+
+            Each index maps an attribute value to the list of devices with
+            that value, kept in the same order as self._devices so lookups
+            return the same device a scan of the list would.
+        """
+        entries = self._deviceIndexEntries(device)
+        self._deviceIndexKeys[device.id] = (device, entries)
+        order = self._deviceOrder[device.id]
+        for (index, key) in entries:
+            devices = self._deviceIndexes[index].setdefault(key, [])
+            if device in devices:
+                # eg: a device whose uuid and format uuid are the same
+                continue
+
+            # newly added devices go at the end; re-indexed ones may not
+            pos = len(devices)
+            while pos and self._deviceOrder[devices[pos - 1].id] > order:
+                pos -= 1
+            devices.insert(pos, device)
+
+    def _unindexDevice(self, device):
+        """ Remove device from the lookup indexes. """
+        (device, entries) = self._deviceIndexKeys.pop(device.id)
+        for (index, key) in entries:
+            devices = self._deviceIndexes[index].get(key, [])
+            if device in devices:
+                devices.remove(device)
+            if not devices:
+                self._deviceIndexes[index].pop(key, None)
+
+    def _syncDeviceIndexes(self):
+        """ Re-index devices whose indexed attributes have changed.
+
+            Names, sysfs paths and formats change in many places outside
+            of the tree (partition allocation, device setup, the UI), so
+            devices record those changes in Device.changeLog and we replay
+            the part of the log we have not seen yet. Entries every tree
+            has seen are dropped from the log.
+        """
+        base = Device.changeLogBase
+        end = base + len(Device.changeLog)
+        if self._changeLogPos == end:
+            return
+
+        if self._changeLogPos < base:
+            # a copy of a tree that missed the trimmed entries
+            changed = set(self._deviceIndexKeys.keys())
+        else:
+            changed = set(Device.changeLog[self._changeLogPos - base:])
+        self._changeLogPos = end
+        _trimChangeLog()
+        for devid in changed:
+            if devid not in self._deviceIndexKeys:
+                continue
+
+            device = self._deviceIndexKeys[devid][0]
+            self._unindexDevice(device)
+            self._indexDevice(device)
+            self._generation += 1
+
+    @property
+    def generation(self):
+        """ Counter that changes whenever the set of devices does.
+
+            It is bumped when a device is added or removed and when a
+            device's name, path, parents, uuid or format changes.
+        """
+        self._syncDeviceIndexes()
+        return self._generation
+
+    def invalidateViews(self):
+        """ Drop the cached views, eg: after changing how they are built. """
+        self._generation += 1
+
+    def getView(self, key, build):
+        """ Return the view cached under key, building it if needed.
+
+            build is called with no arguments to compute the view, which
+            is then kept until the tree's generation changes. Callers must
+            not modify the returned object.
+        """
+        generation = self.generation
+        if self._viewsGeneration != generation:
+            self._views = {}
+            self._viewsGeneration = generation
+
+        try:
+            return self._views[key]
+        except KeyError:
+            view = build()
+            self._views[key] = view
+            return view
+
+    def _inTree(self, device):
+        """ Return True if device is in the tree. """
+        entry = self._deviceIndexKeys.get(device.id)
+        return entry is not None and entry[0] is device
+
+    def _getIndexedDevices(self, index, key):
+        """ Return the list of devices indexed under key, in tree order. """
+        self._syncDeviceIndexes()
+        return self._deviceIndexes[index].get(key, [])
+
     def registerAction(self, action):
         """ Register an action to be performed at a later time.
 
@@ -794,17 +754,16 @@ class DeviceTree(object):
         """
         if (action.isDestroy() or action.isResize() or \
             (action.isCreate() and action.isFormat())) and \
-           action.device not in self._devices:
+           not self._inTree(action.device):
             raise DeviceTreeError("device is not in the tree")
         elif (action.isCreate() and action.isDevice()):
             # this allows multiple create actions w/o destroy in between;
             # we will clean it up before processing actions
             #raise DeviceTreeError("device is already in the tree")
-            if action.device in self._devices:
+            if self._inTree(action.device):
                 self._removeDevice(action.device)
-            for d in self._devices:
-                if d.path == action.device.path:
-                    self._removeDevice(d)
+            for d in self._getIndexedDevices("path", action.device.path)[:]:
+                self._removeDevice(d)
 
         if action.isCreate() and action.isDevice():
             self._addDevice(action.device)
@@ -816,7 +775,7 @@ class DeviceTree(object):
                 raise DeviceTreeError("mountpoint already in use")
 
         log.debug("registered action: %s" % action)
-        self._actions.append(action)
+        self._appendAction(action)
 
     def cancelAction(self, action):
         """ Cancel a registered action.
@@ -838,6 +797,23 @@ class DeviceTree(object):
             action.cancel()
 
         self._actions.remove(action)
+        self._actionIndex[(action.device.id, action.obj)].remove(action)
+        del self._actionOrder[id(action)]
+
+    def _appendAction(self, action):
+        self._actions.append(action)
+        self._actionIndex.setdefault((action.device.id, action.obj),
+                                     []).append(action)
+        self._actionOrder[id(action)] = self._nextActionOrder
+        self._nextActionOrder += 1
+
+    def _setActions(self, actions):
+        """ Replace the action queue and rebuild the action index. """
+        self._actions = []
+        self._actionIndex = {}
+        self._actionOrder = {}
+        for action in actions:
+            self._appendAction(action)
 
     def findActions(self, device=None, type=None, object=None, path=None,
                     devid=None):
@@ -859,8 +835,22 @@ class DeviceTree(object):
         _type = action_type_from_string(type)
         _object = action_object_from_string(object)
 
+        if devid is None and device is not None:
+            devid = device.id
+
+        candidates = self._actions
+        if devid is not None:
+            # the index lists are in queue order, so merge them back into it
+            candidates = []
+            for obj in (ACTION_OBJECT_DEVICE, ACTION_OBJECT_FORMAT,
+                        ACTION_OBJECT_NONE):
+                if _object is None or _object == obj:
+                    candidates.extend(self._actionIndex.get((devid, obj), []))
+            if _object is None:
+                candidates.sort(key=lambda a: self._actionOrder[id(a)])
+
         actions = []
-        for action in self._actions:
+        for action in candidates:
             if device is not None and action.device != device:
                 continue
 
@@ -880,33 +870,50 @@ class DeviceTree(object):
 
         return actions
 
-    def getDependentDevices(self, dep):
-        """ Return a list of devices that depend on dep.
+    def getDependencyClosure(self, devices):
+        """ Return the set of devices that depend on any of devices.
 
-            The list includes both direct and indirect dependents.
+            The set includes both direct and indirect dependents. It is
+            collected by walking down the tree's children map, so it costs
+            as much as the number of dependents rather than a dependsOn
+            call for every device in the tree.
         """
-        dependents = []
+        children = self.getView("children", self._buildChildren)
+        queue = list(devices)
 
         # special handling for extended partitions since the logical
         # partitions and their deps effectively depend on the extended
-        logicals = []
-        if isinstance(dep, PartitionDevice) and dep.partType and \
-           dep.isExtended:
-            # collect all of the logicals on the same disk
+        extended = [d for d in queue if isinstance(d, PartitionDevice) and
+                    d.partType and d.isExtended]
+        if extended:
             for part in self.getDevicesByInstance(PartitionDevice):
-                if part.partType and part.isLogical and part.disk == dep.disk:
-                    logicals.append(part)
+                if not part.partType or not part.isLogical:
+                    continue
 
-        for device in self.devices:
-            if device.dependsOn(dep):
-                dependents.append(device)
-            else:
-                for logical in logicals:
-                    if device.dependsOn(logical):
-                        dependents.append(device)
+                for dep in extended:
+                    if part.disk == dep.disk:
+                        queue.append(part)
                         break
 
-        return dependents
+        closure = set(queue) - set(devices)
+        while queue:
+            device = queue.pop()
+            for child in children.get(device.id, []):
+                if child in closure or device not in child.parents:
+                    continue
+
+                closure.add(child)
+                queue.append(child)
+
+        return closure
+
+    def getDependentDevices(self, dep):
+        """ Return a list of devices that depend on dep.
+
+            The list includes both direct and indirect dependents.
+        """
+        dependents = self.getDependencyClosure([dep])
+        return [d for d in self.devices if d in dependents]
 
     def isIgnored(self, info):
         """ Return True if info is a device we should ignore.
@@ -1292,6 +1299,7 @@ class DeviceTree(object):
         log_method_call(self, name=name, info=info)
         uuid = udev_device_get_uuid(info)
         sysfs_path = udev_device_get_sysfs_path(info)
+        self._udevSignatures[sysfs_path] = self._udevSignature(info)
 
         if self.isIgnored(info):
             log.debug("ignoring %s (%s)" % (name, sysfs_path))
@@ -1554,7 +1562,10 @@ class DeviceTree(object):
             name = "%s-%s" % (vg_name, lv_name)
             if lv_attr[index][0] in 'Ss':
                 log.debug("found lvm snapshot volume '%s'" % name)
-                origin_name = devicelibs.lvm.lvorigin(vg_name, lv_name)
+                origin_name = devicelibs.lvm.lvm_report_get_origin(
+                                                    vg_device.uuid, lv_name)
+                if origin_name is None:
+                    origin_name = devicelibs.lvm.lvorigin(vg_name, lv_name)
                 if not origin_name:
                     log.error("lvm snapshot '%s-%s' has unknown origin"
                                 % (vg_name, lv_name))
@@ -1626,10 +1637,23 @@ class DeviceTree(object):
 
     def handleUdevLVMPVFormat(self, info, device):
         log_method_call(self, name=device.name, type=device.format.type)
+        # prefer the bulk lvm report taken at the start of populate, falling
+        # back to the metadata our udev rules collected for this pv
+        pv_info = devicelibs.lvm.lvm_report_get_pv(udev_device_get_uuid(info))
+        vg_info = None
+        if pv_info:
+            vg_info = devicelibs.lvm.lvm_report_get_vg(pv_info["vg_uuid"])
+
         # lookup/create the VG and LVs
-        try:
-            vg_name = udev_device_get_vg_name(info)
-        except KeyError:
+        if pv_info:
+            vg_name = pv_info["vg_name"]
+        else:
+            try:
+                vg_name = udev_device_get_vg_name(info)
+            except KeyError:
+                vg_name = None
+
+        if not vg_name:
             # no vg name means no vg -- we're done with this pv
             return
 
@@ -1637,17 +1661,26 @@ class DeviceTree(object):
         if vg_device:
             vg_device._addDevice(device)
         else:
-            try:
-                vg_uuid = udev_device_get_vg_uuid(info)
-                vg_size = udev_device_get_vg_size(info)
-                vg_free = udev_device_get_vg_free(info)
-                pe_size = udev_device_get_vg_extent_size(info)
-                pe_count = udev_device_get_vg_extent_count(info)
-                pe_free = udev_device_get_vg_free_extents(info)
-                pv_count = udev_device_get_vg_pv_count(info)
-            except (KeyError, ValueError) as e:
-                log.warning("invalid data for %s: %s" % (device.name, e))
-                return
+            if vg_info:
+                vg_uuid = vg_info["vg_uuid"]
+                vg_size = vg_info["vg_size"]
+                vg_free = vg_info["vg_free"]
+                pe_size = vg_info["vg_extent_size"]
+                pe_count = vg_info["vg_extent_count"]
+                pe_free = vg_info["vg_free_count"]
+                pv_count = vg_info["pv_count"]
+            else:
+                try:
+                    vg_uuid = udev_device_get_vg_uuid(info)
+                    vg_size = udev_device_get_vg_size(info)
+                    vg_free = udev_device_get_vg_free(info)
+                    pe_size = udev_device_get_vg_extent_size(info)
+                    pe_count = udev_device_get_vg_extent_count(info)
+                    pe_free = udev_device_get_vg_free_extents(info)
+                    pv_count = udev_device_get_vg_pv_count(info)
+                except (KeyError, ValueError) as e:
+                    log.warning("invalid data for %s: %s" % (device.name, e))
+                    return
 
             vg_device = LVMVolumeGroupDevice(vg_name,
                                              device,
@@ -1663,15 +1696,25 @@ class DeviceTree(object):
 
         # Now we add any lv info found in this pv to the vg_device, we
         # do this for all pvs as pvs only contain lv info for lvs which they
-        # contain themselves
-        try:
-            lv_names = udev_device_get_lv_names(info)
-            lv_uuids = udev_device_get_lv_uuids(info)
-            lv_sizes = udev_device_get_lv_sizes(info)
-            lv_attr = udev_device_get_lv_attr(info)
-        except KeyError as e:
-            log.warning("invalid data for %s: %s" % (device.name, e))
-            return
+        # contain themselves. The lvm report lists all of the vg's lvs.
+        report_lvs = None
+        if vg_info:
+            report_lvs = devicelibs.lvm.lvm_report_get_lvs(vg_info["vg_uuid"])
+
+        if report_lvs is not None:
+            lv_names = [lv["lv_name"] for lv in report_lvs]
+            lv_uuids = [lv["lv_uuid"] for lv in report_lvs]
+            lv_sizes = [lv["lv_size"] for lv in report_lvs]
+            lv_attr = [lv["lv_attr"] for lv in report_lvs]
+        else:
+            try:
+                lv_names = udev_device_get_lv_names(info)
+                lv_uuids = udev_device_get_lv_uuids(info)
+                lv_sizes = udev_device_get_lv_sizes(info)
+                lv_attr = udev_device_get_lv_attr(info)
+            except KeyError as e:
+                log.warning("invalid data for %s: %s" % (device.name, e))
+                return
 
         for i in range(len(lv_names)):
             # Skip empty and already added lvs
@@ -1874,6 +1917,14 @@ class DeviceTree(object):
             except KeyError:
                 log.debug("mdraid member %s has no md uuid" % name)
             kwargs["biosraid"] = udev_device_is_biosraid(info)
+        elif format_type == "LVM2_member" and \
+             devicelibs.lvm.lvm_report_get_pv(uuid):
+            # lvm, with metadata from the bulk lvm report
+            pv_info = devicelibs.lvm.lvm_report_get_pv(uuid)
+            if pv_info["vg_name"]:
+                kwargs["vgName"] = pv_info["vg_name"]
+                kwargs["vgUuid"] = pv_info["vg_uuid"]
+            kwargs["peStart"] = pv_info["pe_start"]
         elif format_type == "LVM2_member":
             # lvm
             try:
@@ -1990,7 +2041,7 @@ class DeviceTree(object):
 
             elif device.type == "lvmlv":
                 # we might have already fixed this.
-                if device not in self._devices or \
+                if not self._inTree(device) or \
                         device.name in self._ignoredDisks:
                     return
                 if device.complete:
@@ -2098,6 +2149,31 @@ class DeviceTree(object):
         devicelibs.mpath.writeMultipathConf(writer=self.__multipathConfigWriter,
                                             friendly_names=self.mpathFriendlyNames)
 
+        # one lvm report for all pvs, vgs and lvs instead of probing each
+        devicelibs.lvm.lvm_report_refresh()
+        try:
+            self._scanDevices(progressWindow)
+        finally:
+            # the report only describes the system as it was when we
+            # started; from here on, lvm metadata comes from udev
+            devicelibs.lvm.lvm_report_reset()
+
+        self.populated = True
+
+        # After having the complete tree we make sure that the system
+        # inconsistencies are ignored or resolved.
+        self._handleInconsistencies()
+
+        self.teardownAll()
+        try:
+            os.unlink("/etc/mdadm.conf")
+        except OSError:
+            log.info("failed to unlink /etc/mdadm.conf")
+
+        self.startMonitor()
+
+    def _scanDevices(self, progressWindow=None):
+        """ Add the devices udev knows about and those built on them. """
         devices = udev_get_block_devices()
         if os.access("/etc/multipath.conf", os.R_OK):
             (singles, mpaths, partitions) = devicelibs.mpath.identifyMultipaths(devices)
@@ -2119,6 +2195,15 @@ class DeviceTree(object):
         whitelist = []
         mpaths = self.__multipaths.values()
         mpaths.sort(key=lambda d: d.name)
+
+        # activate them all at once; mp.setup() below only sets up what
+        # this failed to
+        failed = devicelibs.mpath.setup_multipaths(
+                        [mp.name for mp in mpaths if not mp.status])
+        if failed:
+            raise MPathError("multipath partition activation failed for '%s'"
+                             % failed[0])
+
         for mp in mpaths:
             log.info("adding mpath device %s" % mp.name)
             mp.setup()
@@ -2170,17 +2255,170 @@ class DeviceTree(object):
                 if progressWindow:
                     progressWindow.pulse()
 
-        self.populated = True
+    # udev properties that refresh compares to decide whether a change event
+    # on a device already in the tree needs the device to be probed again
+    _udevSignatureKeys = ("ID_FS_TYPE", "ID_FS_UUID", "ID_FS_LABEL",
+                          "ID_FS_VERSION", "ID_PART_TABLE_TYPE", "DM_NAME",
+                          "DM_UUID", "MD_UUID", "ID_SERIAL")
+
+    def _udevSignature(self, info):
+        return tuple([info.get(key) for key in self._udevSignatureKeys])
+
+    def startMonitor(self):
+        """ Start collecting block device uevents for refresh. """
+        if self._monitor is None:
+            self._monitor = udev_monitor_start()
+
+    def stopMonitor(self):
+        if self._monitor is not None:
+            udev_monitor_stop(self._monitor)
+            self._monitor = None
+
+    def _removeDeviceStack(self, device):
+        """ Remove device and all the devices built on it from the tree.
+
+            Return False, leaving the tree alone, if there are actions
+            registered for any of them or if any of them is also built on
+            devices outside the stack, like a vg with pvs on other disks.
+            Probing device again would bring such a device back with only
+            part of its members.
+        """
+        doomed = [device] + self.getDependentDevices(device)
+        for dev in doomed:
+            if self.findActions(devid=dev.id):
+                log.info("not removing %s, it has actions registered"
+                         % dev.name)
+                return False
+
+            if dev is not device and \
+               [p for p in dev.parents if p not in doomed]:
+                log.info("not removing %s, it has members outside %s"
+                         % (dev.name, device.name))
+                return False
+
+        # children before parents
+        doomed.sort(key=lambda d: len(d.ancestors), reverse=True)
+        for dev in doomed:
+            self._removeDevice(dev, force=True, moddisk=False)
+            self._udevSignatures.pop(getattr(dev, "sysfsPath", None), None)
+
+        return True
+
+    def refresh(self):
+        """ Apply the block device uevents received since populate.
+
+            Devices that went away are removed from the tree along with the
+            devices built on them, new devices are probed and added the
+            same way populate adds them, and devices whose udev properties
+            changed are probed again. Only the devices named in the events
+            are looked at.
+
+            Return False if the events cannot be applied to the tree, in
+            which case it has to be populated from scratch.
+        """
+        if self._monitor is None or not self.populated:
+            return False
 
-        # After having the complete tree we make sure that the system
-        # inconsistencies are ignored or resolved.
-        self._handleInconsistencies()
+        # make sure udev has sent out the events for what happened so far
+        udev_settle()
+        events = udev_monitor_get_events(self._monitor)
+        if events is None:
+            # we cannot tell what happened to the devices we missed events
+            # for, and the monitor may keep failing
+            self.stopMonitor()
+            return False
+        elif not events:
+            return True
 
-        self.teardownAll()
-        try:
-            os.unlink("/etc/mdadm.conf")
-        except OSError:
-            log.info("failed to unlink /etc/mdadm.conf")
+        # only the last event for each device matters
+        actions = {}
+        paths = []
+        for (action, path) in events:
+            if path not in actions:
+                paths.append(path)
+            actions[path] = action
+
+        log.info("applying %d uevents for %d devices to the device tree"
+                 % (len(events), len(paths)))
+
+        # partitions are looked up in their disk's partition table, so a
+        # partition that was added, removed or changed means its disk and
+        # all of its partitions have to be probed again
+        probe = []
+        forced = set()
+        for path in paths:
+            parent = os.path.dirname(path)
+            if os.path.basename(parent) != "block":
+                if actions[path] != "remove" and \
+                   self.getDeviceBySysfsPath(path) is not None:
+                    info = udev_get_block_device(path)
+                    if info is not None and \
+                       self._udevSignatures.get(path) == \
+                       self._udevSignature(info):
+                        continue
+
+                forced.add(parent)
+                path = parent
+            elif actions[path] == "remove":
+                device = self.getDeviceBySysfsPath(path)
+                if device is not None:
+                    log.info("%s went away" % device.name)
+                    if not self._removeDeviceStack(device):
+                        return False
+                continue
+
+            if path not in probe:
+                probe.append(path)
+
+        known = set([d.id for d in self._devices])
+        mpath = os.access("/etc/multipath.conf", os.R_OK)
+        allPaths = None
+        for path in probe:
+            device = self.getDeviceBySysfsPath(path)
+            info = udev_get_block_device(path)
+            if info is None:
+                # it is already gone again
+                if device is not None and not self._removeDeviceStack(device):
+                    return False
+                continue
+
+            if device is not None:
+                if path not in forced and \
+                   self._udevSignatures.get(path) == self._udevSignature(info):
+                    continue
+
+                log.info("%s changed" % device.name)
+                if not self._removeDeviceStack(device):
+                    return False
+            elif udev_device_is_multipath_member(info) or \
+                 (mpath and udev_device_is_disk(info) and
+                  udev_device_get_serial(info) and
+                  self.getDevicesBySerial(udev_device_get_serial(info))):
+                # a new path to a multipath device; working out the multipath
+                # topology takes a look at all the disks
+                log.info("%s is a multipath member" % udev_device_get_name(info))
+                return False
+
+            self.addUdevDevice(info)
+
+            if allPaths is None:
+                allPaths = udev_enumerate_devices()
+            for partPath in sorted([p for p in allPaths
+                                    if os.path.dirname(p) == path]):
+                partInfo = udev_get_block_device(partPath)
+                if partInfo and self.getDeviceBySysfsPath(partPath) is None:
+                    self.addUdevDevice(partInfo)
+
+        for device in self.leaves:
+            if device.id in known:
+                continue
+
+            try:
+                device.teardown(recursive=True)
+            except StorageError as e:
+                log.info("teardown of %s failed: %s" % (device.name, e))
+
+        return True
 
     def teardownAll(self):
         """ Run teardown methods on all devices. """
@@ -2202,110 +2440,94 @@ class DeviceTree(object):
         if not path:
             return None
 
-        found = None
-        for device in self._devices:
-            if device.sysfsPath == path:
-                found = device
-                break
+        devices = self._getIndexedDevices("sysfsPath", path)
+        if devices:
+            return devices[0]
 
-        return found
+        return None
 
     def getDeviceByUuid(self, uuid):
         if not uuid:
             return None
 
-        found = None
-        for device in self._devices:
-            if device.uuid == uuid:
-                found = device
-                break
-            elif device.format.uuid == uuid:
-                found = device
-                break
+        devices = self._getIndexedDevices("uuid", uuid)
+        if devices:
+            return devices[0]
 
-        return found
+        return None
 
     def getDevicesBySerial(self, serial):
-        devices = []
-        for device in self._devices:
-            if not hasattr(device, "serial"):
-                log.warning("device %s has no serial attr" % device.name)
-                continue
-            if device.serial == serial:
-                devices.append(device)
-        return devices
+        if not serial:
+            return [d for d in self._devices
+                        if getattr(d, "serial", None) == serial]
+
+        return self._getIndexedDevices("serial", serial)[:]
 
     def getDeviceByLabel(self, label):
         if not label:
             return None
 
-        found = None
-        for device in self._devices:
-            _label = getattr(device.format, "label", None)
-            if not _label:
-                continue
+        devices = self._getIndexedDevices("label", label)
+        if devices:
+            return devices[0]
 
-            if _label == label:
-                found = device
-                break
+        return None
+
+    def _getDeviceByLVMAwareKey(self, index, key):
+        """ Look up a device by name or path.
+
+            LVM escapes "-" in vg and lv names as "--" in device-mapper
+            names, so also match lvm devices against the unescaped key.
+        """
+        devices = self._getIndexedDevices(index, key)
+        unescaped = key.replace("--", "-")
+        if unescaped != key:
+            devices = devices + [d for d in
+                                 self._getIndexedDevices(index, unescaped)
+                                 if d.type in ("lvmlv", "lvmvg")]
+            devices.sort(key=lambda d: self._deviceOrder[d.id])
 
-        return found
+        if devices:
+            return devices[0]
+
+        return None
 
     def getDeviceByName(self, name):
-        log.debug("looking for device '%s'..." % name)
         if not name:
             return None
 
-        found = None
-        for device in self._devices:
-            if device.name == name:
-                found = device
-                break
-            elif (device.type == "lvmlv" or device.type == "lvmvg") and \
-                    device.name == name.replace("--","-"):
-                found = device
-                break
-
-        log.debug("found %s" % found)
-        return found
+        return self._getDeviceByLVMAwareKey("name", name)
 
     def getDeviceByPath(self, path):
-        log.debug("looking for device '%s'..." % path)
         if not path:
             return None
 
-        found = None
-        for device in self._devices:
-            if device.path == path:
-                found = device
-                break
-            elif (device.type == "lvmlv" or device.type == "lvmvg") and \
-                    device.path == path.replace("--","-"):
-                found = device
-                break
-
-        log.debug("found %s" % found)
-        return found
+        return self._getDeviceByLVMAwareKey("path", path)
 
     def getDevicesByType(self, device_type):
         # TODO: expand this to catch device format types
-        return [d for d in self._devices if d.type == device_type]
+        return self._getIndexedDevices("type", device_type)[:]
 
     def getDevicesByInstance(self, device_class):
         return [d for d in self._devices if isinstance(d, device_class)]
 
-    @property
-    def devices(self):
-        """ List of device instances """
-        devices = []
+    def _buildDevices(self):
+        paths = set()
         for device in self._devices:
-            if device.path in [d.path for d in devices] and \
-               not isinstance(device, NoDevice):
+            if isinstance(device, NoDevice):
+                continue
+
+            if device.path in paths:
                 raise DeviceTreeError("duplicate paths in device tree")
 
-            devices.append(device)
+            paths.add(device.path)
 
-        return devices
+        return self._devices[:]
+
+    @property
+    def devices(self):
+        """ List of device instances """
+        return self.getView("devices", self._buildDevices)[:]
 
     @property
     def filesystems(self):
@@ -2360,9 +2582,20 @@ class DeviceTree(object):
         leaves = [d for d in self._devices if d.isleaf]
         return leaves
 
+    def _buildChildren(self):
+        children = {}
+        for device in self._devices:
+            for parent in device.parents:
+                siblings = children.setdefault(parent.id, [])
+                if device not in siblings:
+                    siblings.append(device)
+
+        return children
+
     def getChildren(self, device):
         """ Return a list of a device's children. """
-        return [c for c in self._devices if device in c.parents]
+        children = self.getView("children", self._buildChildren)
+        return [c for c in children.get(device.id, []) if device in c.parents]
 
     def resolveDevice(self, devspec, blkidTab=None, cryptTab=None):
         # find device in the tree
@@ -29,6 +29,7 @@
 """
 import math
 import os
+import struct
 import sys
 import tempfile
 import selinux
@@ -63,6 +64,78 @@ def get_kernel_filesystems():
 global kernel_filesystems
 kernel_filesystems = get_kernel_filesystems()
 
+# Sizes probed from existing filesystems, keyed by device path. An entry is
+# only used while the device number and the filesystem's generation (see
+# FS._probeGeneration) are the same as when it was stored.
+_probeCache = {}
+
+def getProbeCacheEntry(device, generation=None):
+    """ Return the probe cache entry for a filesystem on device.
+
+        A stale entry is replaced by an empty one. Probed values are
+        stored in the returned dict.
+    """
+    try:
+        rdev = os.stat(device).st_rdev
+    except OSError:
+        rdev = None
+
+    entry = _probeCache.get(device)
+    if entry is None or entry["rdev"] != rdev or \
+       entry["generation"] != generation:
+        entry = {"rdev": rdev, "generation": generation}
+        _probeCache[device] = entry
+
+    return entry
+
+def invalidateProbeCache(device):
+    """ Forget what was probed about the filesystem on device. """
+    _probeCache.pop(device, None)
+
+EXT_SUPERBLOCK_OFFSET = 1024
+EXT_SUPERBLOCK_MAGIC = 0xEF53
+EXT_FEATURE_INCOMPAT_64BIT = 0x80
+
+def readExtSuperblock(device):
+    """ Read the size fields of an ext2/3/4 superblock.
+
+        Return a dict with the block size, block count and free block
+        count, and a generation tuple of the uuid, mount and write times
+        and the lifetime number of kilobytes written, which changes
+        whenever the filesystem does. Return None if device does not
+        hold an ext2/3/4 filesystem.
+    """
+    try:
+        fd = os.open(device, os.O_RDONLY)
+        try:
+            os.lseek(fd, EXT_SUPERBLOCK_OFFSET, 0)
+            buf = os.read(fd, 1024)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        log.debug("failed to read superblock of %s: %s" % (device, e))
+        return None
+
+    if len(buf) < 1024 or \
+       struct.unpack_from("<H", buf, 0x38)[0] != EXT_SUPERBLOCK_MAGIC:
+        return None
+
+    (blockCount, freeBlocks) = struct.unpack_from("<4xI4xI", buf, 0x00)
+    (logBlockSize,) = struct.unpack_from("<I", buf, 0x18)
+    (mtime, wtime) = struct.unpack_from("<II", buf, 0x2C)
+    (incompat,) = struct.unpack_from("<I", buf, 0x60)
+    uuid = buf[0x68:0x78]
+    (kbytesWritten,) = struct.unpack_from("<Q", buf, 0x178)
+    if incompat & EXT_FEATURE_INCOMPAT_64BIT:
+        (blocksHi, freeHi) = struct.unpack_from("<I4xI", buf, 0x150)
+        blockCount += blocksHi << 32
+        freeBlocks += freeHi << 32
+
+    return {"blockSize": 1024 << logBlockSize,
+            "blockCount": blockCount,
+            "freeBlocks": freeBlocks,
+            "generation": (uuid, mtime, wtime, kbytesWritten)}
+
 def fsConfigFromFile(config_file):
     """ Generate a set of attribute name/value pairs with which a
         filesystem type can be defined.
@@ -250,6 +323,10 @@ class FS(DeviceFormat):
         size = self._size
 
         if self.infofsProg and self.mountable and self.exists and not size:
+            probed = getProbeCacheEntry(self.device, self._probeGeneration())
+            if "size" in probed:
+                return probed["size"]
+
             try:
                 values = []
                 argv = self._defaultInfoOptions + [ self.device ]
@@ -289,12 +366,23 @@ class FS(DeviceFormat):
 
                 # report current size as megabytes
                 size = math.floor(size / 1024.0 / 1024.0)
+                probed["size"] = size
             except Exception as e:
                 log.error("failed to obtain size of filesystem on %s: %s"
                           % (self.device, e))
 
         return size
 
+    def _probeGeneration(self):
+        """ Something that changes whenever this filesystem is modified.
+
+            It is part of the key for the results of probing existing
+            filesystems. None means there is no cheap way to tell, in
+            which case cached results are kept until the device changes
+            or the filesystem is formatted, resized or migrated.
+        """
+        return None
+
     @property
     def currentSize(self):
         """ The filesystem's current actual size. """
@@ -368,6 +456,7 @@ class FS(DeviceFormat):
             if w:
                 w.pop()
 
+        invalidateProbeCache(self.device)
         if rc:
             raise FormatCreateError("format failed: %s" % rc, self.device)
 
@@ -395,6 +484,7 @@ class FS(DeviceFormat):
 
         argv = self._defaultMigrateOptions[:]
         argv.append(self.device)
+        invalidateProbeCache(self.device)
         try:
             rc = iutil.execWithRedirect(self.migratefsProg,
                                         argv,
@@ -468,6 +558,7 @@ class FS(DeviceFormat):
             if w:
                 w.pop()
 
+        invalidateProbeCache(self.device)
         if rc:
             raise FSResizeError("resize failed: %s" % rc, self.device)
 
@@ -979,6 +1070,32 @@ class Ext2FS(FS):
         except Exception as e:
             log.error("failed to run tune2fs on %s: %s" % (self.device, e))
 
+    def _probeGeneration(self):
+        sb = readExtSuperblock(self.device)
+        if sb:
+            return sb["generation"]
+        return None
+
+    def _getExistingSize(self):
+        """ Determine the size of this filesystem from its superblock.
+
+            dumpe2fs is only run if the superblock cannot be read.
+        """
+        if self._size or not self.exists or not self.mountable:
+            return self._size
+
+        sb = readExtSuperblock(self.device)
+        if not sb:
+            return FS._getExistingSize(self)
+
+        probed = getProbeCacheEntry(self.device, sb["generation"])
+        for field in ("blockSize", "blockCount", "freeBlocks"):
+            probed[field] = sb[field]
+        if "size" not in probed:
+            probed["size"] = math.floor(sb["blockCount"] * sb["blockSize"]
+                                        / 1024.0 / 1024.0)
+        return probed["size"]
+
     @property
     def minSize(self):
         """ Minimum size for this filesystem in MB. """
@@ -989,38 +1106,48 @@ class Ext2FS(FS):
             blockSize = None
 
             if self.exists and os.path.exists(self.device):
-                # get block size
-                buf = iutil.execWithCapture(self.infofsProg,
-                                            ["-h", self.device],
-                                            stderr="/dev/tty5")
-                for line in buf.splitlines():
-                    if line.startswith("Block size:"):
-                        blockSize = int(line.split(" ")[-1])
-                        break
+                sb = readExtSuperblock(self.device)
+                if sb:
+                    blockSize = sb["blockSize"]
+                    probed = getProbeCacheEntry(self.device, sb["generation"])
+                else:
+                    probed = getProbeCacheEntry(self.device)
+                    # get block size
+                    buf = iutil.execWithCapture(self.infofsProg,
+                                                ["-h", self.device],
+                                                stderr="/dev/tty5")
+                    for line in buf.splitlines():
+                        if line.startswith("Block size:"):
+                            blockSize = int(line.split(" ")[-1])
+                            break
 
                 if blockSize is None:
                     raise FSError("failed to get block size for %s filesystem "
                                   "on %s" % (self.mountType, self.device))
 
-                # get minimum size according to resize2fs
-                buf = iutil.execWithCapture(self.resizefsProg,
-                                            ["-P", self.device],
-                                            stderr="/dev/tty5")
-                for line in buf.splitlines():
-                    if "minimum size of the filesystem:" not in line:
-                        continue
+                # get minimum size according to resize2fs, which can take
+                # a long time on big filesystems
+                if "minBlocks" not in probed:
+                    buf = iutil.execWithCapture(self.resizefsProg,
+                                                ["-P", self.device],
+                                                stderr="/dev/tty5")
+                    for line in buf.splitlines():
+                        if "minimum size of the filesystem:" not in line:
+                            continue
+
+                        # line will look like:
+                        # Estimated minimum size of the filesystem: 1148649
+                        #
+                        # NOTE: The minimum size reported is in blocks.
+                        (text, sep, minSize) = line.partition(": ")
+                        probed["minBlocks"] = long(minSize)
+                        break
 
-                    # line will look like:
-                    # Estimated minimum size of the filesystem: 1148649
-                    #
-                    # NOTE: The minimum size reported is in blocks.  Convert
-                    # to bytes, then megabytes, and finally round up.
-                    (text, sep, minSize) = line.partition(": ")
-                    size = long(minSize) * blockSize
+                if "minBlocks" in probed:
+                    # Convert to bytes, then megabytes, and finally round up.
+                    size = probed["minBlocks"] * blockSize
                     size = math.ceil(size / 1024.0 / 1024.0)
-                    break
-
-                if size is None:
+                else:
                     log.warning("failed to get minimum size for %s filesystem "
                                 "on %s" % (self.mountType, self.device))
 
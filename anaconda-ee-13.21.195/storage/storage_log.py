@@ -1,15 +1,34 @@
 import logging
+import sys
 import anaconda_log
-import inspect
+from flags import flags
+
+# log_method_call logs at TRACE_LEVEL, DEBUG unless storagetrace=<level> is
+# given on the command line. storagetrace=0 moves it to TRACE, below the
+# storage logger's level, so that method calls are not logged at all.
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+TRACE_LEVEL = logging.DEBUG
+
+def set_trace_level(level):
+    global TRACE_LEVEL
+    TRACE_LEVEL = level
 
 def log_method_call(d, *args, **kwargs):
-    classname = d.__class__.__name__
-    stack = inspect.stack()
-    methodname = stack[1][3]
+    if not logger.isEnabledFor(TRACE_LEVEL):
+        return
+
+    frame = sys._getframe(1)
+    methodname = frame.f_code.co_name
+
+    # indent by the depth of the call stack
+    depth = 1
+    while frame:
+        depth += 1
+        frame = frame.f_back
 
-    spaces = len(stack) * ' '
     fmt = "%s%s.%s:"
-    fmt_args = [spaces, classname, methodname]
+    fmt_args = [depth * ' ', d.__class__.__name__, methodname]
 
     for arg in args:
         fmt += " %s ;"
@@ -19,10 +38,17 @@ def log_method_call(d, *args, **kwargs):
         fmt += " %s: %s ;"
         fmt_args.extend([k, v])
 
-    logger.debug(fmt % tuple(fmt_args))
+    # let logging do the formatting, only if the record gets emitted
+    logger.log(TRACE_LEVEL, fmt, *fmt_args)
 
 
 logger = logging.getLogger("storage")
 logger.setLevel(logging.DEBUG)
 anaconda_log.logger.addFileHandler("/tmp/storage.log", logger, logging.DEBUG)
 anaconda_log.logger.addFileHandler("/dev/tty3", logger, logging.DEBUG)
+
+_trace = flags.cmdline.get("storagetrace")
+if _trace in ("0", "off"):
+    set_trace_level(TRACE)
+elif _trace and isinstance(logging.getLevelName(_trace.upper()), int):
+    set_trace_level(logging.getLevelName(_trace.upper()))
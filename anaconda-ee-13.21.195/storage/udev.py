@@ -22,6 +22,9 @@
 
 import os
 import re
+import time
+import threading
+import Queue
 
 import iutil
 from errors import *
@@ -53,7 +56,7 @@ def udev_resolve_devspec(devspec):
             if not spec.startswith("/dev/"):
                 spec = os.path.normpath("/dev/" + spec)
 
-            for link in dev["symlinks"]:
+            for link in udev_device_get_symlinks(dev):
                 if spec == link:
                     ret = dev
                     break
@@ -75,12 +78,59 @@ def udev_resolve_glob(glob):
         if fnmatch.fnmatch(name, glob):
             ret.append(name)
         else:
-            for link in dev["symlinks"]:
+            for link in udev_device_get_symlinks(dev):
                 if fnmatch.fnmatch(link, glob):
                     ret.append(name)
 
     return ret
 
+# number of threads udev_read_sysfs_files uses, and the number of files
+# below which it does not bother starting any
+SYSFS_READ_THREADS = 8
+SYSFS_READ_THREADS_MIN_FILES = 64
+
+def udev_read_sysfs_files(paths, threads=SYSFS_READ_THREADS):
+    """ Read a list of (small) sysfs files, using a pool of threads.
+
+        Return a dict mapping each path to the file's contents, or to None
+        if the file could not be read.
+    """
+    contents = {}
+
+    def read(path):
+        try:
+            f = open(path)
+            try:
+                contents[path] = f.read()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            contents[path] = None
+
+    if threads <= 1 or len(paths) < SYSFS_READ_THREADS_MIN_FILES:
+        map(read, paths)
+        return contents
+
+    queue = Queue.Queue()
+    for path in paths:
+        queue.put(path)
+
+    def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Queue.Empty:
+                return
+            read(path)
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    return contents
+
 def udev_get_block_devices():
     # Wait for scsi adapters to be done with scanning their busses (#583143)
     iutil.execWithRedirect("modprobe", [ "scsi_wait_scan" ],
@@ -88,36 +138,73 @@ def udev_get_block_devices():
     iutil.execWithRedirect("rmmod", [ "scsi_wait_scan" ],
                                stdout = "/dev/tty5", stderr="/dev/tty5")
     udev_settle()
+
+    # Read the sysfs attributes we need for every device up front and in
+    # parallel, then build the entries from that. libudev itself is not
+    # thread-safe, so the udev db lookups stay in this thread.
+    start = time.time()
+    paths = [p for p in udev_enumerate_devices(deviceClass="block")
+                if not __is_blacklisted_name(os.path.basename(p))]
+    files = []
+    for path in paths:
+        files.append("/sys/class/block/%s/device/model"
+                     % os.path.basename(path))
+        if os.path.basename(path).startswith("md"):
+            files.append("/sys%s/md/array_state" % path)
+
+    contents = udev_read_sysfs_files(files)
+    read = time.time()
+
     entries = []
-    for path in udev_enumerate_block_devices():
+    for path in paths:
+        name = os.path.basename(path)
+        model = contents.get("/sys/class/block/%s/device/model" % name)
+        if __is_blacklisted_model(name, model):
+            continue
+
         entry = udev_get_block_device(path)
         if entry:
             if entry["name"].startswith("md"):
                 # mdraid is really braindead, when a device is stopped
                 # it is no longer usefull in anyway (and we should not
                 # probe it) yet it still sticks around, see bug rh523387
-                state = None
-                state_file = "/sys/%s/md/array_state" % entry["sysfs_path"]
-                if os.access(state_file, os.R_OK):
-                    state = open(state_file).read().strip()
-                if state == "clear":
+                state = contents.get("/sys%s/md/array_state" % path)
+                if state is not None and state.strip() == "clear":
                     continue
             entries.append(entry)
+
+    elapsed = time.time() - read
+    log.info("udev_get_block_devices: %d devices, sysfs %.3fs, udev db %.3fs "
+             "(%.2f ms per device)"
+             % (len(entries), read - start, elapsed,
+                1000 * elapsed / max(len(paths), 1)))
     return entries
 
+def __is_blacklisted_name(dev_name):
+    return dev_name.startswith("loop") or dev_name.startswith("ram") or \
+           dev_name.startswith("fd")
+
+def __is_blacklisted_model(dev_name, model):
+    if not model:
+        return False
+
+    for bad in ("IBM *STMF KERNEL", "SCEI Flash-5", "DGC LUNZ"):
+        if model.find(bad) != -1:
+            log.info("ignoring %s with model %s" %(dev_name, model))
+            return True
+
+    return False
+
 def __is_blacklisted_blockdev(dev_name):
     """Is this a blockdev we never want for an install?"""
-    if dev_name.startswith("loop") or dev_name.startswith("ram") or dev_name.startswith("fd"):
+    if __is_blacklisted_name(dev_name):
         return True
 
+    model = None
     if os.path.exists("/sys/class/block/%s/device/model" %(dev_name,)):
         model = open("/sys/class/block/%s/device/model" %(dev_name,)).read()
-        for bad in ("IBM *STMF KERNEL", "SCEI Flash-5", "DGC LUNZ"):
-            if model.find(bad) != -1:
-                log.info("ignoring %s with model %s" %(dev_name, model))
-                return True
 
-    return False
+    return __is_blacklisted_model(dev_name, model)
 
 def udev_enumerate_block_devices():
     import os.path
@@ -297,11 +384,16 @@ def udev_device_get_bus(udev_info):
 def udev_device_get_path(info):
     return info["ID_PATH"]
 
+def udev_device_get_symlinks(info):
+    try:
+        return info["symlinks"]
+    except KeyError:
+        return []
+
 def udev_device_get_by_path(info):
-    if info.has_key('symlinks'):
-        for link in info['symlinks']:
-            if link.startswith('/dev/disk/by-path/'):
-                return link
+    for link in udev_device_get_symlinks(info):
+        if link.startswith('/dev/disk/by-path/'):
+            return link
 
     return udev_device_get_name(info)
 
@@ -364,40 +456,43 @@ def udev_device_get_pv_pe_start(info):
     # KB and convert to MB here
     return float(info['LVM2_PE_START']) / 1024
 
+def udev_device_get_lvm_list(info, name):
+    """ Return the list of values of an lvm property.
+
+        lvm outputs values for multiple lvs in one line, eg:
+        "lv1 LVM2_LV_NAME=lv2". Only the few lvm properties that hold
+        such lists are split, when they are asked for.
+    """
+    value = info[name]
+    if isinstance(value, list):
+        return value
+
+    # if the first lv's value is empty we end up with a value starting
+    # with name=, prepend a space that our split does the right thing
+    if value.startswith("%s=" % name):
+        value = " " + value
+
+    if value.count(" %s=" % name):
+        return value.split(" %s=" % name)
+    elif value:
+        return [value]
+    else:
+        return []
+
 def udev_device_get_lv_names(info):
-    names = info['LVM2_LV_NAME']
-    if not names:
-        names = []
-    elif not isinstance(names, list):
-        names = [names]
-    return names
+    return udev_device_get_lvm_list(info, 'LVM2_LV_NAME')
 
 def udev_device_get_lv_uuids(info):
-    uuids = info['LVM2_LV_UUID']
-    if not uuids:
-        uuids = []
-    elif not isinstance(uuids, list):
-        uuids = [uuids]
-    return uuids
+    return udev_device_get_lvm_list(info, 'LVM2_LV_UUID')
 
 def udev_device_get_lv_sizes(info):
     # lvm's decmial precision is not configurable, so we tell it to use
     # KB and convert to MB here
-    sizes = info['LVM2_LV_SIZE']
-    if not sizes:
-        sizes = []
-    elif not isinstance(sizes, list):
-        sizes = [sizes]
-
+    sizes = udev_device_get_lvm_list(info, 'LVM2_LV_SIZE')
     return [float(s) / 1024 for s in sizes]
 
 def udev_device_get_lv_attr(info):
-    attr = info['LVM2_LV_ATTR']
-    if not attr:
-        attr = []
-    elif not isinstance(attr, list):
-        attr = [attr]
-    return attr
+    return udev_device_get_lvm_list(info, 'LVM2_LV_ATTR')
 
 def udev_device_dm_subsystem_match(info, subsystem):
     """ Return True if the device matches a given device-mapper subsystem. """
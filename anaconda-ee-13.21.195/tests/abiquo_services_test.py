@@ -0,0 +1,178 @@
+import mock
+import unittest
+
+class ServicePlanTestCase(mock.TestCase):
+    """ Services switched on and off for the Abiquo profiles. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'logging', 'anaconda_log'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def _plan(self, groups):
+        from abiquo_postinstall import servicePlan
+        return dict(servicePlan(lambda group: group in groups))
+
+    def testBase(self):
+        self.assertEqual(self._plan([]), {"motd": "on",
+                                          "iptables": "off",
+                                          "ip6tables": "off"})
+
+    def testOverrides(self):
+        plan = self._plan(["abiquo-server"])
+        self.assertEqual(plan["zookeeper"], "off")
+        self.assertEqual(plan["redis"], "on")
+        self.assertEqual(plan["httpd"], "on")
+
+        # the standalone api needs zookeeper even next to the server
+        plan = self._plan(["abiquo-server", "abiquo-standalone-api"])
+        self.assertEqual(plan["zookeeper"], "on")
+
+    def testNoDuplicates(self):
+        from abiquo_postinstall import servicePlan
+        plan = servicePlan(lambda group: True)
+        services = [service for (service, state) in plan]
+        self.assertEqual(len(services), len(set(services)))
+
+class ServiceReadinessTestCase(mock.TestCase):
+    """ Waiting for services to answer. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'logging', 'anaconda_log'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def testWaitForService(self):
+        from abiquo_services import waitForService
+        probes = []
+        def probe():
+            probes.append(True)
+            return len(probes) == 3
+
+        self.assertTrue(waitForService("test", probe, timeout=10))
+        self.assertEqual(len(probes), 3)
+
+        self.assertFalse(waitForService("test", lambda: False, timeout=0.3))
+
+    def testProbeRedis(self):
+        import socket
+        import threading
+        from abiquo_services import probeRedis
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        def answer():
+            (conn, addr) = server.accept()
+            if conn.recv(64) == "PING\r\n":
+                conn.sendall("+PONG\r\n")
+            conn.close()
+        t = threading.Thread(target=answer)
+        t.start()
+
+        self.assertTrue(probeRedis(server.getsockname()))
+        t.join()
+        server.close()
+
+class FakeRedis(object):
+    """ A stand-in for redis-server knowing just enough commands. """
+
+    def __init__(self, hashes, scan=True):
+        import socket
+        import threading
+        self.hashes = hashes
+        self.scan = scan
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.address = self.server.getsockname()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def reply(self, value):
+        if value is None:
+            return "$-1\r\n"
+        elif isinstance(value, int):
+            return ":%d\r\n" % value
+        elif isinstance(value, list):
+            return "*%d\r\n" % len(value) + "".join(map(self.reply, value))
+        return "$%d\r\n%s\r\n" % (len(value), value)
+
+    def command(self, args):
+        import fnmatch
+        keys = sorted(self.hashes.keys())
+        if args[0] == "SCAN" and self.scan:
+            (cursor, count) = (int(args[1]), int(args[5]))
+            found = [k for k in keys[cursor:cursor + count]
+                     if fnmatch.fnmatch(k, args[3])]
+            cursor += count
+            if cursor >= len(keys):
+                cursor = 0
+            return self.reply([str(cursor), found])
+        elif args[0] == "KEYS":
+            return self.reply([k for k in keys if fnmatch.fnmatch(k, args[1])])
+        elif args[0] == "HGET":
+            return self.reply(self.hashes.get(args[1], {}).get(args[2]))
+        elif args[0] == "HSET":
+            self.hashes.setdefault(args[1], {})[args[2]] = args[3]
+            return self.reply(0)
+        return "-ERR unknown command '%s'\r\n" % args[0]
+
+    def serve(self):
+        (conn, addr) = self.server.accept()
+        f = conn.makefile("rb")
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            args = []
+            for i in range(int(line[1:])):
+                length = int(f.readline()[1:])
+                args.append(f.read(length + 2)[:-2])
+            conn.sendall(self.command(args))
+        conn.close()
+        self.server.close()
+
+
+class RedisMigrationTestCase(mock.TestCase):
+    """ Updating Redis hashes through a pipelined connection. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'logging', 'anaconda_log'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def _migrate(self, scan):
+        from abiquo_services import RedisConnection, updateHashField
+        hashes = {}
+        for i in range(2500):
+            hashes["Task:%d" % i] = {"type": ["SNAPSHOT", "DEPLOY"][i % 2]}
+        hashes["Job:1"] = {"type": "SNAPSHOT"}
+        server = FakeRedis(hashes, scan=scan)
+
+        conn = RedisConnection(*server.address)
+        result = updateHashField(conn, "Task:*", "type", "SNAPSHOT",
+                                 "INSTANCE", batch=100)
+        conn.close()
+
+        self.assertEqual(result, (2500, 1250))
+        self.assertEqual(hashes["Task:0"]["type"], "INSTANCE")
+        self.assertEqual(hashes["Task:1"]["type"], "DEPLOY")
+        self.assertEqual(hashes["Job:1"]["type"], "SNAPSHOT")
+
+    def testScan(self):
+        self._migrate(scan=True)
+
+    def testKeys(self):
+        self._migrate(scan=False)
+
+
+def suite():
+    suite1 = unittest.TestLoader().loadTestsFromTestCase(ServicePlanTestCase)
+    suite2 = unittest.TestLoader().loadTestsFromTestCase(ServiceReadinessTestCase)
+    suite3 = unittest.TestLoader().loadTestsFromTestCase(RedisMigrationTestCase)
+    return unittest.TestSuite([suite1, suite2, suite3])
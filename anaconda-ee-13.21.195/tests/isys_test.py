@@ -0,0 +1,78 @@
+import errno
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+class FakeSELinux(object):
+    """ Contexts of a tree of files, all labeled "old". """
+    def __init__(self, unlabeled=()):
+        self.unlabeled = unlabeled
+        self.checked = []
+        self.set = []
+
+    def matchpathcon(self, path, mode):
+        return (0, "new")
+
+    def lgetfilecon(self, path):
+        self.checked.append(path)
+        if not os.path.lexists(path):
+            raise OSError(errno.ENOENT, "No such file or directory")
+        if os.path.basename(path) in self.unlabeled:
+            raise OSError(errno.ENODATA, "No data available")
+        return (0, "old")
+
+    def lsetfilecon(self, path, con):
+        self.set.append(path)
+        return 0
+
+class ResetFileContextsTestCase(mock.TestCase):
+    """ Relabeling files and trees of files after the install. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'dbus', 'logging', 'selinux'])
+        self.root = tempfile.mkdtemp()
+        for path in ("etc/sysconfig", "var/log/audit", "var/lib"):
+            os.makedirs(os.path.join(self.root, path))
+        for path in ("etc/fstab", "etc/sysconfig/network",
+                     "var/log/messages", "var/log/audit/audit.log"):
+            open(os.path.join(self.root, path), "w").close()
+
+        import isys
+        self.isys = isys
+        self.selinux = isys.selinux
+
+    def tearDown(self):
+        self.isys.selinux = self.selinux
+        shutil.rmtree(self.root)
+        self.tearDownModules()
+
+    def _relabel(self, fns, dirs, unlabeled=()):
+        fake = FakeSELinux(unlabeled)
+        self.isys.selinux = fake
+        self.isys.resetFileContexts(fns, dirs=dirs, instroot=self.root)
+        strip = len(self.root)
+        return ([p[strip:] for p in fake.checked],
+                sorted([p[strip:] for p in fake.set]))
+
+    def testTrees(self):
+        (checked, relabeled) = self._relabel(
+            ["/etc/fstab", "/var/log/messages", "/etc/fstab", "/missing"],
+            ["/var/log", "/var/log/audit/", "/var"])
+
+        # each file is looked at once: /var covers /var/log and the files
+        # in it, and /etc/fstab is listed twice
+        self.assertEqual(sorted(checked), sorted(relabeled + ["/missing"]))
+        self.assertEqual(relabeled, ["/etc/fstab", "/var", "/var/lib", "/var/log",
+                               "/var/log/audit", "/var/log/audit/audit.log",
+                               "/var/log/messages"])
+
+    def testUnlabeled(self):
+        (checked, relabeled) = self._relabel(
+            ["/etc/fstab", "/etc/sysconfig/network"], [],
+            unlabeled=("network",))
+        self.assertEqual(relabeled, ["/etc/fstab", "/etc/sysconfig/network"])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ResetFileContextsTestCase)
@@ -0,0 +1,95 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+class Repo(object):
+    def __init__(self, id, cachedir):
+        self.id = id
+        self.cachedir = cachedir
+
+class RepoMetadataCacheTestCase(mock.TestCase):
+    """ Repository metadata kept across installer runs. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'logging'])
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachePath = os.path.join(self.tmpdir, "cache")
+        os.mkdir(self.cachePath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        self.tearDownModules()
+
+    def _repo(self, name, repomd):
+        cachedir = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.join(cachedir, "packages"))
+        self._write(os.path.join(cachedir, "repomd.xml"), repomd)
+        return Repo(name, cachedir)
+
+    def _write(self, path, data):
+        f = open(path, "w")
+        f.write(data)
+        f.close()
+
+    def _read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testRestore(self):
+        from repocache import RepoMetadataCache
+        cache = RepoMetadataCache(self.cachePath)
+
+        first = self._repo("first", "<repomd>1</repomd>")
+        self.assertFalse(cache.restore(first))
+        self._write(os.path.join(first.cachedir, "primary.sqlite"), "primary")
+        os.mkdir(os.path.join(first.cachedir, "gen"))
+        self._write(os.path.join(first.cachedir, "gen", "comps.xml"), "comps")
+        self._write(os.path.join(first.cachedir, "packages", "a.rpm"), "rpm")
+        cache.store(first)
+
+        # the same repository in a later install
+        second = self._repo("second", "<repomd>1</repomd>")
+        self.assertTrue(cache.restore(second))
+        self.assertEqual(self._read(os.path.join(second.cachedir,
+                                                 "primary.sqlite")),
+                         "primary")
+        self.assertEqual(self._read(os.path.join(second.cachedir,
+                                                 "gen", "comps.xml")),
+                         "comps")
+        self.assertFalse(os.path.exists(os.path.join(second.cachedir,
+                                                     "packages", "a.rpm")))
+
+        # the repository changed
+        third = self._repo("third", "<repomd>2</repomd>")
+        self.assertFalse(cache.restore(third))
+
+        self.assertEqual(cache.hits, ["second"])
+        self.assertEqual(cache.misses, ["first", "third"])
+
+    def testPrune(self):
+        from repocache import RepoMetadataCache, repomdChecksum
+        cache = RepoMetadataCache(self.cachePath, maxEntries=2)
+
+        repos = []
+        for i in range(4):
+            repo = self._repo("repo%d" % i, "<repomd>%d</repomd>" % i)
+            # age the entries already there so that the new one is the
+            # most recently used
+            for entry in os.listdir(self.cachePath):
+                path = os.path.join(self.cachePath, entry)
+                mtime = os.stat(path).st_mtime - 10
+                os.utime(path, (mtime, mtime))
+            cache.store(repo)
+            repos.append(repo)
+
+        kept = [repomdChecksum(r.cachedir) for r in repos[2:]]
+        self.assertEqual(sorted(os.listdir(self.cachePath)), sorted(kept))
+        self.assertEqual(cache.stored, ["repo0", "repo1", "repo2", "repo3"])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(RepoMetadataCacheTestCase)
@@ -0,0 +1,101 @@
+import mock
+import unittest
+
+class ActionGraphTestCase(mock.TestCase):
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block', 'parted', '_ped'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def _action(self, device, type, obj, dir=None):
+        from storage.deviceaction import DeviceAction
+        action = DeviceAction.__new__(DeviceAction)
+        action.device = device
+        action.type = type
+        action.obj = obj
+        action.dir = dir
+        return action
+
+    def testOrdering(self):
+        from storage.devices import StorageDevice
+        from storage.deviceaction import ActionGraph, ACTION_TYPE_CREATE, \
+                                         ACTION_TYPE_DESTROY, \
+                                         ACTION_OBJECT_DEVICE, \
+                                         ACTION_OBJECT_FORMAT
+        sda = StorageDevice("sda", exists=True)
+        sdb = StorageDevice("sdb", exists=True)
+        sdc = StorageDevice("sdc", exists=True)
+        md = StorageDevice("md0", parents=[sda, sdb])
+        pv = StorageDevice("pv", parents=[md])
+
+        create = ACTION_TYPE_CREATE
+        destroy = ACTION_TYPE_DESTROY
+        dev = ACTION_OBJECT_DEVICE
+        fmt = ACTION_OBJECT_FORMAT
+        actions = [self._action(pv, create, fmt),
+                   self._action(pv, create, dev),
+                   self._action(md, create, fmt),
+                   self._action(md, create, dev),
+                   self._action(sda, create, fmt),
+                   self._action(sdc, create, fmt),
+                   self._action(sdc, destroy, fmt),
+                   self._action(pv, destroy, dev),
+                   self._action(md, destroy, dev)]
+        graph = ActionGraph(actions)
+        ordered = graph.sortedActions()
+        expected = [6, 7, 8, 4, 3, 2, 1, 0, 5]
+        self.assertEqual(ordered, [actions[i] for i in expected])
+
+        # formats on sdc do not share any ancestor with the others
+        formats = [a for a in actions if a.isCreate() and a.isFormat()]
+        self.assertEqual(graph.branches(formats),
+                         [[actions[4], actions[2], actions[0]],
+                          [actions[5]]])
+
+    def testCreateFormatsConcurrently(self):
+        from storage.deviceaction import createFormatsConcurrently
+
+        created = []
+        class FakeDevice(object):
+            def __init__(self, name):
+                self.name = name
+
+        class FakeAction(object):
+            def __init__(self, name, fail=False):
+                self.name = name
+                self.fail = fail
+                self.device = FakeDevice("sd" + name)
+
+            def createFormat(self, intf=None):
+                if self.fail:
+                    raise RuntimeError("mkfs failed")
+                created.append(self.name)
+
+        branches = [[FakeAction("a1"), FakeAction("a2")],
+                    [FakeAction("b1")],
+                    [FakeAction("c1")]]
+        self.assertEqual(createFormatsConcurrently(branches, maxJobs=2), [])
+        self.assertEqual(sorted(created), ["a1", "a2", "b1", "c1"])
+        self.assertTrue(created.index("a1") < created.index("a2"))
+
+        # the rest of a failed branch is left for serial execution
+        del created[:]
+        branches = [[FakeAction("a1", fail=True), FakeAction("a2")]]
+        remaining = createFormatsConcurrently(branches)
+        self.assertEqual([a.name for a in remaining], ["a1", "a2"])
+        self.assertEqual(created, [])
+
+        # and no branch is started after a failure
+        branches = [[FakeAction("a1")],
+                    [FakeAction("b1", fail=True), FakeAction("b2")],
+                    [FakeAction("c1")]]
+        remaining = createFormatsConcurrently(branches, maxJobs=1)
+        self.assertEqual([a.name for a in remaining], ["b1", "b2", "c1"])
+        self.assertEqual(created, ["a1"])
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ActionGraphTestCase)
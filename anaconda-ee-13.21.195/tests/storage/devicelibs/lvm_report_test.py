@@ -0,0 +1,72 @@
+import mock
+import unittest
+
+class LVMReportTestCase(mock.TestCase):
+
+    pvs = """\
+  /dev/sda2|Pv1Uuid|1024.00|vg_test|Vg1Uuid
+  /dev/sdb1|Pv2Uuid|1024.00|vg_test|Vg1Uuid
+  /dev/sdc1|Pv3Uuid|192.00||
+"""
+
+    vgs = """\
+  vg_test|Vg1Uuid|20971520.00|1048576.00|4096.00|5120|256|2
+"""
+
+    lvs = """\
+  Vg1Uuid|lv_root|Lv1Uuid|10485760.00|-wi-ao|
+  Vg1Uuid|lv_snap|Lv2Uuid|1048576.00|swi-a-|lv_root
+  Vg1Uuid|[lv_mirror_mimage_0]|Lv3Uuid|1048576.00|iwi-ao|
+"""
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def testParse(self):
+        from storage.devicelibs import lvm
+        rows = lvm.parse_lvm_report(self.pvs, lvm.LVM_REPORT_PV_FIELDS)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]["pv_name"], "/dev/sda2")
+        self.assertEqual(rows[2]["vg_uuid"], "")
+
+        # lines with the wrong number of fields are dropped
+        rows = lvm.parse_lvm_report("a|b\n", lvm.LVM_REPORT_PV_FIELDS)
+        self.assertEqual(rows, [])
+
+    def testReport(self):
+        from storage.devicelibs import lvm
+        report = lvm.build_lvm_report(
+                    lvm.parse_lvm_report(self.pvs, lvm.LVM_REPORT_PV_FIELDS),
+                    lvm.parse_lvm_report(self.vgs, lvm.LVM_REPORT_VG_FIELDS),
+                    lvm.parse_lvm_report(self.lvs, lvm.LVM_REPORT_LV_FIELDS))
+        lvm.lvm_report = report
+        try:
+            self.assertEqual(lvm.lvm_report_get_pv("Pv1Uuid"),
+                             lvm.lvm_report_get_pv("/dev/sda2"))
+            self.assertEqual(lvm.lvm_report_get_pv("Pv2Uuid")["pe_start"], 1.0)
+
+            vg = lvm.lvm_report_get_vg("Vg1Uuid")
+            self.assertEqual(vg["vg_size"], 20480.0)
+            self.assertEqual(vg["vg_extent_size"], 4.0)
+            self.assertEqual(vg["pv_count"], 2)
+
+            lvs = lvm.lvm_report_get_lvs("Vg1Uuid")
+            self.assertEqual([lv["lv_name"] for lv in lvs],
+                             ["lv_root", "lv_snap", "[lv_mirror_mimage_0]"])
+            self.assertEqual(lvs[0]["lv_size"], 10240.0)
+            self.assertEqual(lvm.lvm_report_get_origin("Vg1Uuid", "lv_snap"),
+                             "lv_root")
+            self.assertEqual(lvm.lvm_report_get_origin("Vg1Uuid", "nope"),
+                             None)
+        finally:
+            lvm.lvm_report_reset()
+
+        self.assertEqual(lvm.lvm_report_get_vg("Vg1Uuid"), None)
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(LVMReportTestCase)
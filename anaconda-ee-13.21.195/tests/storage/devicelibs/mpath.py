@@ -1,5 +1,6 @@
 #!/usr/bin/python
 import mock
+import unittest
 
 class MPathTestCase(mock.TestCase):
 
@@ -98,6 +99,68 @@ size=532G features='1 queue_if_no_path' hwhandler='1 alua' wp=undef
         topology = mpath.parseMultipathOutput(self.output5)
         self.assertEqual(topology, {'mpatha':['sda']})
 
+    def testTopologyCache(self):
+        from storage.devicelibs import mpath
+        outputs = {"-d": self.output3, "-ll": ""}
+        calls = []
+        def execWithCapture(command, argv, *args, **kwargs):
+            calls.append(argv)
+            return outputs[argv[0]]
+        saved = mpath.iutil.execWithCapture
+        mpath.iutil.execWithCapture = execWithCapture
+        mpath._topologies.clear()
+        try:
+            devices = [{'name': name, 'DEVTYPE': 'disk',
+                        'sysfs_path': '/devices/virtual/block/%s' % name,
+                        'ID_SERIAL_SHORT': serial}
+                       for (name, serial) in
+                       [('sda', '3600a0b800067fcc9000001f34d23ff88'),
+                        ('sdb', '3600a0b800067fabc000067694d23fe6e'),
+                        ('sdc', '3600a0b800067fcc9000001f34d23ff88'),
+                        ('sdd', '3600a0b800067fabc000067694d23fe6e')]]
+            topology = mpath.getMultipathTopology(devices)
+            self.assertEqual(len(calls), 2)
+            # callers may change what they get back
+            topology.clear()
+            self.assertEqual(mpath.getMultipathTopology(devices),
+                             {'3600a0b800067fabc000067694d23fe6e' : ['sdb','sdd'],
+                              '3600a0b800067fcc9000001f34d23ff88' : ['sda', 'sdc']})
+            self.assertEqual(len(calls), 2)
+
+            # a new disk means a new topology
+            devices.append({'name': 'sde', 'DEVTYPE': 'disk',
+                            'sysfs_path': '/devices/virtual/block/sde',
+                            'ID_SERIAL_SHORT': 'SATA_1'})
+            mpath.getMultipathTopology(devices)
+            self.assertEqual(len(calls), 4)
+        finally:
+            mpath.iutil.execWithCapture = saved
+            mpath._topologies.clear()
+
+    def testSetup(self):
+        from storage.devicelibs import mpath
+        batches = []
+        def execBatchWithRedirect(commands, *args, **kwargs):
+            batches.append(commands)
+            # creating mpathb fails, kpartx fails on mpathc
+            return [int(argv[-1] in ("mpathb", "/dev/mapper/mpathc"))
+                    for (command, argv) in commands]
+        saved = (mpath.iutil.execBatchWithRedirect, mpath.udev_settle)
+        mpath.iutil.execBatchWithRedirect = execBatchWithRedirect
+        mpath.udev_settle = lambda: None
+        try:
+            failed = mpath.setup_multipaths(["mpatha", "mpathb", "mpathc"])
+        finally:
+            (mpath.iutil.execBatchWithRedirect, mpath.udev_settle) = saved
+
+        # only the maps asked for are created
+        self.assertEqual(batches[0], [("multipath", ["mpatha"]),
+                                      ("multipath", ["mpathb"]),
+                                      ("multipath", ["mpathc"])])
+        self.assertEqual([argv[-1] for (command, argv) in batches[1]],
+                         ["/dev/mapper/mpatha", "/dev/mapper/mpathc"])
+        self.assertEqual(failed, ["mpathc"])
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(MPathTestCase)
@@ -0,0 +1,525 @@
+import gc
+import logging
+import mock
+import time
+import unittest
+
+log = logging.getLogger("anaconda.tests")
+
+class DeviceTreeTestCase(mock.TestCase):
+    """ Common setup of the device tree tests.
+
+        The benchmark tests run the same code on trees big enough for the
+        time they take to matter, and log that time at debug level.
+    """
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block', 'parted', '_ped'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def logTime(self, start, what):
+        log.debug("%s: %s %.2fs" % (self.id(), what, time.time() - start))
+
+class DeviceTreeLookupTestCase(DeviceTreeTestCase):
+    """ Device lookups on a synthetic tree. """
+
+    NUM_DISKS = 5000
+
+    def _populate(self, tree, count):
+        from storage.devices import DiskDevice
+        disks = []
+        for i in range(count):
+            disk = DiskDevice("sd%d" % i, serial="serial%d" % (i / 4),
+                              sysfsPath="/devices/virtual/block/sd%d" % i)
+            tree._addDevice(disk)
+            disks.append(disk)
+        return disks
+
+    def testLookups(self):
+        from storage.devicetree import DeviceTree
+        tree = DeviceTree()
+        disks = self._populate(tree, 8)
+
+        self.assertEqual(tree.getDeviceByName("sd3"), disks[3])
+        self.assertEqual(tree.getDeviceByPath("/dev/sd3"), disks[3])
+        self.assertEqual(tree.getDeviceBySysfsPath(
+                            "/devices/virtual/block/sd5"), disks[5])
+        self.assertEqual(tree.getDevicesBySerial("serial1"), disks[4:8])
+        self.assertEqual(tree.getDevicesByType("disk"), disks)
+        self.assertEqual(tree.getDeviceByName("sdx"), None)
+
+        # changes made behind the tree's back are picked up
+        disks[2].sysfsPath = "/devices/virtual/block/sdx"
+        self.assertEqual(tree.getDeviceBySysfsPath(
+                            "/devices/virtual/block/sd2"), None)
+        self.assertEqual(tree.getDeviceBySysfsPath(
+                            "/devices/virtual/block/sdx"), disks[2])
+
+        tree._removeDevice(disks[3])
+        self.assertEqual(tree.getDeviceByName("sd3"), None)
+        self.assertEqual(tree.getDevicesBySerial("serial0"), disks[0:3])
+
+    def testLVMNames(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import LVMVolumeGroupDevice
+        tree = DeviceTree()
+        vg = LVMVolumeGroupDevice("my-vg", [], exists=True)
+        tree._addDevice(vg)
+        self.assertEqual(tree.getDeviceByName("my--vg"), vg)
+        self.assertEqual(tree.getDeviceByName("my-vg"), vg)
+
+    def testRenames(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import LVMVolumeGroupDevice, \
+                                    LVMLogicalVolumeDevice
+        tree = DeviceTree()
+        vg = LVMVolumeGroupDevice("vg", [])
+        lv = LVMLogicalVolumeDevice("root", vg, exists=True)
+        tree._addDevice(vg)
+        tree._addDevice(lv)
+        self.assertEqual(tree.getDeviceByName("vg-root"), lv)
+
+        # renaming the vg renames its lvs
+        vg.name = "system"
+        self.assertEqual(tree.getDeviceByName("vg-root"), None)
+        self.assertEqual(tree.getDeviceByName("system-root"), lv)
+
+    def testChangeLog(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import Device
+        gc.collect()
+        trees = [DeviceTree(), DeviceTree()]
+        disks = self._populate(trees[0], 2)
+        trees[1]._addDevice(disks[1])
+
+        # the log is kept until every tree has seen it
+        disks[1].sysfsPath = "/devices/virtual/block/sdx"
+        self.assertEqual(trees[0].getDeviceBySysfsPath(disks[1].sysfsPath),
+                         disks[1])
+        self.assertEqual(len(Device.changeLog), 1)
+        self.assertEqual(trees[1].getDeviceBySysfsPath(disks[1].sysfsPath),
+                         disks[1])
+        self.assertEqual(Device.changeLog, [])
+
+    def testLookupBenchmark(self):
+        from storage.devicetree import DeviceTree
+        tree = DeviceTree()
+
+        start = time.time()
+        disks = self._populate(tree, self.NUM_DISKS)
+        self.logTime(start, "populate %d devices" % self.NUM_DISKS)
+
+        start = time.time()
+        for disk in disks:
+            self.assertEqual(tree.getDeviceByName(disk.name), disk)
+            self.assertEqual(tree.getDeviceBySysfsPath(disk.sysfsPath), disk)
+        self.logTime(start, "%d lookups" % (2 * self.NUM_DISKS))
+
+class DeviceTreeViewTestCase(DeviceTreeTestCase):
+    """ Cached device lists of the tree and of Storage. """
+
+    NUM_DISKS = 2000
+    NUM_ACCESSES = 200
+
+    def _storage(self, tree):
+        from storage import Storage
+        storage = Storage.__new__(Storage)
+        storage.devicetree = tree
+        storage.eddDict = {}
+        return storage
+
+    def testViews(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import DiskDevice, StorageDevice
+        tree = DeviceTree()
+        storage = self._storage(tree)
+        sdb = DiskDevice("sdb")
+        sda = DiskDevice("sda")
+        tree._addDevice(sdb)
+        tree._addDevice(sda)
+
+        generation = tree.generation
+        self.assertEqual(storage.devices, [sda, sdb])
+        self.assertEqual(tree.devices, [sdb, sda])
+        self.assertEqual(tree.generation, generation)
+
+        # the views are copies
+        storage.devices.remove(sda)
+        self.assertEqual(storage.devices, [sda, sdb])
+
+        md = StorageDevice("md0", parents=[sda])
+        tree._addDevice(md)
+        self.assertNotEqual(tree.generation, generation)
+        self.assertEqual(storage.devices, [md, sda, sdb])
+        self.assertEqual(tree.getChildren(sda), [md])
+        self.assertEqual(tree.getChildren(sdb), [])
+
+        # parents and names changed behind the tree's back are picked up
+        md.parents.append(sdb)
+        md.noteIndexedChange()
+        self.assertEqual(tree.getChildren(sdb), [md])
+        md.parents = [sdb]
+        self.assertEqual(tree.getChildren(sda), [])
+
+        sdb._name = "sdc"
+        sdb.noteIndexedChange()
+        self.assertEqual(storage.devices, [md, sda, sdb])
+
+        tree._removeDevice(md)
+        self.assertEqual(storage.devices, [sda, sdb])
+        self.assertEqual(tree.getChildren(sdb), [])
+
+    def testViewBenchmark(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import DiskDevice
+        tree = DeviceTree()
+        for i in range(self.NUM_DISKS):
+            tree._addDevice(DiskDevice("sd%d" % i))
+        storage = self._storage(tree)
+
+        start = time.time()
+        for i in range(self.NUM_ACCESSES):
+            self.assertEqual(len(storage.devices), self.NUM_DISKS)
+            storage.disks
+            storage.partitions
+            storage.vgs
+            storage.lvs
+            storage.pvs
+            storage.mdarrays
+            storage.swaps
+            storage.protectedDevices
+            tree.getChildren(tree.devices[i])
+        self.logTime(start, "%d rounds of property accesses on %d devices"
+                            % (self.NUM_ACCESSES, self.NUM_DISKS))
+
+class DeviceDependencyTestCase(DeviceTreeTestCase):
+    """ Dependency queries on synthetic device stacks. """
+
+    NUM_STACKS = 500
+
+    def _stack(self, tree, prefix):
+        """ Add a disk, partition, md, luks, pv, vg, lv stack to tree. """
+        from storage.devices import StorageDevice
+        stack = []
+        parents = []
+        for name in ("sd", "sd1", "md", "luks", "pv", "vg", "lv"):
+            device = StorageDevice("%s%s" % (prefix, name), parents=parents)
+            tree._addDevice(device)
+            stack.append(device)
+            parents = [device]
+        return stack
+
+    def testDependsOn(self):
+        from storage.devicetree import DeviceTree
+        tree = DeviceTree()
+        stack = self._stack(tree, "a")
+        other = self._stack(tree, "b")
+
+        lv = stack[-1]
+        self.assertTrue(lv.dependsOn(stack[0]))
+        self.assertTrue(stack[2].dependsOn(stack[1]))
+        self.assertFalse(stack[1].dependsOn(stack[2]))
+        self.assertFalse(lv.dependsOn(other[0]))
+        self.assertFalse(lv.dependsOn(lv))
+
+        self.assertEqual(tree.getDependentDevices(stack[2]), stack[3:])
+        self.assertEqual(tree.getDependencyClosure([stack[4], other[5]]),
+                         set(stack[5:] + other[6:]))
+
+        # moving the md onto the other disk shows up in its dependents
+        stack[2].parents = [other[1]]
+        self.assertTrue(lv.dependsOn(other[0]))
+        self.assertFalse(lv.dependsOn(stack[0]))
+        self.assertEqual(tree.getDependentDevices(stack[0]), stack[1:2])
+        self.assertEqual(tree.getDependentDevices(other[1]),
+                         stack[2:] + other[2:])
+
+    def testArrayMembers(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import DiskDevice, DMRaidArrayDevice
+        from storage.formats import getFormat
+        tree = DeviceTree()
+        disks = []
+        for name in ("sda", "sdb"):
+            disk = DiskDevice(name, format=getFormat("dmraidmember"))
+            tree._addDevice(disk)
+            disks.append(disk)
+
+        array = DMRaidArrayDevice("isw_raid", parents=disks[:1])
+        tree._addDevice(array)
+        self.assertTrue(array.dependsOn(disks[0]))
+        self.assertFalse(array.dependsOn(disks[1]))
+        self.assertEqual(tree.getChildren(disks[1]), [])
+
+        # members added while probing show up in the cached relations
+        array._addDevice(disks[1])
+        self.assertTrue(array.dependsOn(disks[1]))
+        self.assertEqual(tree.getChildren(disks[1]), [array])
+        self.assertEqual(tree.getDependentDevices(disks[1]), [array])
+
+    def testDependencyBenchmark(self):
+        from storage.devicetree import DeviceTree
+        tree = DeviceTree()
+        stacks = [self._stack(tree, "s%d" % i)
+                  for i in range(self.NUM_STACKS)]
+
+        start = time.time()
+        for stack in stacks:
+            self.assertTrue(stack[-1].dependsOn(stack[0]))
+            self.assertFalse(stack[-1].dependsOn(stacks[0][-1]))
+            self.assertEqual(len(tree.getDependentDevices(stack[0])), 6)
+        self.logTime(start, "%d dependency queries on %d devices"
+                            % (3 * self.NUM_STACKS, len(tree.devices)))
+
+class DeviceTreeRefreshTestCase(DeviceTreeTestCase):
+    """ Applying uevents to a populated tree. """
+
+    def setUp(self):
+        DeviceTreeTestCase.setUp(self)
+
+        import storage.devicetree
+        self.devicetree = storage.devicetree
+        self.saved = {}
+        self.events = []
+        self.udev = {}
+        self.patch("udev_settle", lambda: None)
+        self.patch("udev_monitor_get_events", self._getEvents)
+        self.patch("udev_get_block_device", self.udev.get)
+        self.patch("udev_enumerate_devices", lambda: self.udev.keys())
+        self.patch("udev_monitor_stop", lambda monitor: None)
+
+    def tearDown(self):
+        for (name, value) in self.saved.items():
+            setattr(self.devicetree, name, value)
+        DeviceTreeTestCase.tearDown(self)
+
+    def patch(self, name, value):
+        self.saved[name] = getattr(self.devicetree, name)
+        setattr(self.devicetree, name, value)
+
+    def _getEvents(self, monitor):
+        (events, self.events) = (self.events, [])
+        return events
+
+    def _tree(self):
+        from storage.devices import StorageDevice
+        tree = self.devicetree.DeviceTree()
+        tree.populated = True
+        tree._monitor = object()
+        self.probed = []
+
+        def addUdevDevice(info):
+            self.probed.append(info["name"])
+            tree._udevSignatures[info["sysfs_path"]] = tree._udevSignature(info)
+            parents = [d for d in tree.devices if d.sysfsPath == info["parent"]]
+            device = StorageDevice(info["name"], parents=parents,
+                                   sysfsPath=info["sysfs_path"])
+            tree._addDevice(device)
+
+        tree.addUdevDevice = addUdevDevice
+        return tree
+
+    def _udev(self, name, path, parent=None, **kwargs):
+        info = {"name": name, "sysfs_path": path, "parent": parent,
+                "DEVTYPE": "disk"}
+        info.update(kwargs)
+        self.udev[path] = info
+        return info
+
+    def testRefresh(self):
+        tree = self._tree()
+        sda = "/devices/pci0000:00/host0/block/sda"
+        sdb = "/devices/pci0000:00/host1/block/sdb"
+        self._udev("sda", sda)
+        self._udev("sda1", sda + "/sda1", parent=sda)
+        self.events = [("add", sda), ("add", sda + "/sda1")]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, ["sda", "sda1"])
+        self.assertEqual([d.name for d in tree.devices], ["sda", "sda1"])
+
+        # a new disk is probed, unchanged devices are not
+        self._udev("sdb", sdb, ID_FS_TYPE="ext4")
+        self.probed = []
+        self.events = [("change", sda), ("add", sdb)]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, ["sdb"])
+
+        # so is a partition that did not change
+        self.probed = []
+        self.events = [("change", sda + "/sda1")]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, [])
+
+        # a changed partition means its disk is probed again
+        self._udev("sda1", sda + "/sda1", parent=sda, ID_FS_TYPE="ext4")
+        self.events = [("change", sda + "/sda1")]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, ["sda", "sda1"])
+
+        # and so does a new partition
+        self._udev("sda2", sda + "/sda2", parent=sda)
+        self.probed = []
+        self.events = [("add", sda + "/sda2")]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, ["sda", "sda1", "sda2"])
+
+        # devices that went away take the ones built on them along
+        del self.udev[sda]
+        del self.udev[sda + "/sda1"]
+        self.events = [("remove", sda + "/sda1"), ("remove", sda)]
+        self.assertTrue(tree.refresh())
+        self.assertEqual([d.name for d in tree.devices], ["sdb"])
+
+        # devices with actions registered are left to a full rescan
+        from storage.deviceaction import ActionDestroyFormat
+        action = ActionDestroyFormat.__new__(ActionDestroyFormat)
+        action.device = tree.getDeviceByName("sdb")
+        tree._setActions([action])
+        self._udev("sdb", sdb, ID_FS_TYPE="xfs")
+        self.events = [("change", sdb)]
+        self.assertFalse(tree.refresh())
+
+    def testPopulateFailure(self):
+        lvm = self.devicetree.devicelibs.lvm
+        mpath = self.devicetree.devicelibs.mpath
+        saved = (lvm.lvm_report_refresh, lvm.lvm_report_reset,
+                 mpath.writeMultipathConf)
+        calls = []
+        lvm.lvm_report_refresh = lambda: calls.append("refresh")
+        lvm.lvm_report_reset = lambda: calls.append("reset")
+        mpath.writeMultipathConf = lambda *args, **kwargs: None
+        try:
+            tree = self.devicetree.DeviceTree()
+            def scan(progressWindow=None):
+                raise RuntimeError("scan failed")
+            tree._scanDevices = scan
+
+            # the lvm report does not outlive a failed scan
+            self.assertRaises(RuntimeError, tree.populate)
+            self.assertEqual(calls, ["refresh", "reset"])
+        finally:
+            (lvm.lvm_report_refresh, lvm.lvm_report_reset,
+             mpath.writeMultipathConf) = saved
+
+    def testLostEvents(self):
+        tree = self._tree()
+        sda = "/devices/pci0000:00/host0/block/sda"
+        self._udev("sda", sda)
+        self.events = [("add", sda)]
+        self.assertTrue(tree.refresh())
+
+        # when uevents were lost, refresh leaves it to a full rescan
+        self.events = None
+        self.assertFalse(tree.refresh())
+        self.assertEqual(tree._monitor, None)
+        self.assertFalse(tree.refresh())
+
+    def testRefreshSharedVG(self):
+        from storage.devices import StorageDevice
+        tree = self._tree()
+        sda = "/devices/pci0000:00/host0/block/sda"
+        sdb = "/devices/pci0000:00/host1/block/sdb"
+        self._udev("sda", sda)
+        self._udev("sda1", sda + "/sda1", parent=sda)
+        self._udev("sdb", sdb)
+        self._udev("sdb1", sdb + "/sdb1", parent=sdb)
+        self.events = [("add", sda), ("add", sda + "/sda1"),
+                       ("add", sdb), ("add", sdb + "/sdb1")]
+        self.assertTrue(tree.refresh())
+
+        pvs = [tree.getDeviceByName("sda1"), tree.getDeviceByName("sdb1")]
+        vg = StorageDevice("vg", parents=pvs)
+        tree._addDevice(vg)
+        tree._addDevice(StorageDevice("lv", parents=[vg]))
+
+        # events on unchanged pvs leave the stack alone
+        self.probed = []
+        self.events = [("change", sda + "/sda1"), ("change", sdb + "/sdb1")]
+        self.assertTrue(tree.refresh())
+        self.assertEqual(self.probed, [])
+
+        # probing one pv again would bring the vg back without the other,
+        # so that is left to a full rescan
+        self._udev("sda1", sda + "/sda1", parent=sda, ID_FS_UUID="newuuid")
+        self.events = [("change", sda + "/sda1")]
+        self.assertFalse(tree.refresh())
+        self.assertEqual(self.probed, [])
+        self.assertEqual([d.name for d in tree.devices],
+                         ["sda", "sda1", "sdb", "sdb1", "vg", "lv"])
+
+class DeviceTreePruneTestCase(DeviceTreeTestCase):
+    """ Pruning of synthetic action queues. """
+
+    NUM_DEVICES = 2000
+
+    def _action(self, device, type, obj):
+        from storage.deviceaction import DeviceAction, RESIZE_GROW
+        action = DeviceAction.__new__(DeviceAction)
+        action.device = device
+        action.type = type
+        action.obj = obj
+        action.dir = RESIZE_GROW
+        return action
+
+    def _queue(self, devices):
+        from storage.deviceaction import ACTION_TYPE_CREATE, \
+                                         ACTION_TYPE_DESTROY, \
+                                         ACTION_TYPE_RESIZE, \
+                                         ACTION_OBJECT_DEVICE, \
+                                         ACTION_OBJECT_FORMAT
+        create = ACTION_TYPE_CREATE
+        destroy = ACTION_TYPE_DESTROY
+        resize = ACTION_TYPE_RESIZE
+        dev = ACTION_OBJECT_DEVICE
+        fmt = ACTION_OBJECT_FORMAT
+
+        # for each device: create it, format it, destroy it again, create
+        # it once more and resize its format twice
+        actions = []
+        for (type, obj) in [(create, dev), (create, fmt), (destroy, dev),
+                            (create, dev), (create, fmt), (resize, fmt),
+                            (resize, fmt)]:
+            for device in devices:
+                actions.append(self._action(device, type, obj))
+
+        # what is left is the second create, format and last resize
+        count = len(devices)
+        return (actions, actions[3 * count:5 * count] + actions[6 * count:])
+
+    def testPrune(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import StorageDevice
+        devices = [StorageDevice("sd%d" % i) for i in range(3)]
+        (actions, expected) = self._queue(devices)
+
+        tree = DeviceTree()
+        tree._setActions(actions)
+        tree.pruneActions()
+        self.assertEqual(tree.findActions(), expected)
+        self.assertEqual(tree.findActions(device=devices[1]),
+                         [a for a in expected if a.device == devices[1]])
+
+    def testPruneBenchmark(self):
+        from storage.devicetree import DeviceTree
+        from storage.devices import StorageDevice
+        devices = [StorageDevice("sd%d" % i) for i in range(self.NUM_DEVICES)]
+        (actions, expected) = self._queue(devices)
+
+        tree = DeviceTree()
+        tree._setActions(actions)
+        start = time.time()
+        tree.pruneActions()
+        self.logTime(start, "pruning %d actions" % len(actions))
+        self.assertEqual(tree.findActions(), expected)
+
+
+def suite():
+    suite1 = unittest.TestLoader().loadTestsFromTestCase(DeviceTreeLookupTestCase)
+    suite2 = unittest.TestLoader().loadTestsFromTestCase(DeviceTreeViewTestCase)
+    suite3 = unittest.TestLoader().loadTestsFromTestCase(DeviceDependencyTestCase)
+    suite4 = unittest.TestLoader().loadTestsFromTestCase(DeviceTreeRefreshTestCase)
+    suite5 = unittest.TestLoader().loadTestsFromTestCase(DeviceTreePruneTestCase)
+    return unittest.TestSuite([suite1, suite2, suite3, suite4, suite5])
@@ -0,0 +1,58 @@
+import mock
+import os
+import subprocess
+import tempfile
+import unittest
+
+class FSProbeTestCase(mock.TestCase):
+    """ Reading ext superblocks and caching probed sizes. """
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block', 'parted', '_ped'])
+        (fd, self.image) = tempfile.mkstemp()
+        os.ftruncate(fd, 16 * 1024 * 1024)
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.image)
+        self.tearDownModules()
+
+    def _mkfs(self, *args):
+        try:
+            rc = subprocess.call(["mke2fs", "-q", "-F"] + list(args) +
+                                 [self.image])
+        except OSError:
+            rc = 1
+        return rc == 0
+
+    def testSuperblock(self):
+        from storage.formats.fs import readExtSuperblock
+        self.assertEqual(readExtSuperblock(self.image), None)
+        if not self._mkfs("-b", "4096"):
+            return
+
+        sb = readExtSuperblock(self.image)
+        self.assertEqual(sb["blockSize"], 4096)
+        self.assertEqual(sb["blockCount"], 4096)
+        self.assertTrue(0 < sb["freeBlocks"] < sb["blockCount"])
+
+        # a new filesystem has a new generation
+        self._mkfs("-b", "4096")
+        self.assertNotEqual(readExtSuperblock(self.image)["generation"],
+                            sb["generation"])
+
+    def testCache(self):
+        from storage.formats.fs import getProbeCacheEntry, \
+                                       invalidateProbeCache
+        getProbeCacheEntry(self.image, 1)["size"] = 16
+        self.assertEqual(getProbeCacheEntry(self.image, 1)["size"], 16)
+        self.assertFalse("size" in getProbeCacheEntry(self.image, 2))
+
+        getProbeCacheEntry(self.image, 2)["size"] = 16
+        invalidateProbeCache(self.image)
+        self.assertFalse("size" in getProbeCacheEntry(self.image, 2))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(FSProbeTestCase)
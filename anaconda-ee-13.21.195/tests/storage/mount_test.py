@@ -0,0 +1,88 @@
+import mock
+import threading
+import time
+import unittest
+
+class FakeFormat(object):
+    def __init__(self, mountpoint):
+        self.mountpoint = mountpoint
+
+class MountSchedulingTestCase(mock.TestCase):
+    """ Ordering and grouping of FSSet.mountFilesystems. """
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block', 'parted', '_ped'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def _device(self, name, mountpoint=None, parents=None):
+        from storage.devices import StorageDevice
+        device = StorageDevice(name, parents=parents)
+        device._format = FakeFormat(mountpoint)
+        return device
+
+    def testDependencies(self):
+        from storage import _mountDependencies
+        mountpoints = ["/", "/boot", "/boot-old", "/boot-old/x", "/boot/efi",
+                       "/home", "/home", "/mnt", "/var"]
+        devices = [self._device("d%d" % i, mp)
+                   for (i, mp) in enumerate(mountpoints)]
+
+        deps = _mountDependencies(devices)
+        self.assertEqual(deps, [set(), set([0]), set([0]), set([2]),
+                                set([1]), set([0]), set([5]), set([0]),
+                                set([0])])
+
+        # a barrier waits for everything before it, and the rest for it
+        deps = _mountDependencies(devices, barriers=set([7]))
+        self.assertEqual(deps[7], set(range(7)))
+        self.assertEqual(deps[8], set([0, 7]))
+
+    def testSetupGroups(self):
+        from storage import _setupGroups
+        from storage.devices import DiskDevice
+        disks = [DiskDevice("sd%s" % c) for c in "abcd"]
+
+        # two luks devices on separate disks are independent, two lvs on
+        # the same vg are not
+        luks1 = self._device("luks1", "/home", parents=[disks[0]])
+        luks2 = self._device("luks2", "/srv", parents=[disks[1]])
+        vg = self._device("vg", parents=[disks[2], disks[3]])
+        root = self._device("root", "/", parents=[vg])
+        var = self._device("var", "/var", parents=[vg])
+
+        groups = _setupGroups([root, luks1, var, luks2])
+        self.assertEqual(sorted([[d.name for d in g] for g in groups]),
+                         [["luks1"], ["luks2"], ["root", "var"]])
+
+    def testSetupConcurrently(self):
+        from storage import setupDevicesConcurrently
+        running = []
+        maxRunning = []
+        lock = threading.Lock()
+
+        def setup():
+            lock.acquire()
+            running.append(1)
+            maxRunning.append(len(running))
+            lock.release()
+            time.sleep(0.1)
+            lock.acquire()
+            running.pop()
+            lock.release()
+
+        devices = [self._device("luks%d" % i) for i in range(4)]
+        for device in devices:
+            device.setup = setup
+        def fail():
+            raise Exception("no passphrase")
+        devices[2].setup = fail
+
+        failed = setupDevicesConcurrently(devices, maxJobs=4)
+        self.assertEqual(failed, [devices[2]])
+        self.assertEqual(max(maxRunning), 3)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(MountSchedulingTestCase)
@@ -0,0 +1,39 @@
+import mock
+import unittest
+
+class UdevTestCase(mock.TestCase):
+
+    def setUp(self):
+        self.setupModules(
+            ['_isys', 'logging', 'anaconda_log', 'block', 'pyudev'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def testLVMLists(self):
+        from storage import udev
+        info = {"LVM2_LV_NAME": "lv_root LVM2_LV_NAME=lv_swap",
+                "LVM2_LV_UUID": "Lv1Uuid",
+                "LVM2_LV_SIZE": "1024.00 LVM2_LV_SIZE=2048.00",
+                "LVM2_LV_ATTR": ""}
+        self.assertEqual(udev.udev_device_get_lv_names(info),
+                         ["lv_root", "lv_swap"])
+        self.assertEqual(udev.udev_device_get_lv_uuids(info), ["Lv1Uuid"])
+        self.assertEqual(udev.udev_device_get_lv_sizes(info), [1.0, 2.0])
+        self.assertEqual(udev.udev_device_get_lv_attr(info), [])
+
+        # the first lv's value is empty
+        info["LVM2_LV_NAME"] = "LVM2_LV_NAME=lv_swap"
+        self.assertEqual(udev.udev_device_get_lv_names(info), ["", "lv_swap"])
+
+    def testSymlinks(self):
+        from storage import udev
+        info = {"name": "sda",
+                "symlinks": ["/dev/disk/by-id/ata-disk",
+                             "/dev/disk/by-path/pci-0000:00:1f.2-scsi-0:0:0:0"]}
+        self.assertEqual(udev.udev_device_get_by_path(info),
+                         "/dev/disk/by-path/pci-0000:00:1f.2-scsi-0:0:0:0")
+        self.assertEqual(udev.udev_device_get_by_path({"name": "sdb"}), "sdb")
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(UdevTestCase)
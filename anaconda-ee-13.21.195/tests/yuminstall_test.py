@@ -0,0 +1,116 @@
+import mock
+import time
+import unittest
+
+class Package(object):
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.repoid = "updates"
+
+    def __repr__(self):
+        return self.name
+
+class Repo(object):
+    """ A repository whose downloads are recorded and can fail. """
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.fetched = []
+
+    def getPackage(self, po, checkfunc=None):
+        if po.name in self.failing:
+            raise IOError("cannot download %s" % po.name)
+        self.fetched.append(po)
+        return "/var/cache/yum/updates/packages/%s.rpm" % po.name
+
+class Repos(object):
+    def __init__(self, repo):
+        self.repo = repo
+
+    def getRepo(self, repoid):
+        return self.repo
+
+class YumBase(object):
+    def __init__(self, repo):
+        self.repos = Repos(repo)
+
+    def verifyPkg(self, fo, po, raiseError):
+        return True
+
+class PackagePrefetcherTestCase(mock.TestCase):
+    """ Downloading packages ahead of rpm. """
+
+    def setUp(self):
+        self.setupModules(['_isys', 'block', 'logging', 'rpm', 'rpmUtils',
+                           'yum', 'urlgrabber', 'iniparse', 'backend'])
+
+    def tearDown(self):
+        self.tearDownModules()
+
+    def _prefetcher(self, pkgs, failing=(), **kwargs):
+        from yuminstall import PackagePrefetcher
+        self.repo = Repo(failing=failing)
+        return PackagePrefetcher(YumBase(self.repo), pkgs, **kwargs)
+
+    def _settle(self, prefetcher):
+        """ Wait until the prefetcher is blocked or done. """
+        for i in range(100):
+            count = len(self.repo.fetched)
+            time.sleep(0.01)
+            if count == len(self.repo.fetched) and \
+               (prefetcher._done or count):
+                return
+        self.fail("prefetcher did not settle")
+
+    def testOrder(self):
+        pkgs = [Package("pkg%d" % i, 1024) for i in range(20)]
+        prefetcher = self._prefetcher(pkgs, maxPackages=4)
+        for po in pkgs:
+            self.assertEqual(prefetcher.get(po),
+                             "/var/cache/yum/updates/packages/%s.rpm" % po)
+            prefetcher.release(po)
+        prefetcher.stop()
+        self.assertEqual(self.repo.fetched, pkgs)
+        self.assertEqual(prefetcher.downloaded, 20 * 1024)
+
+        # packages that were not scheduled are left to the caller
+        self.assertEqual(prefetcher.get(Package("other", 1024)), None)
+
+    def testBudget(self):
+        pkgs = [Package("pkg%d" % i, 100) for i in range(6)]
+        prefetcher = self._prefetcher(pkgs, maxPackages=3, maxSize=250)
+
+        # two packages fit in the size budget
+        self._settle(prefetcher)
+        self.assertEqual(self.repo.fetched, pkgs[:2])
+
+        # installing one makes room for one more
+        prefetcher.get(pkgs[0])
+        self._settle(prefetcher)
+        self.assertEqual(self.repo.fetched, pkgs[:2])
+        prefetcher.release(pkgs[0])
+        self._settle(prefetcher)
+        self.assertEqual(self.repo.fetched, pkgs[:3])
+
+        # rpm asking for a package goes past the budget
+        prefetcher.get(pkgs[1])
+        prefetcher.get(pkgs[2])
+        self.assertTrue(prefetcher.get(pkgs[3]))
+        self.assertEqual(self.repo.fetched, pkgs[:4])
+
+        prefetcher.stop()
+        self.assertEqual(self.repo.fetched, pkgs[:4])
+
+    def testFailure(self):
+        pkgs = [Package("pkg%d" % i, 1024) for i in range(4)]
+        prefetcher = self._prefetcher(pkgs, failing=("pkg1",))
+        self.assertTrue(prefetcher.get(pkgs[0]))
+
+        # nothing after the failure is fetched
+        for po in pkgs[1:]:
+            self.assertEqual(prefetcher.get(po), None)
+        prefetcher.stop()
+        self.assertEqual(self.repo.fetched, pkgs[:1])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PackagePrefetcherTestCase)
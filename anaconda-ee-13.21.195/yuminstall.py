@@ -33,6 +33,7 @@ import glob
 import tempfile
 import itertools
 import re
+import threading
 
 
 import anaconda_log
@@ -55,6 +56,7 @@ from image import *
 from compssort import *
 import packages
 import iutil
+from repocache import openRepoMetadataCache
 
 import gettext
 _ = lambda x: gettext.ldgettext("anaconda", x)
@@ -93,6 +95,146 @@ def size_string (size):
 
     return to_unicode(retval)
 
+# how far ahead of rpm the package prefetcher may download, in packages and
+# in bytes of downloaded packages rpm has not installed yet
+PREFETCH_PACKAGES = 8
+PREFETCH_MAX_SIZE = 256 * 1024 * 1024
+
+class PackagePrefetcher:
+    """ Download packages from network repositories ahead of rpm.
+
+        A background thread fetches the packages in transaction order
+        into the yum cache while rpm installs the previous ones, so that
+        the network and the disk are busy at the same time.  It stays at
+        most PREFETCH_PACKAGES packages and PREFETCH_MAX_SIZE bytes ahead
+        of rpm.
+
+        urlgrabber shares a single curl handle in the process, so there
+        is only one downloading thread and nothing else may download
+        while it runs.  Any failure stops the prefetcher; get() then
+        returns None for the packages it did not fetch and the caller
+        downloads them itself, with the usual retry dialogs.
+    """
+    def __init__(self, ayum, pkgs, maxPackages=PREFETCH_PACKAGES,
+                 maxSize=PREFETCH_MAX_SIZE):
+        self.ayum = ayum
+        self.pkgs = pkgs
+        self._scheduled = set(pkgs)
+        self.maxPackages = maxPackages
+        self.maxSize = maxSize
+
+        self._cond = threading.Condition()
+        self._fetched = {}      # po -> path of the downloaded package
+        self._pending = {}      # po -> size, fetched and not installed yet
+        self._pendingSize = 0
+        self._wanted = None
+        self._done = False
+        self._stopped = False
+
+        self.downloaded = 0
+        self.fetchTime = 0.0
+        self.waitTime = 0.0
+        self._start = time.time()
+
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _mayFetch(self, po):
+        if not self._pending or self._wanted is not None:
+            return True
+        return len(self._pending) < self.maxPackages and \
+               self._pendingSize + po.size <= self.maxSize
+
+    def _worker(self):
+        try:
+            for po in self.pkgs:
+                self._cond.acquire()
+                try:
+                    while not self._stopped and not self._mayFetch(po):
+                        self._cond.wait()
+                    if self._stopped:
+                        return
+                finally:
+                    self._cond.release()
+
+                start = time.time()
+                try:
+                    repo = self.ayum.repos.getRepo(po.repoid)
+                    checkfunc = (self.ayum.verifyPkg, (po, 1), {})
+                    fn = repo.getPackage(po, checkfunc=checkfunc)
+                except Exception as e:
+                    log.warning("prefetching %s failed, downloading the rest "
+                                "of the packages on demand: %s" % (po, e))
+                    return
+                self.fetchTime += time.time() - start
+                self.downloaded += po.size
+
+                self._cond.acquire()
+                try:
+                    self._fetched[po] = fn
+                    self._pending[po] = po.size
+                    self._pendingSize += po.size
+                    if self._wanted is po:
+                        self._wanted = None
+                    self._cond.notifyAll()
+                finally:
+                    self._cond.release()
+        finally:
+            self._cond.acquire()
+            self._done = True
+            self._cond.notifyAll()
+            self._cond.release()
+
+    def get(self, po):
+        """ Return the path to the downloaded package po.
+
+            Wait for the prefetcher to get to po if it has not yet.  Return
+            None if it will not fetch po.
+        """
+        if po not in self._scheduled:
+            return None
+
+        start = time.time()
+        self._cond.acquire()
+        try:
+            # rpm wants a package we have not fetched yet: go past the
+            # limits rather than wait for a release that will not come
+            self._wanted = po
+            self._cond.notifyAll()
+            while po not in self._fetched and not self._done:
+                self._cond.wait()
+            if self._wanted is po:
+                self._wanted = None
+            self.waitTime += time.time() - start
+            return self._fetched.pop(po, None)
+        finally:
+            self._cond.release()
+
+    def release(self, po):
+        """ Tell the prefetcher rpm is done with po. """
+        self._cond.acquire()
+        try:
+            self._pendingSize -= self._pending.pop(po, 0)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """ Stop the prefetcher and wait for its download to finish. """
+        self._cond.acquire()
+        self._stopped = True
+        self._cond.notifyAll()
+        self._cond.release()
+        self._thread.join()
+
+        elapsed = time.time() - self._start
+        log.info("prefetched %d MB in %.1f s (%.1f MB/s), waited %.1f s of "
+                 "%.1f s for packages"
+                 % (self.downloaded / (1024 * 1024), self.fetchTime,
+                    self.downloaded / (1024 * 1024.0) / max(self.fetchTime, 0.001),
+                    self.waitTime, elapsed))
+
 class AnacondaCallback:
 
     def __init__(self, ayum, anaconda, instLog, modeText):
@@ -117,6 +259,7 @@ class AnacondaCallback:
 
         self.openfile = None
         self.inProgressPo = None
+        self.prefetcher = None
 
     def setSizes(self, numpkgs, totalSize, totalFiles):
         self.numpkgs = numpkgs
@@ -173,6 +316,14 @@ class AnacondaCallback:
             self.instLog.flush()
             self.openfile = None
 
+            if self.prefetcher:
+                fn = self.prefetcher.get(po)
+                if fn:
+                    try:
+                        self.openfile = open(fn, 'r')
+                    except IOError as e:
+                        log.warning("unable to open prefetched %s: %s" % (fn, e))
+
             trynumber = 0
             while self.openfile is None:
                 trynumber += 1
@@ -222,6 +373,9 @@ class AnacondaCallback:
                 except OSError as e:
                     log.debug("unable to remove file %s" %(e.strerror,))
 
+            if self.prefetcher:
+                self.prefetcher.release(self.inProgressPo)
+
             self.donepkgs += 1
             self.doneSize += self.inProgressPo.returnSimple("installedsize") / 1024.0
             self.doneFiles += len(hdr[rpm.RPMTAG_BASENAMES])
@@ -1027,22 +1181,38 @@ class AnacondaYum(YumSorter):
             return
 
         delay = 0.25*(2**(obj.tries-1))
-        if delay > 1:
+        # the package prefetcher downloads from its own thread, which must
+        # not touch the UI
+        if delay > 1 and \
+           threading.currentThread().getName() == "MainThread":
             w = self.anaconda.intf.waitWindow(_("Retrying"), _("Retrying download."))
             time.sleep(delay)
             w.pop()
         else:
             time.sleep(delay)
 
-    def getDownloadPkgs(self):
+    def getDownloadPkgs(self, countFiles=False):
+        """ Return the packages to install, their installed size in KB
+            and the number of files in them.
+
+            The package list and size come from the primary metadata.
+            Counting the files needs the filelists of every package in the
+            transaction, which is slow and takes a lot of memory, so it is
+            only done when countFiles is True; otherwise the number of
+            files is None. AnacondaCallback counts the files of each
+            package from its header once the package is installed.
+        """
         downloadpkgs = []
         totalSize = 0
-        totalFiles = 0
+        totalFiles = None
+        if countFiles:
+            totalFiles = 0
         for txmbr in self.tsInfo.getMembersWithState(output_states=TS_INSTALL_STATES):
             if txmbr.po:
                 totalSize += int(txmbr.po.returnSimple("installedsize")) / 1024
-                for filetype in txmbr.po.returnFileTypes():
-                    totalFiles += len(txmbr.po.returnFileEntries(ftype=filetype))
+                if countFiles:
+                    for filetype in txmbr.po.returnFileTypes():
+                        totalFiles += len(txmbr.po.returnFileEntries(ftype=filetype))
                 downloadpkgs.append(txmbr.po)
 
         return (downloadpkgs, totalSize, totalFiles)
@@ -1131,6 +1301,7 @@ class AnacondaYum(YumSorter):
         fileConflicts = []
         fileprob = ""
 
+        cb.prefetcher = self._startPrefetch()
         try:
             self.runTransaction(cb=cb)
         except YumBaseError, probs:
@@ -1197,6 +1368,39 @@ class AnacondaYum(YumSorter):
             else:
                 self._undoDepInstalls()
                 return DISPATCH_BACK
+        finally:
+            if cb.prefetcher:
+                cb.prefetcher.stop()
+                cb.prefetcher = None
+
+    def _startPrefetch(self):
+        """ Start prefetching the packages from network repositories.
+
+            Packages from local repositories are read in place by yum, so
+            there is nothing to gain for them.  Return None if there are
+            no packages to prefetch.
+        """
+        if self.currentMedia or flags.cmdline.has_key("noprefetch"):
+            return None
+
+        pkgs = []
+        for te in self.ts.ts:
+            if te.Type() != rpm.TR_ADDED:
+                continue
+            epoch = te.E()
+            if epoch is not None:
+                epoch = str(epoch)
+            txmbrs = self.tsInfo.matchNaevr(te.N(), te.A(), epoch, te.V(),
+                                            te.R())
+            if txmbrs and txmbrs[0].po and \
+               self.repos.getRepo(txmbrs[0].po.repoid).needsNetwork():
+                pkgs.append(txmbrs[0].po)
+
+        if not pkgs:
+            return None
+
+        log.info("prefetching %d packages" % len(pkgs))
+        return PackagePrefetcher(self, pkgs)
 
     def doMacros(self):
         for (key, val) in self.macros.items():
@@ -1282,6 +1486,10 @@ class YumBackend(AnacondaBackend):
         AnacondaBackend.__init__(self, anaconda)
         self.supportsPackageSelection = True
 
+        self.repoCache = None
+        if flags.cmdline.get("repocache"):
+            self.repoCache = openRepoMetadataCache(flags.cmdline["repocache"])
+
         buf = """
 [main]
 installroot=%s
@@ -1351,6 +1559,11 @@ debuglevel=6
         self.doSackSetup(anaconda)
         self.doGroupSetup(anaconda)
 
+        if self.repoCache:
+            for repo in self.ayum.repos.listEnabled():
+                self.repoCache.store(repo)
+            self.repoCache.report()
+
         self.ayum.doMacros()
 
     def doGroupSetup(self, anaconda):
@@ -1392,10 +1605,19 @@ debuglevel=6
                           callback=RepoSetupPulseProgress(anaconda.intf))
 
     def doSackSetup(self, anaconda, thisrepo = None, fatalerrors = True):
-        self.__withFuncDo(anaconda, lambda r: self.ayum.doSackSetup(thisrepo=r.id),
+        self.__withFuncDo(anaconda, self._sackSetup,
                           thisrepo=thisrepo, fatalerrors=fatalerrors,
                           callback=SackSetupProgress(anaconda.intf))
 
+    def _sackSetup(self, repo):
+        if self.repoCache:
+            # fetch the repomd.xml so that the cache can tell whether it
+            # has the rest of the metadata
+            repo.repoXML
+            self.repoCache.restore(repo)
+
+        self.ayum.doSackSetup(thisrepo=repo.id)
+
     def __withFuncDo(self, anaconda, fn, thisrepo=None, fatalerrors=True,
                      callback=None):
         # Don't do this if we're being called as a dispatcher step (instead